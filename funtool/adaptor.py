@@ -2,11 +2,15 @@
 
 import collections
 import yaml
-import importlib
 import functools
+import itertools
 
+import funtool.state_collection
+import funtool.data_store
 import funtool.lib.config_parse
+import funtool.lib.lazy_import
 import funtool.lib.general
+import funtool.progress
 
 
 Adaptor = collections.namedtuple('Adaptor',['adaptor_module','adaptor_function','parameters'])
@@ -21,9 +25,70 @@ class AdaptorError(Exception):
     pass
 
 def adaptor_process(adaptor): #returns a function, that accepts a state_collection, to be used as a process
-    adaptor_module = importlib.import_module(adaptor.adaptor_module)
-    return functools.partial( getattr(adaptor_module,adaptor.adaptor_function), adaptor )
+    adaptor_function= funtool.lib.lazy_import.LazyFunction(adaptor.adaptor_module, adaptor.adaptor_function, adaptor)
+    if (adaptor.parameters or {}).get('data_store') in [None, False]:
+        return adaptor_function
+    return stored_data_adaptor(adaptor_function, adaptor.parameters['data_store'])
+
+def stored_data_adaptor(adaptor_function, data_store_option):
+    """
+    Returns an adaptor process which moves the data of each state returned by adaptor_function to a DataStore 
+    ( see funtool.data_store ), so state data is only decoded when a field is used
+
+    Used for adaptors with the data_store parameter, either true for a temporary store or the path of the store file
+        For example (as YAML):
+            parameters:
+                data_store: ./cache/saves.store
+    A store path is needed to resume from checkpoints, since snapshots refer to the records in the store.
+    """
+    def wrapped_function(state_collection, overriding_parameters=None, loggers=None):
+        data_store= funtool.data_store.open_data_store(None if data_store_option is True else data_store_option)
+        state_collection= adaptor_function(state_collection, overriding_parameters, loggers)
+        if funtool.state_collection.is_stream(state_collection):
+            return funtool.state_collection.map_stream(state_collection, 
+                lambda batch: funtool.data_store.store_state_data(batch, data_store))
+        return funtool.data_store.store_state_data(state_collection, data_store)
+    return wrapped_function
     
 import_config= functools.partial(funtool.lib.config_parse.import_config, Adaptor, adaptor_process)
 
 get_adaptor_parameters= funtool.lib.general.get_parameters
+
+
+def streaming_adaptor(adaptor_function):
+    """
+    Decorator for adaptors which yield states one at a time instead of returning a StateCollection
+    
+    The adaptor_function is a generator taking the adaptor and its parameters. The states are grouped into 
+    batches and returned as a StateCollectionStream, so the full dataset never has to be held in memory.
+
+    Adaptor parameters used by the stream:
+        batch_size          the number of states in each batch (default 10000)
+        retain_states       when true the states are kept once the stream is drained (default false)
+        expected_states     the number of states the adaptor should yield, used to report the percentage read and ETA (optional)
+
+    Any states already in the incoming StateCollection are passed on as the first batch
+
+    Progress is reported as each batch is read ( see funtool.progress )
+    """
+    def wrapped_function(adaptor, state_collection, overriding_parameters=None, loggers=None):
+        adaptor_parameters= get_adaptor_parameters(adaptor, overriding_parameters)
+        batch_size= adaptor_parameters.get('batch_size') or 10000
+        progress= funtool.progress.start_progress(loggers, adaptor_parameters.get('expected_states'))
+        batches= _batch_states(adaptor_function(adaptor, adaptor_parameters), batch_size, progress)
+        if state_collection != None and len(state_collection.states) > 0:
+            batches= itertools.chain([state_collection], batches)
+        return funtool.state_collection.StateCollectionStream(batches, bool(adaptor_parameters.get('retain_states')))
+    return wrapped_function
+
+def _batch_states(states, batch_size, progress=None):
+    states= iter(states)
+    while True:
+        batch= list(itertools.islice(states, batch_size))
+        if len(batch) == 0:
+            if progress != None:
+                funtool.progress.finish_progress(progress)
+            return
+        if progress != None:
+            funtool.progress.advance_progress(progress, len(batch))
+        yield funtool.state_collection.StateCollection(batch,{})
@@ -9,20 +9,46 @@ import uuid
 import logging
 import datetime
 import os
-import pkg_resources
-import pip
-import pip.vcs
-import subprocess
+import threading
 
 import funtool.state_collection
 import funtool.logger
+import funtool.incremental
+import funtool.snapshot
+import funtool.analysis_plan
+import funtool.analysis_profile
+import funtool.progress
+import funtool.reporter
+import funtool.lib.config_parse
+import funtool.lib.general
+import funtool.provenance
 
 
-Analysis = collections.namedtuple('Analysis',['name','process_identifiers','processes'])
+Analysis = collections.namedtuple('Analysis',['name','process_identifiers','processes','options'])
+Analysis.__new__.__defaults__= (None,)
+
+# options is a dict of any other keys given with the analysis in the analysis config, for example:
+#   - my_analysis:
+#       - adaptor: load_saves
+#     profile: sampling
+#
+# profile               profiles each step which doesn't set its own profile option ( see funtool.analysis_profile )
 
 # ProcessIdentifiers are defined in the analysis config, Processes are created internally
 
-ProcessIdentifier = collections.namedtuple('ProcessIdentifier', ['process_type','process_name'])
+ProcessIdentifier = collections.namedtuple('ProcessIdentifier', ['process_type','process_name','options'])
+ProcessIdentifier.__new__.__defaults__= (None,)
+
+# options is a dict of any other keys given with the process in the analysis config, for example:
+#   - my_analysis:
+#       - adaptor: load_saves
+#       - state_measure: slow_measure
+#         checkpoint_after: true
+#
+# checkpoint_after      saves a checkpoint of the StateCollection after the step, so run_analysis can resume from it
+# profile               runs the step under cProfile or a sampling profiler ( see funtool.analysis_profile )
+
+default_log_dir= os.path.join('.','logs') # used by nested analyses run without the loggers of a parent analysis
 
 # for a process, the collection is the particular namedtuple used to generate the process_fuction
 Process= collections.namedtuple('Process',['collection','process_function'])
@@ -41,44 +67,131 @@ AnalysisCollection = collections.namedtuple('AnalysisCollection',['state','group
 
 def import_config(config_file_location):
     new_analyses=[]
-    with open(config_file_location) as f:
-        yaml_config= yaml.load(f)
+    yaml_config= funtool.lib.config_parse.load_yaml(config_file_location)
     for individual_analysis in yaml_config:
-        analysis_name, analysis_parameters = next(iter(individual_analysis.items()))
-        new_analyses.append( Analysis(analysis_name, load_process_identifiers(analysis_parameters), []) )
+        analysis_items= list(individual_analysis.items())
+        analysis_name, analysis_parameters = analysis_items[0]
+        new_analyses.append( Analysis(analysis_name, load_process_identifiers(analysis_parameters), [], dict(analysis_items[1:])) )
     return new_analyses
 
 def load_process_identifiers(analysis_parameters):
     return [ ProcessIdentifier(*_expand_process_identifiers(process_parameters)) for process_parameters in analysis_parameters ]        
 
 def load_processes(analysis,known_processes, known_analyses):
+    if len(analysis.processes) == len(analysis.process_identifiers) and len(analysis.processes) > 0: # already loaded, possibly as a sub-analysis
+        return analysis
     check_process_existence(analysis,known_processes,known_analyses)
     for process_id in analysis.process_identifiers:    
         if process_id.process_type == 'analysis':
             sub_analysis= load_processes(known_analyses[process_id.process_name], known_processes, known_analyses)
-            analysis.processes.append(analysis_process(sub_analysis) )              
+            analysis.processes.append(Process(sub_analysis, analysis_process(sub_analysis)) )              
         else:
             analysis.processes.append(known_processes[process_id.process_type][process_id.process_name])
     return analysis 
 
 def analysis_process(analysis): # returns a function which takes and returns a StateCollection and runs an analysis
-    return functools.partial(run_analysis, analysis)
+    def run_sub_analysis(state_collection, overriding_parameters=None, loggers=None):
+        log_dir= getattr(loggers, 'log_dir', None) or default_log_dir
+        log_level= loggers.analysis_logger.level if loggers != None else logging.INFO
+        return run_analysis(analysis, state_collection, log_dir, log_level)
+    return run_sub_analysis
+
+def run_analysis(analysis,state_collection=None,log_dir=None,log_level=logging.INFO,incremental_dir=None,resume=False,checkpoint_dir=None,plan=None,trace_memory=False,
+        progress_file=None,progress_writers=None,measure_latency=False):
+    """
+    Runs each process of the analysis in order, passing the StateCollection from one process to the next
+
+    With an incremental_dir, the final StateCollection is saved there and used by the next run to only measure 
+    new or changed states ( see funtool.incremental for details )
+
+    Steps with the checkpoint_after option save a checkpoint to checkpoint_dir ( log_dir/checkpoints by default ).
+    With resume, the analysis restarts after the last checkpoint saved by an unfinished run. Checkpoints are 
+    removed once the analysis completes.
+
+    With a plan ( see funtool.analysis_plan ), the steps run by stage, steps in the same stage run concurrently and 
+    groupings are dropped once no later step uses them. Consecutive reporters share a stage, so they write concurrently.
+    Without a plan every step, including each reporter, runs on its own in order.
+    Reporters' calls to funtool.reporter.link_latest_output are deferred until their stage completes.
+
+    The time and memory used by each step are written to profile.json and profile.csv next to analysis.log 
+    ( see funtool.analysis_profile ). With trace_memory, python allocations are traced as well, and with measure_latency 
+    the time taken by each state ( or group ) measured. Steps with a profile option also save a cProfile or sampled 
+    stack profile there.
 
-def run_analysis(analysis,state_collection=None,log_dir=None,log_level=logging.INFO):
+    Measures and streaming adaptors report their progress, rate, and ETA to the status log ( see funtool.progress ). 
+    With progress_file ( or a progress_file option in the analysis config ) the latest progress of each step is also kept 
+    as JSON, in progress.json next to analysis.log when progress_file is true, or at the given path. Any progress_writers 
+    are called with each update as well.
+    """
     analysis_start_time= _analysis_time_str() 
     loggers= _load_loggers(analysis, analysis_start_time, log_dir, log_level)
     overriding_parameters={ 'analysis_start_time':analysis_start_time }
     loggers.analysis_logger.warning('Analysis Overriding Parameters: %s'% overriding_parameters)
+    finish_provenance= _log_provenance(loggers)
+    analysis_profile= funtool.analysis_profile.start_profile(analysis.name, funtool.logger.log_directory(log_dir, analysis_start_time, analysis.name), trace_memory, measure_latency)
     if state_collection == None :
         state_collection = funtool.state_collection.StateCollection([],{})        
-    for idx,process in enumerate(analysis.processes):
-        _log_analysis_step(loggers,idx+1, analysis.process_identifiers[idx].process_type, analysis.process_identifiers[idx].process_name)
-        new_state_collection= process.process_function(state_collection,overriding_parameters,loggers)
-        state_collection= _test_and_update_state_collection(new_state_collection,state_collection,loggers)
+    if checkpoint_dir == None:
+        checkpoint_dir= os.path.join(log_dir,'checkpoints')
+    incremental_run= None
+    if incremental_dir != None:
+        incremental_run= funtool.incremental.start_incremental_run(analysis, incremental_dir)
+        loggers.analysis_logger.warning('Incremental Run, Previous Snapshot Used: %s'% funtool.incremental.has_previous_run(incremental_run))
+    completed_step_indices= set()
+    if resume:
+        completed_step_indices, state_collection= _resume_from_checkpoint(analysis, checkpoint_dir, state_collection, incremental_run, loggers)
+    else:
+        funtool.snapshot.clear_checkpoints(checkpoint_dir, analysis.name)
+    if plan == None:
+        stages= [ [idx] for idx in range(len(analysis.processes)) ]
+    else:
+        loggers.analysis_logger.warning(funtool.analysis_plan.format_plan(plan))
+        stages= plan.stages
+    progress_writers= _progress_writers(analysis, analysis_profile.log_dir, loggers, progress_file, progress_writers)
+    output_dirs= set()
+    def run_step(idx, state_collection):
+        process_identifier= analysis.process_identifiers[idx]
+        progress_context= funtool.progress.ProgressContext(analysis.name, idx+1, process_identifier.process_type, process_identifier.process_name, progress_writers)
+        step_function= lambda: funtool.progress.run_in_context(progress_context, lambda: funtool.reporter.defer_output_links(output_dirs, 
+            lambda: _run_step(analysis, idx, state_collection, overriding_parameters, loggers, incremental_run)))
+        profiler_options= _step_profiler_options(analysis, process_identifier)
+        if profiler_options != None:
+            step_function= functools.partial(_profile_step, analysis_profile, idx, process_identifier, profiler_options, step_function, loggers)
+        return funtool.analysis_profile.profile_step(analysis_profile, idx+1, analysis.process_identifiers[idx].process_type, 
+            analysis.process_identifiers[idx].process_name, step_function)
+    for stage_number, stage in enumerate(stages):
+        stage= [ idx for idx in stage if idx not in completed_step_indices ]
+        if len(stage) > 1 and not funtool.state_collection.is_stream(state_collection):
+            state_collection= funtool.analysis_plan.run_stage(plan, stage, state_collection, run_step)
+        else:
+            for idx in stage:
+                state_collection= run_step(idx, state_collection)
+        funtool.reporter.link_deferred_outputs(output_dirs)
+        completed_step_indices.update(stage)
+        if plan != None and not funtool.state_collection.is_stream(state_collection):
+            state_collection= funtool.analysis_plan.drop_unused_groupings(plan, stage_number, state_collection)
+        if any( _process_option(analysis.process_identifiers[idx], 'checkpoint_after') for idx in stage ):
+            state_collection= _save_checkpoint(analysis, checkpoint_dir, completed_step_indices, state_collection, incremental_run, loggers)
+    if funtool.state_collection.is_stream(state_collection):
+        state_collection= funtool.state_collection.drain_stream(state_collection)
+    if incremental_run != None:
+        funtool.incremental.save_incremental_run(incremental_run, state_collection)
+    funtool.snapshot.clear_checkpoints(checkpoint_dir, analysis.name)
+    funtool.lib.general.invalidate_sorted_states() # releases the cached states lists
+    funtool.analysis_profile.finish_profile(analysis_profile)
+    finish_provenance()
     _link_latest_logs(log_dir)
     _log_analysis_complete(loggers)
+    funtool.logger.close_loggers(loggers)
     return state_collection
 
+def is_streamable(process):
+    """
+    Returns true if the process can accept a StateCollectionStream ( see state_collection.StateCollectionStream )
+    """
+    process_function= process.process_function
+    return getattr(process_function, 'streamable', False) or getattr(getattr(process_function, 'func', None), 'streamable', False)
+
 
 # TODO needs to be made recursive for measures, etc...
 def check_process_existence(analysis,known_processes, known_analyses):
@@ -105,48 +218,32 @@ def _load_loggers(analysis,analysis_start_time, log_dir,log_level):
     analysis_uuid= uuid.uuid4()
     loggers= funtool.logger.load_loggers(log_dir, analysis_start_time, analysis.name, analysis_uuid,log_level)
     _log_analysis_start(loggers, analysis, analysis_start_time)
-    _log_module_versions(loggers)
-    _log_version_control(loggers)
+    funtool.provenance.start_version_control()
     return loggers
 
+def _log_provenance(loggers):
+    """
+    Logs the module versions, and the version control status once it is collected ( see funtool.provenance )
+
+    Returns a function which waits for the version control status to be logged, called when the analysis completes
+    """
+    funtool.provenance.log_module_versions(loggers, funtool.provenance.get_module_versions())
+    version_control_future= funtool.provenance.start_version_control()
+    logged_lock= threading.Lock()
+    logged= []
+    def log_version_control(future):
+        with logged_lock:
+            if len(logged) == 0:
+                logged.append(True)
+                funtool.provenance.log_version_control(loggers, future.result())
+    version_control_future.add_done_callback(log_version_control)
+    return functools.partial(log_version_control, version_control_future)
+
 def _log_analysis_start(loggers,analysis, analysis_start_time):
     loggers.analysis_logger.warning('Analysis Name: %s'% analysis.name )
     loggers.analysis_logger.warning('Analysis Start Time: %s'% analysis_start_time) 
     return loggers
 
-def _log_module_versions(loggers):
-    for package in pip.get_installed_distributions():
-        if 'funtool' in package.project_name:
-            if pip.vcs.vcs.get_backend_name(package.location):
-                revision= pip.vcs.vcs.get_backend_from_location(package.location)().get_revision(package.location)
-                refs= pip.vcs.vcs.get_backend_from_location(package.location)().get_refs(package.location)
-                branch= next((ref for (ref,commit) in refs.items() if commit==revision), '')
-                loggers.analysis_logger.warning('%s Version: %s Branch %s Commit: %s'% (package.project_name, package.version, branch, revision))
-            else:
-                loggers.analysis_logger.warning('%s Version: %s'% (package.project_name, package.version))
-        else:
-            loggers.analysis_logger.info('%s Version: %s'% (package.project_name, package.version))
-    return loggers
-
-def _log_version_control(loggers): #git only for now
-    try:
-        git_branch = subprocess.check_output(['git', 'rev-parse','--abbrev-ref','HEAD']).decode('utf8').rstrip()
-        loggers.analysis_logger.warning('Analysis Git Branch: %s'% git_branch)
-        commit_hash= subprocess.check_output(['git', 'rev-parse', 'HEAD']).decode('utf8').rstrip()
-        loggers.analysis_logger.warning('Analysis Git Commit: %s'% commit_hash)
-        git_status = subprocess.check_output(['git','status','--porcelain']).decode('utf8')
-        if len(git_status) is 0:
-            loggers.analysis_logger.warning('Analysis Git Status: Clean')
-        else:
-            loggers.analysis_logger.warning('Analysis Git Status: Dirty')
-            for status_line in git_status.split("\n"):
-                loggers.analysis_logger.warning("\t"+status_line)
-            
-    except Exception:
-        pass
-    return loggers
-
-
 def _log_analysis_step(loggers,step_number, process_type, process_name):
     loggers.analysis_logger.warning("\tRunning step "+ str(step_number) + " : " + process_type + ":" + process_name )
     loggers.status_logger.warning(_analysis_time_str() + " : Step "+ str(step_number) + " : " + process_type + ":" + process_name )
@@ -175,8 +272,90 @@ def _link_latest_logs(log_dir):
         print('OSError:',str(e))
         succeed= False
     return succeed
+def _run_step(analysis, idx, state_collection, overriding_parameters, loggers, incremental_run):
+    process= analysis.processes[idx]
+    process_type= analysis.process_identifiers[idx].process_type
+    _log_analysis_step(loggers,idx+1, process_type, analysis.process_identifiers[idx].process_name)
+    if funtool.state_collection.is_stream(state_collection) and not is_streamable(process):
+        loggers.analysis_logger.warning("\tCollecting streamed states for a process which needs the full StateCollection")
+        state_collection= funtool.state_collection.collect_stream(state_collection)
+    new_state_collection= _run_process(process, process_type, state_collection, overriding_parameters, loggers, incremental_run)
+    state_collection= _test_and_update_state_collection(new_state_collection,state_collection,loggers)
+    if process_type not in funtool.analysis_plan.measure_process_types + [ 'reporter' ]: # measures invalidate the keys they write
+        funtool.lib.general.invalidate_sorted_states()
+    if incremental_run != None and process_type == 'adaptor':
+        if funtool.state_collection.is_stream(state_collection):
+            loggers.analysis_logger.warning("\tCollecting streamed states, incremental runs compare the full StateCollection with the previous run")
+            state_collection= funtool.state_collection.collect_stream(state_collection)
+        state_collection= funtool.incremental.merge_previous_states(incremental_run, state_collection)
+        loggers.analysis_logger.warning("\tNew or changed states: %s of %s"% (len(incremental_run.changed_state_ids), len(state_collection.states)))
+    return state_collection
+
+def _step_profiler_options(analysis, process_identifier):
+    profile_option= _process_option(process_identifier, 'profile')
+    if profile_option is None:
+        profile_option= (analysis.options or {}).get('profile')
+    return funtool.analysis_profile.profiler_options(profile_option)
+
+def _progress_writers(analysis, analysis_log_dir, loggers, progress_file, progress_writers):
+    writers= [ funtool.progress.status_log_writer(loggers.status_logger) ]
+    if progress_file is None:
+        progress_file= (analysis.options or {}).get('progress_file')
+    if progress_file is True:
+        progress_file= os.path.join(analysis_log_dir, funtool.progress.progress_file_name)
+    if progress_file not in [ None, False ]:
+        writers.append(funtool.progress.progress_file_writer(progress_file))
+    return writers + list(progress_writers or [])
+
+def _profile_step(analysis_profile, idx, process_identifier, profiler_options, step_function, loggers):
+    file_name= 'step_%04d_%s_%s'% (idx+1, process_identifier.process_type, process_identifier.process_name)
+    state_collection, profile_path= funtool.analysis_profile.profiled_call(profiler_options, analysis_profile.log_dir, file_name, step_function)
+    if profile_path is None:
+        loggers.analysis_logger.warning("\tNot profiled on its own, the step ran inside another cProfiled step")
+    else:
+        loggers.analysis_logger.warning("\tSaved %s profile: %s"% (profiler_options['type'], profile_path))
+    return state_collection
+
+def _save_checkpoint(analysis, checkpoint_dir, completed_step_indices, state_collection, incremental_run, loggers):
+    if funtool.state_collection.is_stream(state_collection):
+        loggers.analysis_logger.warning("\tCollecting streamed states to save a checkpoint")
+        state_collection= funtool.state_collection.collect_stream(state_collection)
+    extra= { 'completed_step_indices': sorted(completed_step_indices) }
+    if incremental_run != None:
+        extra['incremental']= { 'state_hashes': incremental_run.state_hashes, 'changed_state_ids': incremental_run.changed_state_ids }
+    checkpoint_path= funtool.snapshot.save_checkpoint(state_collection, checkpoint_dir, analysis.name, len(completed_step_indices), extra)
+    loggers.analysis_logger.warning("\tSaved checkpoint: %s"% checkpoint_path)
+    return state_collection
+
+def _resume_from_checkpoint(analysis, checkpoint_dir, state_collection, incremental_run, loggers):
+    completed_steps, checkpoint_path= funtool.snapshot.latest_checkpoint(checkpoint_dir, analysis.name)
+    if completed_steps == None:
+        loggers.analysis_logger.warning('No checkpoint found, running the full analysis')
+        return set(), state_collection
+    state_collection, extra= funtool.snapshot.load_snapshot(checkpoint_path)
+    completed_step_indices= set(extra.get('completed_step_indices', range(completed_steps)))
+    if incremental_run != None and extra.get('incremental') != None:
+        incremental_run.state_hashes.update(extra['incremental']['state_hashes'])
+        incremental_run.changed_state_ids.update(extra['incremental']['changed_state_ids'])
+    loggers.analysis_logger.warning('Resuming after %s completed steps from checkpoint: %s'% (completed_steps, checkpoint_path))
+    return completed_step_indices, state_collection
+
+def _run_process(process, process_type, state_collection, overriding_parameters, loggers, incremental_run=None):
+    if incremental_run != None and process_type in [ 'state_measure', 'group_measure' ]:
+        if not funtool.incremental.reuses_values(process.collection):
+            loggers.analysis_logger.warning("\tNot reusing previous values, the measure uses analysis_selectors or sort_by ( set incremental: reuse to reuse them )")
+            record_changed_values= funtool.incremental.record_changed_values(incremental_run, state_collection, process.collection)
+            return record_changed_values(process.process_function(state_collection,overriding_parameters,loggers))
+    if incremental_run != None and process_type == 'state_measure':
+        return process.process_function(state_collection,overriding_parameters,loggers,
+            reuse_state=funtool.incremental.reuse_state(incremental_run))
+    if incremental_run != None and process_type == 'group_measure':
+        return process.process_function(state_collection,overriding_parameters,loggers,
+            reuse_group=funtool.incremental.reuse_group(incremental_run))
+    return process.process_function(state_collection,overriding_parameters,loggers)
+
 def _test_and_update_state_collection(new_state_collection,old_state_collection,loggers):
-    if isinstance(new_state_collection, funtool.state_collection.StateCollection):
+    if isinstance(new_state_collection, (funtool.state_collection.StateCollection, funtool.state_collection.StateCollectionStream)):
         return new_state_collection
     else:
         loggers.analysis_logger.error("Error in process : StateCollection not returned")
@@ -184,5 +363,10 @@ def _test_and_update_state_collection(new_state_collection,old_state_collection,
         return old_state_collection
 
 def _expand_process_identifiers(process_parameters_dict):
-    return list(next(iter(process_parameters_dict.items())))
+    process_items= list(process_parameters_dict.items())
+    process_type, process_name= process_items[0]
+    return [ process_type, process_name, dict(process_items[1:]) ]
+
+def _process_option(process_identifier, option_name):
+    return (process_identifier.options or {}).get(option_name)
  
@@ -0,0 +1,232 @@
+# Compiles an analysis into a plan of stages, so independent measures can run concurrently
+
+import collections
+import concurrent.futures
+import os
+
+import funtool.state_collection
+import funtool.lib.general
+
+AnalysisPlan = collections.namedtuple('AnalysisPlan',['analysis','steps','stages','dropped_groupings','loaded_processes','workers'])
+
+# An AnalysisPlan is a dependency ordering of the steps of an analysis
+#
+# analysis              the analysis the plan was compiled from
+# steps                 a list of PlanSteps, one for each process in the analysis
+# stages                a list of lists of step indices. Steps in the same stage don't depend on each other and may run concurrently.
+#                           Each stage only depends on earlier stages.
+# dropped_groupings     a list with a list of grouping names for each stage, these groupings are no longer used after the stage
+# loaded_processes      the loaded processes, used to compute groupings before a stage runs
+# workers               the largest number of steps run at once
+
+PlanStep = collections.namedtuple('PlanStep',['index','process_identifier','reads','writes','groupings','barrier','dependencies'])
+
+# index                 the position of the step in the analysis
+# process_identifier    the ProcessIdentifier of the step
+# reads                 a frozenset of the keys ( in data, meta, or measures ) read by the step, or None if unknown ( any key )
+# writes                a frozenset of the keys written by the step
+# groupings             a frozenset of the groupings used by the step, or None if unknown ( any grouping )
+# barrier               true for steps which must run alone, with every earlier step complete ( adaptors, reporters, sub-analyses, ... ).
+#                           Reporters only read the StateCollection, so consecutive reporters run together.
+# dependencies          a list of the indices of the steps this step depends on
+#
+# What a measure reads must be declared in its parameters for the plan to run it concurrently with anything. Reads
+# aren't inferred, since the measure function may read any key. The keys used by its grouping selectors and sort_by are
+# added to the declared reads. A measure which doesn't declare reads is treated as reading every key, so it depends
+# on every earlier measure and every later measure depends on it: a plan of such measures runs one step at a time.
+# format_plan lists the measures without declared reads.
+#   For example (as YAML):
+#       parameters:
+#           reads:
+#               - measures: time_on_task
+#               - meta: user_id
+#           writes:                 (optional: defaults to the measure name)
+#               - time_on_task_rank
+#           uses_groupings:         (optional: groupings used besides grouping_selectors and sort_by)
+#               - user_id
+#
+# Reporters and other steps may declare uses_groupings, otherwise they are treated as using every grouping.
+# A grouping is dropped from the StateCollection ( and its states ) after the last stage which uses it.
+
+measure_process_types= [ 'state_measure', 'group_measure' ]
+
+
+class AnalysisPlanError(Exception):
+    pass
+
+def compile_plan(analysis, loaded_processes, workers=None):
+    """
+    Returns an AnalysisPlan for an analysis with loaded processes ( see funtool.analysis.load_processes )
+    """
+    if len(analysis.processes) != len(analysis.process_identifiers):
+        raise AnalysisPlanError("Processes are not loaded for analysis " + str(analysis.name))
+    steps= []
+    for index, (process_identifier, process) in enumerate(zip(analysis.process_identifiers, analysis.processes)):
+        reads, writes, groupings, barrier= _step_access(process_identifier, process, loaded_processes)
+        dependencies= [ earlier_step.index for earlier_step in steps
+            if not _independent_reporters(earlier_step, process_identifier) 
+            and (barrier or earlier_step.barrier or _conflicts(earlier_step, reads, writes)) ]
+        steps.append( PlanStep(index, process_identifier, reads, writes, groupings, barrier, dependencies) )
+    stages= _stages(steps)
+    return AnalysisPlan(analysis, steps, stages, _dropped_groupings(steps, stages), loaded_processes, workers or os.cpu_count() or 1)
+
+def format_plan(plan):
+    """
+    Returns a printable description of the plan
+    """
+    lines= [ 'Analysis Plan: %s'% plan.analysis.name ]
+    for stage_number, stage in enumerate(plan.stages):
+        lines.append('\tStage %s%s'% (stage_number + 1, ' (concurrent)' if len(stage) > 1 else ''))
+        for index in stage:
+            step= plan.steps[index]
+            lines.append('\t\tStep %s : %s:%s%s'% (index + 1, step.process_identifier.process_type, step.process_identifier.process_name, ' [barrier]' if step.barrier else ''))
+            if not step.barrier:
+                lines.append('\t\t\treads: %s writes: %s groupings: %s depends on: %s'% (
+                    _format_keys(step.reads), _format_keys(step.writes), _format_keys(step.groupings),
+                    ', '.join( str(dependency + 1) for dependency in step.dependencies ) or '-' ))
+        if len(plan.dropped_groupings[stage_number]) > 0:
+            lines.append('\t\tDrops groupings: %s'% ', '.join(plan.dropped_groupings[stage_number]))
+    undeclared= [ step.process_identifier.process_name for step in plan.steps if not step.barrier and step.reads is None ]
+    if len(undeclared) > 0:
+        lines.append('\tMeasures without declared reads ( run alone ): %s'% ', '.join( str(name) for name in undeclared ))
+    return '\n'.join(lines)
+
+def run_stage(plan, stage, state_collection, run_step):
+    """
+    Runs the steps of a stage concurrently with a thread pool, after computing the groupings they use
+
+    run_step is a function of ( step index, state_collection ) which runs a single step and returns the StateCollection
+
+    Steps in a stage must update the StateCollection they are given, an AnalysisPlanError is raised if any step 
+    returns a different StateCollection, since only one could be kept
+    """
+    for index in stage:
+        collection= plan.analysis.processes[index].collection
+        for grouping_name in (getattr(collection, 'grouping_selectors', None) or []):
+            state_collection= funtool.state_collection.add_grouping(state_collection, grouping_name, plan.loaded_processes)
+    with concurrent.futures.ThreadPoolExecutor(max_workers=min(plan.workers, len(stage))) as executor:
+        results= list(executor.map( lambda index: run_step(index, state_collection), stage ))
+    replaced= [ plan.steps[index].process_identifier for index, result in zip(stage, results) if result is not state_collection ]
+    if len(replaced) > 0:
+        raise AnalysisPlanError("Steps run concurrently returned a new StateCollection: " + 
+            ', '.join( '%s:%s'% (process_identifier.process_type, process_identifier.process_name) for process_identifier in replaced ))
+    return state_collection
+
+def drop_unused_groupings(plan, stage_number, state_collection):
+    """
+    Removes the groupings which aren't used after the given stage from the StateCollection and its states
+    """
+    for grouping_name in plan.dropped_groupings[stage_number]:
+        if grouping_name in state_collection.groupings:
+            del state_collection.groupings[grouping_name]
+            for state in state_collection.states:
+                state.groupings.pop(grouping_name, None)
+            funtool.lib.general.invalidate_sorted_states(grouping_name=grouping_name)
+    return state_collection
+
+def _step_access(process_identifier, process, loaded_processes):
+    """
+    Returns the reads, writes, groupings, and barrier of a step
+    """
+    collection= getattr(process, 'collection', None)
+    parameters= getattr(collection, 'parameters', None) or {}
+    declared_groupings= _declared_groupings(parameters)
+    if process_identifier.process_type not in measure_process_types:
+        return ( None, frozenset(), declared_groupings, True )
+    groupings= set(collection.grouping_selectors or [])
+    groupings.update(declared_groupings or [])
+    reads= _declared_keys(parameters.get('reads'))
+    if reads != None:
+        reads= set(reads)
+        for grouping_name in groupings:
+            grouping_reads= _grouping_selector_reads(grouping_name, loaded_processes)
+            if grouping_reads is None:
+                reads= None
+                break
+            reads.update(grouping_reads)
+    sort_fields= funtool.lib.general.compile_sort_list(parameters.get('sort_by') or [])
+    groupings.update( field[1] for inverted, field in sort_fields if field[0] == 'groupings' )
+    if reads != None:
+        reads.update( field[-1] for inverted, field in sort_fields )
+    return ( frozenset(reads) if reads != None else None, frozenset(declared_writes(collection)), frozenset(groupings), False )
+
+def declared_writes(measure):
+    """
+    Returns the keys written by a state or group measure: its declared writes, or its name
+    """
+    writes= _declared_keys((measure.parameters or {}).get('writes'))
+    if writes is None:
+        writes= [ measure.name ]
+    return writes
+
+def _declared_keys(declared): # reads and writes can be a list of keys, or a list of state field: field key pairs
+    if declared is None:
+        return None
+    keys= []
+    for declared_key in declared:
+        if hasattr(declared_key, 'items'):
+            for state_field, field_keys in declared_key.items():
+                keys.extend( field_keys if isinstance(field_keys, (list, tuple)) else [ field_keys ] )
+        else:
+            keys.append(declared_key)
+    return keys
+
+def _declared_groupings(parameters):
+    if parameters.get('uses_groupings') is None:
+        return None
+    return frozenset(parameters['uses_groupings'])
+
+def _grouping_selector_reads(grouping_name, loaded_processes):
+    grouping_selector= (loaded_processes or {}).get('grouping_selector', {}).get(grouping_name)
+    if grouping_selector is None:
+        return None
+    parameters= grouping_selector.collection.parameters or {}
+    if parameters.get('reads') != None:
+        return _declared_keys(parameters['reads'])
+    if grouping_selector.collection.selector_function == 'group_by_key' and parameters.get('group_by') != None:
+        group_by= parameters['group_by']
+        return _declared_keys( [ group_by ] if hasattr(group_by, 'items') else group_by )
+    return None
+
+def _independent_reporters(earlier_step, process_identifier):
+    return earlier_step.process_identifier.process_type == 'reporter' and process_identifier.process_type == 'reporter'
+
+def _conflicts(earlier_step, reads, writes):
+    if earlier_step.writes & writes:
+        return True
+    if (reads is None and earlier_step.writes) or (earlier_step.reads is None and writes):
+        return True
+    return bool( (reads or frozenset()) & earlier_step.writes or (earlier_step.reads or frozenset()) & writes )
+
+def _stages(steps):
+    levels= []
+    for step in steps:
+        levels.append( 1 + max([ levels[dependency] for dependency in step.dependencies ] or [ -1 ]) )
+    stages= [ [] for level in range(max(levels or [ -1 ]) + 1) ]
+    for step in steps:
+        stages[levels[step.index]].append(step.index)
+    return stages
+
+def _dropped_groupings(steps, stages):
+    """
+    Returns a list with the groupings to drop after each stage
+
+    A grouping is only dropped when every later step declares the groupings it uses
+    """
+    last_use= {}
+    for stage_number, stage in enumerate(stages):
+        for index in stage:
+            for grouping_name in (steps[index].groupings or []):
+                last_use[grouping_name]= stage_number
+    last_unknown_stage= max([ stage_number for stage_number, stage in enumerate(stages)
+        for index in stage if steps[index].groupings is None ] or [ -1 ])
+    dropped= [ [] for stage in stages ]
+    for grouping_name, stage_number in sorted(last_use.items()):
+        if stage_number >= last_unknown_stage:
+            dropped[stage_number].append(grouping_name)
+    return dropped
+
+def _format_keys(keys):
+    if keys is None:
+        return '*'
+    return ', '.join(sorted( str(key) for key in keys )) or '-'
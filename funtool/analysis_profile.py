@@ -0,0 +1,342 @@
+# Records the run time and memory use of each step of an analysis, and optionally profiles steps
+
+import collections
+import cProfile
+import csv
+import json
+import math
+import os
+import sys
+import threading
+import time
+import tracemalloc
+
+try:
+    import resource
+except ImportError: # resource is only available on unix, peak rss isn't recorded elsewhere
+    resource= None
+
+StepProfile = collections.namedtuple('StepProfile',['step','process_type','process_name','wall_time','cpu_time','peak_rss','rss_increase',
+    'traced_memory_increase','traced_memory_peak','state_count','measured_count','latency_p50','latency_p90','latency_p99','latency_max'])
+
+# A StepProfile holds the measurements for one step of an analysis
+#
+# step                      the step number ( starting at 1, as in the analysis log )
+# process_type              the type of the process run in the step
+# process_name              the name of the process run in the step
+# wall_time                 seconds from the start to the end of the step
+# cpu_time                  cpu seconds used by the analysis process during the step ( not including worker processes ).
+#                               Steps in the same stage of an AnalysisPlan run concurrently, so their cpu times overlap.
+# peak_rss                  the peak resident memory of the analysis process in bytes at the end of the step, or None without the resource module
+# rss_increase              how much the step raised peak_rss, in bytes
+# traced_memory_increase    the change in memory allocated by python during the step in bytes, or None unless memory is traced
+# traced_memory_peak        the peak memory allocated by python during the step, above the memory allocated at its start, or None
+#                               Memory is only measured for the whole process, so rss_increase and the traced memory fields
+#                               are None for a step which ran at the same time as another step ( in a stage of an AnalysisPlan ).
+# state_count               the number of states in the StateCollection after the step, or None for a StateCollectionStream
+# measured_count            the number of states ( or groups for a group measure ) timed during the step, or None unless
+#                               latencies are measured
+# latency_p50, latency_p90, latency_p99, latency_max
+#                           percentiles of the seconds taken to measure each state ( or group ), or None when nothing was timed.
+#                               Percentiles are read from a LatencyHistogram, so they are rounded up to its bucket bounds.
+#                               Batch measures record the average time per state.
+#
+# Profiles are written as profile.json and profile.csv next to analysis.log. profile.json is rewritten and a row is 
+# appended to profile.csv ( in the order the steps finished ) after each step, so an unfinished run still leaves a profile.
+#
+# Tracing memory with tracemalloc slows most analyses considerably, so it is only done when trace_memory is set.
+# Timing each state ( or group ) is only done when measure_latency is set.
+
+AnalysisProfile = collections.namedtuple('AnalysisProfile',['analysis_name','log_dir','trace_memory','step_profiles','lock','started_tracing','running_steps',
+    'measure_latency'])
+
+# analysis_name     the name of the profiled analysis
+# log_dir           the directory the profile files are written to
+# trace_memory      true to record traced_memory_increase and traced_memory_peak
+# step_profiles     a list of StepProfiles, in the order the steps finished
+# lock              guards step_profiles and the profile files when steps run concurrently
+# started_tracing   true if tracemalloc was started for this profile, so finish_profile stops it
+# running_steps     a dict of step: true if another step ran at the same time, for the steps currently running
+# measure_latency   true to time each state ( or group ) measured, for measured_count and the latency percentiles
+
+profile_file_names= { 'json':'profile.json', 'csv':'profile.csv' }
+
+_measure_latencies= threading.local()
+
+
+def start_profile(analysis_name, log_dir, trace_memory=False, measure_latency=False):
+    """
+    Returns an AnalysisProfile for an analysis, starting tracemalloc if memory is traced
+    """
+    started_tracing= trace_memory and not tracemalloc.is_tracing()
+    if started_tracing:
+        tracemalloc.start()
+    return AnalysisProfile(analysis_name, log_dir, trace_memory, [], threading.Lock(), started_tracing, {}, measure_latency)
+
+def finish_profile(analysis_profile):
+    """
+    Stops tracemalloc if it was started by start_profile
+    """
+    if analysis_profile.started_tracing:
+        tracemalloc.stop()
+    return analysis_profile
+
+def profile_step(analysis_profile, step, process_type, process_name, step_function):
+    """
+    Calls step_function, which runs one step and returns a StateCollection, and records a StepProfile for it
+
+    Returns the StateCollection returned by step_function
+    """
+    latencies= LatencyHistogram() if analysis_profile.measure_latency else None
+    previous_latencies= getattr(_measure_latencies, 'latencies', None)
+    _measure_latencies.latencies= latencies
+    with analysis_profile.lock:
+        concurrent= len(analysis_profile.running_steps) > 0
+        for running_step in analysis_profile.running_steps:
+            analysis_profile.running_steps[running_step]= True
+        analysis_profile.running_steps[step]= concurrent
+    start_rss= _peak_rss()
+    start_traced_memory= tracemalloc.get_traced_memory()[0] if analysis_profile.trace_memory else None
+    if analysis_profile.trace_memory:
+        tracemalloc.reset_peak()
+    start_cpu_time= time.process_time()
+    start_time= time.perf_counter()
+    try:
+        state_collection= step_function()
+    finally:
+        _measure_latencies.latencies= previous_latencies
+        with analysis_profile.lock:
+            concurrent= analysis_profile.running_steps.pop(step)
+    wall_time= time.perf_counter() - start_time
+    cpu_time= time.process_time() - start_cpu_time
+    traced_memory_increase= traced_memory_peak= None
+    if analysis_profile.trace_memory and not concurrent:
+        current_traced_memory, peak_traced_memory= tracemalloc.get_traced_memory()
+        traced_memory_increase= current_traced_memory - start_traced_memory
+        traced_memory_peak= max(0, peak_traced_memory - start_traced_memory)
+    peak_rss= _peak_rss()
+    percentiles= latency_percentiles(latencies)
+    step_profile= StepProfile(step, process_type, process_name, wall_time, cpu_time, peak_rss,
+        (peak_rss - start_rss) if peak_rss != None and not concurrent else None, traced_memory_increase, traced_memory_peak,
+        len(state_collection.states) if hasattr(state_collection, 'states') else None, 
+        len(latencies) if latencies != None else None, *percentiles)
+    with analysis_profile.lock:
+        analysis_profile.step_profiles.append(step_profile)
+        write_profile(analysis_profile)
+        append_profile_row(analysis_profile, step_profile)
+    return state_collection
+
+def current_latencies():
+    """
+    Returns the LatencyHistogram which per state ( or per group ) measure times should be appended to in this thread, 
+    or None when latencies aren't measured in the current step
+    """
+    return getattr(_measure_latencies, 'latencies', None)
+
+def timed_call(latencies, function, *args):
+    """
+    Calls function with args, appending the seconds it took to latencies unless latencies is None
+    """
+    if latencies is None:
+        return function(*args)
+    start_time= time.perf_counter()
+    try:
+        return function(*args)
+    finally:
+        latencies.append(time.perf_counter() - start_time)
+
+def timed_result(function, *args):
+    """
+    Calls function with args, returns its return value and the seconds it took
+
+    Used by workers which can't append to the LatencyHistogram of the step themselves
+    """
+    start_time= time.perf_counter()
+    result= function(*args)
+    return result, time.perf_counter() - start_time
+
+class LatencyHistogram(object):
+    """
+    Counts latencies in logarithmic buckets, so the memory used doesn't grow with the number of latencies
+
+    Each power of ten is split into buckets_per_decade buckets, a percentile is given as the upper bound of its bucket 
+    ( at most 12% above the latency ) or the maximum latency if that is lower. Not thread safe.
+    """
+    buckets_per_decade= 20
+
+    def __init__(self):
+        self.bucket_counts= collections.Counter()
+        self.count= 0
+        self.max= None
+
+    def append(self, latency, count=1):
+        """
+        Records count latencies of the given number of seconds
+        """
+        bucket= math.ceil(math.log10(latency) * self.buckets_per_decade) if latency > 0 else -math.inf
+        self.bucket_counts[bucket]+= count
+        self.count+= count
+        self.max= latency if self.max is None else max(self.max, latency)
+
+    def __len__(self):
+        return self.count
+
+    def percentile(self, percentile):
+        """
+        Returns the latency at the given percentile ( nearest rank ), or None if no latencies were recorded
+        """
+        if self.count == 0:
+            return None
+        rank= max(1, -(-percentile * self.count // 100))
+        counted= 0
+        for bucket in sorted(self.bucket_counts):
+            counted+= self.bucket_counts[bucket]
+            if counted >= rank:
+                return min(10 ** (bucket / self.buckets_per_decade), self.max)
+        return self.max
+
+def latency_percentiles(latencies, percentiles=(50, 90, 99)):
+    """
+    Returns the given percentiles and the maximum of a LatencyHistogram, or Nones if it is None or empty
+    """
+    if latencies is None or len(latencies) == 0:
+        return [ None for percentile in percentiles ] + [ None ]
+    return [ latencies.percentile(percentile) for percentile in percentiles ] + [ latencies.max ]
+
+def write_profile(analysis_profile):
+    """
+    Writes the profile of an analysis as JSON in its log directory
+    """
+    if not os.path.exists(analysis_profile.log_dir):
+        os.makedirs(analysis_profile.log_dir)
+    step_profiles= sorted(analysis_profile.step_profiles, key= lambda step_profile: step_profile.step)
+    with open(os.path.join(analysis_profile.log_dir, profile_file_names['json']), 'w') as f:
+        json.dump({ 'analysis_name': analysis_profile.analysis_name,
+            'trace_memory': analysis_profile.trace_memory,
+            'measure_latency': analysis_profile.measure_latency,
+            'steps': [ step_profile._asdict() for step_profile in step_profiles ] }, f, indent=2)
+    return analysis_profile
+
+def append_profile_row(analysis_profile, step_profile):
+    """
+    Appends a step profile to the CSV file in the log directory of the analysis, starting the file with a header
+    for the first step profile
+    """
+    if not os.path.exists(analysis_profile.log_dir):
+        os.makedirs(analysis_profile.log_dir)
+    first_row= len(analysis_profile.step_profiles) <= 1
+    with open(os.path.join(analysis_profile.log_dir, profile_file_names['csv']), 'w' if first_row else 'a', newline='') as f:
+        writer= csv.writer(f)
+        if first_row:
+            writer.writerow(StepProfile._fields)
+        writer.writerow(step_profile)
+    return analysis_profile
+
+def _peak_rss():
+    if resource is None:
+        return None
+    max_rss= resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return max_rss if sys.platform == 'darwin' else max_rss * 1024 # linux reports kilobytes, macOS reports bytes
+
+
+# A profile option runs a step under a profiler, given in the analysis config for the whole analysis or for one process:
+#   - my_analysis:
+#       - adaptor: load_saves
+#       - state_measure: slow_measure
+#         profile: cprofile
+#     profile: sampling                 (optional: profiles every step which doesn't set its own profile option)
+#
+# The option may be:
+#   cprofile ( or true )    profiles every call with cProfile and saves step_<number>_<process_type>_<process_name>.pstats
+#   sampling                samples the stack of the step every interval seconds and saves a .collapsed file ( one
+#                               line per stack with its sample count, as used by flamegraph tools )
+#   a dict                  with type ( cprofile or sampling ) and, for sampling, interval ( defaults to 0.005 )
+#   false                   to turn off an analysis wide profile option for a process
+#
+# Files are saved in the log directory of the analysis. Steps without a profile option aren't wrapped at all.
+
+profiler_types= [ 'cprofile', 'sampling' ]
+
+default_sampling_interval= 0.005
+
+
+class AnalysisProfileError(Exception):
+    pass
+
+def profiler_options(profile_option):
+    """
+    Returns a dict of profiler options ( with type and interval ) for a profile option, or None when profiling is off
+    """
+    if profile_option in [ None, False ]:
+        return None
+    if profile_option is True:
+        profile_option= 'cprofile'
+    if not hasattr(profile_option, 'items'):
+        profile_option= { 'type': profile_option }
+    options= { 'type': 'cprofile', 'interval': default_sampling_interval }
+    options.update(profile_option)
+    if options['type'] not in profiler_types:
+        raise AnalysisProfileError("Unknown profile type: " + str(options['type']) + " ( expected one of " + ', '.join(profiler_types) + " )")
+    return options
+
+def profiled_call(options, log_dir, file_name, function):
+    """
+    Calls function under the profiler given by options ( see profiler_options ), saving the results to log_dir
+
+    Returns the return value of function and the path of the saved profile. Calls profiled with cProfile run one at 
+    a time, so cProfiled steps in the same stage of an AnalysisPlan don't run concurrently. A cProfiled call made
+    while the same thread is already in one ( such as a step of a sub-analysis ) isn't profiled on its own, since it 
+    is part of the enclosing profile, and the returned path is None.
+    """
+    if not os.path.exists(log_dir):
+        os.makedirs(log_dir)
+    if options['type'] == 'cprofile':
+        return _cprofile_call(os.path.join(log_dir, file_name + '.pstats'), function)
+    return _sampling_call(os.path.join(log_dir, file_name + '.collapsed'), options['interval'], function)
+
+def _cprofile_call(profile_path, function):
+    if _cprofile_owner['thread'] == threading.get_ident(): # waiting for the lock would deadlock
+        return function(), None
+    with _cprofile_lock: # only one cProfile profiler can be active at a time ( since python 3.12 )
+        _cprofile_owner['thread']= threading.get_ident()
+        profiler= cProfile.Profile()
+        profiler.enable()
+        try:
+            result= function()
+        finally:
+            profiler.disable()
+            _cprofile_owner['thread']= None
+            profiler.dump_stats(profile_path)
+    return result, profile_path
+
+_cprofile_lock= threading.Lock()
+
+_cprofile_owner= { 'thread': None } # the ident of the thread holding _cprofile_lock
+
+def _sampling_call(profile_path, interval, function):
+    stack_counts= collections.Counter()
+    sampled_thread_id= threading.get_ident()
+    finished= threading.Event()
+    def sample():
+        while not finished.wait(interval):
+            frame= sys._current_frames().get(sampled_thread_id)
+            if frame != None:
+                stack_counts[_collapsed_stack(frame)]+= 1
+    sampler= threading.Thread(target=sample, name='funtool-profile-sampler', daemon=True)
+    sampler.start()
+    try:
+        result= function()
+    finally:
+        finished.set()
+        sampler.join()
+        with open(profile_path, 'w') as f:
+            for stack, count in stack_counts.most_common():
+                f.write('%s %s\n'% (stack, count))
+    return result, profile_path
+
+def _collapsed_stack(frame):
+    stack= []
+    while frame != None:
+        stack.append('%s:%s'% (os.path.basename(frame.f_code.co_filename), frame.f_code.co_name))
+        frame= frame.f_back
+    return ';'.join(reversed(stack))
@@ -1,10 +1,12 @@
 # Defines a state selector
 import collections
 import yaml
-import importlib
 import functools
 
+import funtool.analysis
 import funtool.lib.config_parse
+import funtool.lib.general
+import funtool.lib.lazy_import
 
 AnalysisSelector = collections.namedtuple('AnalysisSelector',['selector_module','selector_function','parameters'])
 
@@ -17,12 +19,225 @@ AnalysisSelector = collections.namedtuple('AnalysisSelector',['selector_module',
 # For example: One state selector may find all the states with the same user id as a given state
 #
 # Another example: A state selector to find the next state based on on time stamp
+#
+# Selectors are called with ( analysis_collection, state_collection ) for each state. Bulk selectors ( see bulk_analysis_selector )
+# are instead called once with the analysis_collections of every state being measured, so they can index the 
+# StateCollection once rather than scanning it for each state.
+#
+# Any selector can be memoized by adding a memoize_by parameter, a list of state field: field key pairs ( like sort_by ).
+#   The selector then runs once for each distinct key, and states with the same key get copies of its states_dict and 
+#   groupings ( the selected lists are shared, so shouldn't be changed ). Later selectors can set keys for each state.
+#   For example (as YAML):
+#       parameters:
+#           memoize_by:
+#               - meta: user_id
+#   This is only correct when the selection depends on nothing but the key and the StateCollection.
+#
+# Without bulk or memoized selectors, the selectors run for each state just before it is measured, so a selector sees
+# the measures already written to earlier states. With them, every state is selected before any is measured.
 
 
 #returns a function, that accepts a state_collection and returns an analysis_collection, to be used as a process
 def analysis_selector_process(analysis_selector): 
-    analysis_selector_module = importlib.import_module(analysis_selector.selector_module)
-    return functools.partial( getattr(analysis_selector_module,analysis_selector.selector_function), analysis_selector )
+    return funtool.lib.lazy_import.LazyFunction(analysis_selector.selector_module, analysis_selector.selector_function, analysis_selector)
 
 import_config= functools.partial(funtool.lib.config_parse.import_config, AnalysisSelector, analysis_selector_process)    
 
+
+
+def bulk_analysis_selector(selector_function):
+    """
+    Decorator for analysis selectors which select for many states at once
+
+    The selector_function takes the analysis_selector, a list of analysis_collections, and the state_collection, and 
+    returns a list with the updated analysis_collection ( or None to skip the state ) for each one.
+        For example:
+            @funtool.analysis_selector.bulk_analysis_selector
+            def same_level(analysis_selector, analysis_collections, state_collection):
+                ...
+
+    The decorated selector can still be called for a single analysis_collection
+    """
+    def wrapped_function(analysis_selector, analysis_collection, state_collection):
+        return selector_function(analysis_selector, [ analysis_collection ], state_collection)[0]
+    wrapped_function.bulk_selector= selector_function
+    return wrapped_function
+
+@bulk_analysis_selector
+def states_with_same_key(analysis_selector, analysis_collections, state_collection):
+    """
+    Adds the states which share a key with each state to its states_dict, indexing the StateCollection once
+
+    The key parameter is a state field: field key pair, or a list of them, for example (as YAML):
+        same_user:
+            selector_module: funtool.analysis_selector
+            selector_function: states_with_same_key
+            parameters:
+                key:
+                    meta: user_id
+                states_dict_key: same_user      (optional: defaults to same_key)
+                include_self: false             (optional: defaults to true)
+    States missing any part of the key get an empty list. The lists are shared between states, so shouldn't be changed.
+    """
+    parameters= analysis_selector.parameters or {}
+    key_fields= [ funtool.lib.general.get_tuple(field) for field in ( [ parameters['key'] ] if hasattr(parameters['key'], 'items') else parameters['key'] ) ]
+    states_dict_key= parameters.get('states_dict_key', 'same_key')
+    include_self= parameters.get('include_self', True)
+    index= {}
+    for state in state_collection.states:
+        state_key= _state_key(state, key_fields)
+        if state_key != None:
+            index.setdefault(state_key, []).append(state)
+    for analysis_collection in analysis_collections:
+        same_key_states= index.get(_state_key(analysis_collection.state, key_fields), []) 
+        if not include_self:
+            same_key_states= [ state for state in same_key_states if state is not analysis_collection.state ]
+        analysis_collection.states_dict[states_dict_key]= same_key_states
+    return analysis_collections
+
+def _state_key(state, key_fields):
+    values= tuple( getattr(state, state_field).get(field_key) for state_field, field_key in key_fields )
+    if None in values:
+        return None
+    return values
+
+@bulk_analysis_selector
+def neighboring_states(analysis_selector, analysis_collections, state_collection):
+    """
+    Adds the previous and next states of each state to its states_dict, within its partition of the sorted StateCollection
+
+    The StateCollection is sorted and partitioned once, each state then gets its neighbors by position.
+        For example (as YAML):
+            previous_save:
+                selector_module: funtool.analysis_selector
+                selector_function: neighboring_states
+                parameters:
+                    sort_by:                (optional: see funtool.lib.general.sort_states, defaults to the StateCollection order)
+                        - meta: saved_at
+                    partition_by:           (optional: a state field: field key pair or a list of them)
+                        meta: user_id
+                    grouping: sessions      (optional: partitions by the first group of each state in the grouping instead)
+                    previous: 3             (optional: the number of previous states, defaults to 1)
+                    next: 0                 (optional: the number of next states, defaults to 0)
+                    previous_key: previous  (optional: the states_dict key of the previous states)
+                    next_key: next          (optional: the states_dict key of the next states)
+
+    Previous and next states are listed nearest first, so states_dict['previous'][0] is the state just before.
+    States missing from the partitions ( or missing part of the partition key ) get empty lists.
+    """
+    parameters= analysis_selector.parameters or {}
+    previous_count= parameters.get('previous', 1)
+    next_count= parameters.get('next', 0)
+    previous_key= parameters.get('previous_key', 'previous')
+    next_key= parameters.get('next_key', 'next')
+    positions= _partition_positions(state_collection, parameters)
+    for analysis_collection in analysis_collections:
+        partition, index= positions.get(id(analysis_collection.state), ( [], 0 ))
+        analysis_collection.states_dict[previous_key]= partition[max(0, index - previous_count):index][::-1]
+        analysis_collection.states_dict[next_key]= partition[index + 1:index + 1 + next_count]
+    return analysis_collections
+
+def _partition_positions(state_collection, parameters):
+    """
+    Returns a dict of id(state): ( partition, index of the state in the partition ) for the sorted and partitioned states
+    """
+    states= state_collection.states
+    if parameters.get('sort_by') != None:
+        states= funtool.lib.general.cached_sort_states(states, parameters['sort_by'])
+    partition_by= parameters.get('partition_by')
+    key_fields= None
+    if partition_by != None:
+        key_fields= [ funtool.lib.general.get_tuple(field) for field in ( [ partition_by ] if hasattr(partition_by, 'items') else partition_by ) ]
+    grouping_name= parameters.get('grouping')
+    partitions= {}
+    for state in states:
+        if grouping_name != None:
+            groups= state.groupings.get(grouping_name)
+            partition_key= id(groups[0]) if groups else None
+        elif key_fields != None:
+            partition_key= _state_key(state, key_fields)
+        else:
+            partition_key= ()
+        if partition_key != None:
+            partitions.setdefault(partition_key, []).append(state)
+    return { id(state):( partition, index ) for partition in partitions.values() for index, state in enumerate(partition) }
+
+def select_analysis_collections(analysis_collections, state_collection, analysis_selector_names, loaded_processes):
+    """
+    Runs the named analysis selectors in order for a list of analysis_collections, returns a list with the 
+    selected analysis_collection ( or None when a selector skipped it ) for each one
+    """
+    for analysis_selector_name in (analysis_selector_names or []):
+        analysis_selector_process= loaded_processes["analysis_selector"][analysis_selector_name]
+        analysis_collections= _select_with(analysis_selector_process, analysis_collections, state_collection)
+    return analysis_collections
+
+def select_analysis_collection(analysis_collection, state_collection, analysis_selector_names, loaded_processes):
+    """
+    Runs the named analysis selectors in order for a single analysis_collection, returns the selected 
+    analysis_collection or None when a selector skipped it
+    """
+    for analysis_selector_name in (analysis_selector_names or []):
+        if analysis_collection is None:
+            break
+        analysis_collection= loaded_processes["analysis_selector"][analysis_selector_name].process_function(analysis_collection, state_collection)
+    return analysis_collection
+
+def selects_in_bulk(analysis_selector_names, loaded_processes):
+    """
+    Returns true if any of the named analysis selectors is a bulk selector or has a memoize_by parameter
+    """
+    for analysis_selector_name in (analysis_selector_names or []):
+        analysis_selector_process= loaded_processes["analysis_selector"][analysis_selector_name]
+        memoize_by= (getattr(analysis_selector_process.collection, 'parameters', None) or {}).get('memoize_by')
+        if memoize_by != None or bulk_selector_function(analysis_selector_process) != None:
+            return True
+    return False
+
+def bulk_selector_function(analysis_selector_process):
+    """
+    Returns the bulk function of an analysis selector process created from a bulk_analysis_selector, or None
+    """
+    return getattr(getattr(analysis_selector_process.process_function, 'func', None), 'bulk_selector', None)
+
+def _select_with(analysis_selector_process, analysis_collections, state_collection):
+    memoize_by= (getattr(analysis_selector_process.collection, 'parameters', None) or {}).get('memoize_by')
+    if memoize_by != None:
+        return _memoized_select(analysis_selector_process, analysis_collections, state_collection, memoize_by)
+    return _run_selector(analysis_selector_process, analysis_collections, state_collection)
+
+def _run_selector(analysis_selector_process, analysis_collections, state_collection):
+    selected= [ None ] * len(analysis_collections)
+    positions= [ position for position, analysis_collection in enumerate(analysis_collections) if analysis_collection != None ]
+    bulk_function= bulk_selector_function(analysis_selector_process)
+    if bulk_function != None:
+        selected_collections= bulk_function(analysis_selector_process.collection, [ analysis_collections[position] for position in positions ], state_collection)
+    else:
+        selected_collections= [ analysis_selector_process.process_function(analysis_collections[position], state_collection) for position in positions ]
+    for position, selected_collection in zip(positions, selected_collections):
+        selected[position]= selected_collection
+    return selected
+
+def _memoized_select(analysis_selector_process, analysis_collections, state_collection, memoize_by):
+    """
+    Runs the selector for the first analysis_collection with each key, the others get shallow copies of its states_dict and groupings
+    """
+    key_fields= [ funtool.lib.general.get_tuple(field) for field in ( [ memoize_by ] if hasattr(memoize_by, 'items') else memoize_by ) ]
+    selection_keys= [ None if analysis_collection is None else 
+            tuple( getattr(analysis_collection.state, state_field).get(field_key) for state_field, field_key in key_fields )
+        for analysis_collection in analysis_collections ]
+    first_positions= {}
+    for position, selection_key in enumerate(selection_keys):
+        if analysis_collections[position] != None and selection_key not in first_positions:
+            first_positions[selection_key]= position
+    first_selections= _run_selector(analysis_selector_process, [ analysis_collections[position] for position in first_positions.values() ], state_collection)
+    selections= dict(zip(first_positions.keys(), first_selections))
+    selected= []
+    for position, (analysis_collection, selection_key) in enumerate(zip(analysis_collections, selection_keys)):
+        selection= selections.get(selection_key) if analysis_collection != None else None
+        if selection is None or first_positions[selection_key] == position:
+            selected.append(selection)
+        else:
+            selected.append( funtool.analysis.AnalysisCollection(analysis_collection.state, selection.group, 
+                dict(selection.states_dict), dict(selection.groupings)) )
+    return selected
@@ -4,6 +4,7 @@ import inspect
 
 import funtool
 import funtool.analysis
+import funtool.analysis_plan
 
 # Configuration Locations
 # processes defined in the last location take precedence
@@ -95,27 +96,63 @@ def prepare_analyses(loaded_processes=None,known_analyses=None, primary_analyses
     return [ funtool.analysis.load_processes(analysis,loaded_processes,known_analyses) for analysis in primary_analyses ]
    
 
-def run_analyses(prepared_analyses=None,log_dir=default_log_dir):
+def plan_analyses(prepared_analyses=None, loaded_processes=None):
+    """
+    Returns an AnalysisPlan for each prepared analysis ( see funtool.analysis_plan )
+    """
+    if loaded_processes == None:
+        loaded_processes = load_config()
+    if prepared_analyses == None:
+        prepared_analyses = prepare_analyses(loaded_processes)
+    return [ funtool.analysis_plan.compile_plan(analysis, loaded_processes) for analysis in prepared_analyses ]
+
+def print_plans(prepared_analyses=None, loaded_processes=None):
+    """
+    Prints the plan of each prepared analysis, to inspect which steps can run concurrently
+    """
+    plans= plan_analyses(prepared_analyses, loaded_processes)
+    for plan in plans:
+        print(funtool.analysis_plan.format_plan(plan))
+    return plans
+
+def run_analyses(prepared_analyses=None,log_dir=default_log_dir,incremental_dir=None,resume=False,planned=False,loaded_processes=None,trace_memory=False,progress_file=None,measure_latency=False):
     """
         If all defaults are ok, this should be the only function needed to run the analyses.
+
+        With an incremental_dir, each analysis only measures the states which changed since its last run ( see funtool.incremental )
+
+        With resume, each analysis restarts after its last checkpoint ( see funtool.analysis.run_analysis )
+
+        With planned, each analysis is compiled into a plan first, so independent measures run concurrently ( see funtool.analysis_plan )
+
+        Each analysis writes a profile of its steps next to its logs, with trace_memory the profile includes python allocations
+        and with measure_latency the time taken to measure each state or group ( see funtool.analysis_profile )
+
+        With progress_file, each analysis keeps the progress of its steps as JSON ( see funtool.progress )
     """
+    if planned and loaded_processes == None:
+        loaded_processes = load_config()
     if prepared_analyses == None:
-        prepared_analyses = prepare_analyses()
+        prepared_analyses = prepare_analyses(loaded_processes)
     state_collection = funtool.state_collection.StateCollection([],{})
     for analysis in prepared_analyses:
-        state_collection= funtool.analysis.run_analysis(analysis, state_collection, log_dir)
+        plan= funtool.analysis_plan.compile_plan(analysis, loaded_processes) if planned else None
+        state_collection= funtool.analysis.run_analysis(analysis, state_collection, log_dir, incremental_dir=incremental_dir, resume=resume, plan=plan, trace_memory=trace_memory, progress_file=progress_file, measure_latency=measure_latency)
     return state_collection
 
-def run_analysis( named_analysis, prepared_analyses=None,log_dir=default_log_dir):
+def run_analysis( named_analysis, prepared_analyses=None,log_dir=default_log_dir,incremental_dir=None,resume=False,planned=False,loaded_processes=None,trace_memory=False,progress_file=None,measure_latency=False):
     """
     Runs just the named analysis. Otherwise just like run_analyses
     """
+    if planned and loaded_processes == None:
+        loaded_processes = load_config()
     if prepared_analyses == None:
-        prepared_analyses = prepare_analyses()
+        prepared_analyses = prepare_analyses(loaded_processes)
     state_collection = funtool.state_collection.StateCollection([],{})
     for analysis in prepared_analyses:
         if analysis.name == named_analysis:
-            state_collection= funtool.analysis.run_analysis(analysis, state_collection, log_dir)
+            plan= funtool.analysis_plan.compile_plan(analysis, loaded_processes) if planned else None
+            state_collection= funtool.analysis.run_analysis(analysis, state_collection, log_dir, incremental_dir=incremental_dir, resume=resume, plan=plan, trace_memory=trace_memory, progress_file=progress_file, measure_latency=measure_latency)
     return state_collection
     
        
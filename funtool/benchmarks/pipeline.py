@@ -0,0 +1,176 @@
+# Times the core paths of the analysis pipeline on synthetic StateCollections
+#
+# Run with:
+#   python -m funtool.benchmarks.pipeline --states 100000 --groupings 2 --group-size 50 --output results.json
+#
+# Results are written as JSON, so runs with different versions of funtool can be compared
+
+import argparse
+import contextlib
+import json
+import logging
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import time
+
+import funtool.api
+import funtool.analysis
+import funtool.logger
+import funtool.state_collection
+import funtool.state_measure
+import funtool.group_measure
+import funtool.lib.general
+import funtool.benchmarks.synthetic
+
+benchmark_names= [
+    'load_config',
+    'sort_states',
+    'state_measure',
+    'group_measure',
+    'add_grouping',
+    'join_state_collections',
+    'run_analysis'
+]
+
+
+def time_call(benchmark_function, setup_function=None, repeat=3):
+    """
+    Calls benchmark_function repeat times, with a fresh result of setup_function as the argument each time
+
+    Returns a dict with the best and mean time in seconds
+    """
+    timings= []
+    for repetition in range(repeat):
+        arguments= setup_function() if setup_function != None else ()
+        start_time= time.perf_counter()
+        benchmark_function(*arguments)
+        timings.append(time.perf_counter() - start_time)
+    return { 'repeat': repeat, 'best_seconds': min(timings), 'mean_seconds': sum(timings) / len(timings) }
+
+def write_config(config_dir, state_count, grouping_count, group_size):
+    """
+    Writes process configs for the synthetic processes, returns the config directory
+    """
+    process_configs= {
+        'adaptors': { 'synthetic_states': { 
+            'adaptor_module': 'funtool.benchmarks.synthetic', 'adaptor_function': 'synthetic_adaptor',
+            'parameters': { 'states': state_count, 'groupings': grouping_count, 'group_size': group_size } } },
+        'grouping_selectors': { 'group_%d'% grouping_index: {
+            'selector_module': 'funtool.grouping_selector', 'selector_function': 'group_by_key', 
+            'parameters': { 'group_by': { 'meta': 'group_%d'% grouping_index } } } for grouping_index in range(grouping_count) },
+        'state_measures': { 'clicks_per_position': {
+            'measure_module': 'funtool.benchmarks.synthetic', 'measure_function': 'clicks_per_position', 
+            'parameters': { 'sort_by': [ { 'meta': 'created_at' } ] } } },
+        'group_measures': { 'group_click_total': {
+            'measure_module': 'funtool.benchmarks.synthetic', 'measure_function': 'group_click_total',
+            'grouping_selectors': [ 'group_0' ], 'parameters': {} } },
+        'reporters': { 'null_reporter': {
+            'reporter_module': 'funtool.benchmarks.synthetic', 'reporter_function': 'null_reporter', 'parameters': {} } }
+    }
+    for process_directory, processes in process_configs.items():
+        os.makedirs(os.path.join(config_dir, process_directory))
+        with open(os.path.join(config_dir, process_directory, 'benchmark.yaml'), 'w') as f:
+            json.dump(processes, f) # JSON is valid YAML
+    return config_dir
+
+def benchmark_analysis(loaded_processes):
+    process_identifiers= [
+        funtool.analysis.ProcessIdentifier('adaptor', 'synthetic_states'),
+        funtool.analysis.ProcessIdentifier('state_measure', 'clicks_per_position'),
+        funtool.analysis.ProcessIdentifier('group_measure', 'group_click_total'),
+        funtool.analysis.ProcessIdentifier('reporter', 'null_reporter') ]
+    analysis= funtool.analysis.Analysis('benchmark', process_identifiers, [])
+    return funtool.analysis.load_processes(analysis, loaded_processes, {})
+
+def run(state_count=10000, grouping_count=1, group_size=10, repeat=3, benchmarks=benchmark_names):
+    """
+    Runs the benchmarks, returns a dict of results which can be saved as JSON
+    """
+    work_dir= tempfile.mkdtemp(prefix='funtool_benchmark_')
+    loggers= funtool.logger.Loggers(*[ logging.getLogger('funtool_benchmark_' + name) for name in ['analysis','process','status'] ])
+    for logger in loggers[:3]:
+        logger.addHandler(logging.NullHandler())
+        logger.propagate= False
+    collection= lambda: funtool.benchmarks.synthetic.synthetic_state_collection(state_count, grouping_count, group_size)
+    try:
+        config_dir= write_config(os.path.join(work_dir, 'config'), state_count, grouping_count, group_size)
+        locations= [ funtool.api.funtool_path, config_dir ]
+        loaded= {}
+        def loaded_processes():
+            if 'processes' not in loaded:
+                loaded['processes']= funtool.api.load_config(locations)
+            return loaded['processes']
+        benchmark_functions= {
+            'load_config': lambda: time_call(lambda: funtool.api.load_config(locations), repeat=repeat),
+            'sort_states': lambda: time_call(
+                lambda states: funtool.lib.general.sort_states(states, [ { 'meta': 'user_id' }, { '-meta': 'created_at' }, { 'data': 'position' } ]),
+                lambda: (collection().states,), repeat),
+            'state_measure': lambda: time_call(
+                loaded_processes()['state_measure']['clicks_per_position'].process_function, 
+                lambda: (collection(), None, loggers), repeat),
+            'group_measure': lambda: time_call(
+                loaded_processes()['group_measure']['group_click_total'].process_function, 
+                lambda: (collection(), None, loggers), repeat),
+            'add_grouping': lambda: time_call(
+                lambda state_collection: [ funtool.state_collection.add_grouping(state_collection, 'group_%d'% grouping_index, loaded_processes()) 
+                    for grouping_index in range(grouping_count) ],
+                lambda: (collection(),), repeat),
+            'join_state_collections': lambda: time_call(funtool.state_collection.join_state_collections,
+                lambda: _grouped_collections(collection(), collection(), grouping_count), repeat),
+            'run_analysis': lambda: time_call(
+                lambda: funtool.analysis.run_analysis(benchmark_analysis(loaded_processes()), None, os.path.join(work_dir, 'logs')),
+                repeat=repeat)
+        }
+        results= {}
+        for benchmark_name in benchmarks:
+            try:
+                results[benchmark_name]= benchmark_functions[benchmark_name]()
+            except Exception as e:
+                results[benchmark_name]= { 'error': '%s: %s'% (type(e).__name__, e) }
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+    return {
+        'benchmark': 'pipeline',
+        'funtool_version': _funtool_version(),
+        'python_version': platform.python_version(),
+        'states': state_count,
+        'groupings': grouping_count,
+        'group_size': group_size,
+        'results': results }
+
+def _grouped_collections(collection_a, collection_b, grouping_count):
+    for state_collection in (collection_a, collection_b):
+        for grouping_index in range(grouping_count):
+            funtool.benchmarks.synthetic.synthetic_grouping(state_collection, grouping_index)
+    return (collection_a, collection_b)
+
+def _funtool_version():
+    try:
+        import importlib.metadata
+        return importlib.metadata.version('funtool')
+    except Exception:
+        return None
+
+def main(argv=None):
+    parser= argparse.ArgumentParser(description='Time the core paths of the funtool analysis pipeline')
+    parser.add_argument('--states', type=int, default=10000, help='number of synthetic states (default 10000)')
+    parser.add_argument('--groupings', type=int, default=1, help='number of groupings (default 1)')
+    parser.add_argument('--group-size', type=int, default=10, help='average number of states in a group (default 10)')
+    parser.add_argument('--repeat', type=int, default=3, help='number of times each benchmark is run (default 3)')
+    parser.add_argument('--benchmark', action='append', choices=benchmark_names, help='benchmarks to run (default all)')
+    parser.add_argument('--output', help='file to write the JSON results to (default stdout)')
+    arguments= parser.parse_args(argv)
+    with contextlib.redirect_stdout(sys.stderr): # keeps process loading and log output out of the JSON results
+        results= run(arguments.states, arguments.groupings, arguments.group_size, arguments.repeat, arguments.benchmark or benchmark_names)
+    if arguments.output:
+        with open(arguments.output, 'w') as f:
+            json.dump(results, f, indent=2)
+    else:
+        json.dump(results, sys.stdout, indent=2)
+        sys.stdout.write("\n")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,73 @@
+# Compares the memory used by States ( state.py ) and by a CompactStateStore ( compact_state.py )
+#
+# Run with:
+#   python -m funtool.benchmarks.state_memory --states 1000000
+#
+# Results are printed as JSON
+
+import argparse
+import gc
+import json
+import sys
+import time
+import tracemalloc
+
+import funtool.state
+import funtool.compact_state
+
+
+def state_values(state_index):
+    """
+    Returns the id, data, measures, and meta for a small synthetic state
+    """
+    return ( 
+        str(state_index), 
+        { 'position': state_index },
+        { 'clicks': state_index % 97, 'duration': state_index * 0.5 },
+        { 'user_id': state_index % 1000, 'project_id': state_index % 50, 'created_at': state_index } )
+
+def build_states(state_count):
+    return [ funtool.state.State(*state_values(state_index), {}) for state_index in range(state_count) ]
+
+def build_compact_store(state_count):
+    store= funtool.compact_state.CompactStateStore()
+    for state_index in range(state_count):
+        store.add_state(*state_values(state_index))
+    return store
+
+def measure_memory(build_function, state_count):
+    """
+    Returns a dict with the memory held by the result of build_function, and the time taken to build it
+    """
+    gc.collect()
+    tracemalloc.start()
+    start_time= time.perf_counter()
+    built= build_function(state_count)
+    build_seconds= time.perf_counter() - start_time
+    current_bytes, peak_bytes= tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del built
+    return { 
+        'retained_bytes': current_bytes, 
+        'peak_bytes': peak_bytes, 
+        'bytes_per_state': current_bytes / max(1, state_count),
+        'build_seconds': build_seconds }
+
+def run(state_count):
+    results= { 
+        'benchmark': 'state_memory',
+        'states': state_count,
+        'state': measure_memory(build_states, state_count),
+        'compact_state_store': measure_memory(build_compact_store, state_count) }
+    results['retained_ratio']= results['compact_state_store']['retained_bytes'] / max(1, results['state']['retained_bytes'])
+    return results
+
+def main(argv=None):
+    parser= argparse.ArgumentParser(description='Compare the memory used by States and a CompactStateStore')
+    parser.add_argument('--states', type=int, default=1000000, help='number of synthetic states (default 1000000)')
+    arguments= parser.parse_args(argv)
+    json.dump(run(arguments.states), sys.stdout, indent=2)
+    sys.stdout.write("\n")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,77 @@
+# Synthetic states and processes used by the benchmarks
+
+import funtool.state
+import funtool.state_collection
+import funtool.state_measure
+import funtool.grouping_selector
+import funtool.analysis
+import funtool.lib.general
+
+
+def synthetic_states(state_count, grouping_count=1, group_size=10):
+    """
+    Returns a list of states with simple numeric data and meta
+
+    Each state has a meta key group_0 ... group_N for every grouping, placing it in a group of about group_size states.
+    Group members are spread through the list rather than being adjacent.
+    """
+    group_count= max(1, state_count // max(1, group_size))
+    states= []
+    for state_index in range(state_count):
+        meta= { 'user_id': state_index % 1000, 'created_at': (state_index * 7919) % max(1, state_count) }
+        for grouping_index in range(grouping_count):
+            meta['group_%d'% grouping_index]= ((state_index + grouping_index) * 31) % group_count
+        states.append( funtool.state.State(str(state_index), { 'position': state_index, 'clicks': state_index % 97 }, {}, meta, {}) )
+    return states
+
+def synthetic_state_collection(state_count, grouping_count=1, group_size=10):
+    return funtool.state_collection.StateCollection(synthetic_states(state_count, grouping_count, group_size), {})
+
+def synthetic_grouping(state_collection, grouping_index):
+    """
+    Adds the grouping group_N to a StateCollection, using the group_by_key grouping selector
+    """
+    grouping_name= 'group_%d'% grouping_index
+    grouping_selector= funtool.grouping_selector.GroupingSelector(grouping_name, 'funtool.grouping_selector', 'group_by_key', 
+        { 'group_by': { 'meta': grouping_name } })
+    return funtool.grouping_selector.group_by_key(grouping_selector, state_collection)
+
+
+# Processes which can be used in benchmark configs
+
+def synthetic_adaptor(adaptor, state_collection, overriding_parameters=None, loggers=None):
+    parameters= adaptor.parameters or {}
+    return funtool.state_collection.join_state_collections(state_collection,
+        synthetic_state_collection(parameters.get('states', 1000), parameters.get('groupings', 1), parameters.get('group_size', 10)))
+
+@funtool.state_measure.state_and_parameter_measure
+def clicks_per_position(state, parameters):
+    return state.data['clicks'] / (state.data['position'] + 1)
+
+def group_click_total(group_measure, analysis_collection, state_collection):
+    group= analysis_collection.group
+    group.measures[group_measure.name]= sum( state.data['clicks'] for state in group.states )
+    return analysis_collection
+
+def null_reporter(reporter, state_collection, overriding_parameters=None, loggers=None):
+    return state_collection
+
+def naive_previous_states(analysis_selector, analysis_collection, state_collection):
+    """
+    Finds the states before a state from the same user by scanning the full StateCollection, as a hand written selector would
+    """
+    parameters= analysis_selector.parameters or {}
+    state= analysis_collection.state
+    same_user_states= funtool.lib.general.sort_states(
+        [ other_state for other_state in state_collection.states if other_state.meta['user_id'] == state.meta['user_id'] ],
+        [ { 'meta': 'created_at' } ])
+    index= same_user_states.index(state)
+    analysis_collection.states_dict['previous']= same_user_states[max(0, index - parameters.get('previous', 1)):index][::-1]
+    return analysis_collection
+
+@funtool.state_measure.analysis_collection_and_parameter_measure
+def clicks_since_previous(analysis_collection, parameters):
+    previous_states= analysis_collection.states_dict['previous']
+    if len(previous_states) == 0:
+        return None
+    return analysis_collection.state.data['clicks'] - previous_states[0].data['clicks']
@@ -0,0 +1,83 @@
+# Compares the built-in neighboring_states analysis selector with a selector which scans the StateCollection for each state
+#
+# Run with:
+#   python -m funtool.benchmarks.window_selector --states 20000 --previous 3 --output results.json
+#
+# Both selectors give each state its previous states from the same user, ordered by created_at. The naive selector is
+# quadratic in the number of states, so keep --states modest.
+
+import argparse
+import contextlib
+import json
+import logging
+import platform
+import sys
+
+import funtool.analysis
+import funtool.analysis_selector
+import funtool.logger
+import funtool.state_measure
+import funtool.benchmarks.pipeline
+import funtool.benchmarks.synthetic
+
+
+def selector_processes(previous_count):
+    """
+    Returns loaded analysis selector processes for the naive and windowed selectors
+    """
+    selectors= {
+        'naive': funtool.analysis_selector.AnalysisSelector('funtool.benchmarks.synthetic', 'naive_previous_states', 
+            { 'previous': previous_count }),
+        'windowed': funtool.analysis_selector.AnalysisSelector('funtool.analysis_selector', 'neighboring_states', 
+            { 'sort_by': [ { 'meta': 'created_at' } ], 'partition_by': { 'meta': 'user_id' }, 'previous': previous_count }) }
+    return { 'analysis_selector': { selector_name:funtool.analysis.Process(selector, funtool.analysis_selector.analysis_selector_process(selector))
+        for selector_name, selector in selectors.items() }, 'grouping_selector': {} }
+
+def measure_process(selector_name, loaded_processes):
+    state_measure= funtool.state_measure.StateMeasure('clicks_since_previous', 'funtool.benchmarks.synthetic', 'clicks_since_previous', 
+        [ selector_name ], None, {})
+    return funtool.state_measure.state_measure_process(state_measure, loaded_processes)
+
+def run(state_count=5000, previous_count=1, repeat=3):
+    """
+    Runs both selectors with the same measure, returns a dict of results which can be saved as JSON
+    """
+    loggers= funtool.logger.Loggers(*[ logging.getLogger('funtool_benchmark_' + name) for name in ['analysis','process','status'] ])
+    for logger in loggers[:3]:
+        logger.addHandler(logging.NullHandler())
+        logger.propagate= False
+    loaded_processes= selector_processes(previous_count)
+    collection= lambda: ( funtool.benchmarks.synthetic.synthetic_state_collection(state_count), None, loggers )
+    results= {}
+    measured_values= {}
+    for selector_name in [ 'naive', 'windowed' ]:
+        process_function= measure_process(selector_name, loaded_processes)
+        results[selector_name]= funtool.benchmarks.pipeline.time_call(process_function, collection, repeat)
+        measured_values[selector_name]= [ state.measures.get('clicks_since_previous') for state in process_function(*collection()).states ]
+    return {
+        'benchmark': 'window_selector',
+        'python_version': platform.python_version(),
+        'states': state_count,
+        'previous': previous_count,
+        'same_results': measured_values['naive'] == measured_values['windowed'],
+        'speedup': results['naive']['best_seconds'] / results['windowed']['best_seconds'],
+        'results': results }
+
+def main(argv=None):
+    parser= argparse.ArgumentParser(description='Compare the neighboring_states analysis selector with a naive scan')
+    parser.add_argument('--states', type=int, default=5000, help='number of synthetic states (default 5000)')
+    parser.add_argument('--previous', type=int, default=1, help='number of previous states selected (default 1)')
+    parser.add_argument('--repeat', type=int, default=3, help='number of times each selector is run (default 3)')
+    parser.add_argument('--output', help='file to write the JSON results to (default stdout)')
+    arguments= parser.parse_args(argv)
+    with contextlib.redirect_stdout(sys.stderr):
+        results= run(arguments.states, arguments.previous, arguments.repeat)
+    if arguments.output:
+        with open(arguments.output, 'w') as f:
+            json.dump(results, f, indent=2)
+    else:
+        json.dump(results, sys.stdout, indent=2)
+        sys.stdout.write("\n")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,329 @@
+# Exports states and group measures as typed columns, as Parquet files or NumPy .npy column files
+
+import collections
+import collections.abc
+import json
+import numbers
+import os
+
+import funtool.reporter
+
+try:
+    import numpy
+except ImportError: # numpy is only needed for npy column files
+    numpy= None
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError: # without pyarrow, columns are written as npy files
+    pyarrow= None
+
+Column = collections.namedtuple('Column',['name','value_function','column_type','nullable'])
+
+# A Column is one column of an exported table
+#
+# name              the column name: id, meta.<key>, data.<key>, or the measure name for states,
+#                       group_key, state_count, or the measure name for groups. A measure named like another column
+#                       ( such as id ) raises a ColumnarError.
+# value_function    a function which returns the value of the column for a row ( a state, or a group key and group pair )
+# column_type       the type inferred from the values, one of column_types
+# nullable          true if any row has no value ( None or a missing key )
+#
+# Column types:
+#   bool        when every value is a bool
+#   int64       when every value is an integer which fits in 64 bits
+#   float64     when every value is a number
+#   string      when every value is a string
+#   json        for anything else ( dicts, lists, mixed types ), the values are written as JSON strings
+#
+# Parquet files keep missing values as nulls. In npy files missing numbers and bools are written as NaN ( so the
+# column is a float64 column ) and missing strings are written as empty strings. The column types are saved in
+# columns.json next to the npy files ( see read_npy_columns ).
+#
+# In npy files string and json columns are variable length: the values are written one after another as UTF-8 to a 
+# .bytes file ( values_file in columns.json ), and the npy file holds rows + 1 int64 offsets, so value i is the bytes
+# from offsets[i] to offsets[i + 1]. Fixed width numpy strings would take 4 bytes per character of the longest value
+# for every row.
+
+column_types= [ 'bool', 'int64', 'float64', 'string', 'json' ]
+
+export_formats= [ 'parquet', 'npy' ]
+
+variable_length_types= [ 'string', 'json' ]
+
+default_chunk_size= 100000
+
+columns_file_name= 'columns.json'
+
+
+class ColumnarError(Exception):
+    pass
+
+def columnar_report(reporter, state_collection, overriding_parameters=None, loggers=None):
+    """
+    Writes the states of the StateCollection as a table with a row for each state, and a table of the group measures
+    of each grouping with a row for each group
+        For example (as YAML):
+            reporter_module: funtool.columnar
+            reporter_function: columnar_report
+            parameters:
+                save_directory: ./reports
+                name: states            (optional: the name of the states table, group tables are named <name>_groups_<grouping>)
+                meta:                   (optional: meta keys to include)
+                    - user_id
+                data:                   (optional: data keys to include)
+                    - level
+                groupings:              (optional: defaults to every grouping in the StateCollection)
+                    - user_id
+                format: parquet         (optional: parquet or npy, defaults to parquet when pyarrow is installed)
+                chunk_size: 100000      (optional: the number of rows converted and written at once)
+    Every measure is written. Tables are saved as <name>.parquet, or as a <name> directory of npy files.
+    """
+    reporter_parameters= funtool.reporter.get_parameters(reporter, overriding_parameters)
+    export_format= reporter_parameters.get('format') or ( 'parquet' if pyarrow != None else 'npy' )
+    chunk_size= max(1, int(reporter_parameters.get('chunk_size') or default_chunk_size))
+    save_path= funtool.reporter.get_default_save_path(reporter_parameters)
+    name= reporter_parameters.get('name') or 'states'
+    states= state_collection.states
+    write_table(os.path.join(save_path, name),
+        state_columns(states, reporter_parameters.get('meta') or [], reporter_parameters.get('data') or [], chunk_size),
+        states, export_format, chunk_size)
+    grouping_names= reporter_parameters.get('groupings')
+    if grouping_names is None:
+        grouping_names= sorted(state_collection.groupings.keys(), key=str)
+    for grouping_name in grouping_names:
+        groups= list(state_collection.groupings.get(grouping_name, {}).items())
+        write_table(os.path.join(save_path, '%s_groups_%s'% (name, grouping_name)), group_columns(groups, chunk_size), groups, export_format, chunk_size)
+    if reporter_parameters.get('analysis_start_time') != None:
+        funtool.reporter.link_latest_output(reporter_parameters['save_directory'])
+    return state_collection
+
+def state_columns(states, meta_keys=(), data_keys=(), chunk_size=default_chunk_size):
+    """
+    Returns the Columns for a table of states: the id, the given meta and data keys, and every measure
+    """
+    value_functions= [ ('id', lambda state: state.id) ]
+    value_functions.extend( ('meta.%s'% key, _field_value('meta', key)) for key in meta_keys )
+    value_functions.extend( ('data.%s'% key, _field_value('data', key)) for key in data_keys )
+    value_functions.extend( (str(key), _field_value('measures', key)) for key in funtool.reporter.measure_keys(states) )
+    _check_column_names(value_functions)
+    return [ infer_column(name, value_function, states, chunk_size) for name, value_function in value_functions ]
+
+def group_columns(groups, chunk_size=default_chunk_size):
+    """
+    Returns the Columns for a table of ( group key, group ) pairs: the group key, the number of states, and every measure
+    """
+    value_functions= [ ('group_key', lambda keyed_group: keyed_group[0]), ('state_count', lambda keyed_group: len(keyed_group[1].states)) ]
+    value_functions.extend( (str(key), _group_measure_value(key)) for key in funtool.reporter.measure_keys( group for group_key, group in groups ) )
+    _check_column_names(value_functions)
+    return [ infer_column(name, value_function, groups, chunk_size) for name, value_function in value_functions ]
+
+def infer_column(name, value_function, rows, chunk_size=default_chunk_size):
+    """
+    Returns a Column with the type of the values of value_function over rows ( see column_types ), chunk_size rows at a time
+    """
+    value_types= set()
+    fits_int64= True
+    for start in range(0, len(rows), chunk_size):
+        values= list(map(value_function, rows[start:start + chunk_size]))
+        value_types.update(map(type, values))
+        fits_int64= fits_int64 and _fits_int64(values)
+    nullable= type(None) in value_types
+    value_types.discard(type(None))
+    kinds= set( _type_kind(value_type) for value_type in value_types )
+    if 'int64' in kinds and not fits_int64:
+        kinds.add('json')
+    if len(kinds) == 0:
+        column_type= 'float64' # a column with no values
+    elif len(kinds) == 1:
+        column_type= kinds.pop()
+    elif kinds <= set([ 'int64', 'float64' ]):
+        column_type= 'float64'
+    else:
+        column_type= 'json'
+    return Column(name, value_function, column_type, nullable)
+
+def write_table(path, columns, rows, export_format='parquet', chunk_size=default_chunk_size):
+    """
+    Writes the columns of rows to path.parquet or to a path directory of npy files, chunk_size rows at a time
+    """
+    if export_format not in export_formats:
+        raise ColumnarError("Unknown columnar format: " + str(export_format) + " ( expected one of " + ', '.join(export_formats) + " )")
+    directory= os.path.dirname(path)
+    if directory != '' and not os.path.exists(directory):
+        os.makedirs(directory)
+    if export_format == 'parquet':
+        if pyarrow is None:
+            raise ColumnarError("pyarrow is required to write parquet files, use the npy format without it")
+        return _write_parquet(path + '.parquet', columns, rows, chunk_size)
+    if numpy is None:
+        raise ColumnarError("numpy is required to write npy column files")
+    return _write_npy(path, columns, rows, chunk_size)
+
+def read_npy_columns(directory, mmap_mode='r'):
+    """
+    Returns an OrderedDict of column name: column for a directory written in the npy format
+
+    Columns are numpy arrays, except string and json columns which are StringColumns. The files are memory mapped by 
+    default, pandas.DataFrame(read_npy_columns(directory)) loads the table
+    """
+    with open(os.path.join(directory, columns_file_name)) as f:
+        column_descriptions= json.load(f)['columns']
+    return collections.OrderedDict( (column_description['name'], _read_npy_column(directory, column_description, mmap_mode))
+        for column_description in column_descriptions )
+
+def _read_npy_column(directory, column_description, mmap_mode):
+    column_array= numpy.load(os.path.join(directory, column_description['file']), mmap_mode=mmap_mode)
+    if column_description.get('values_file') is None:
+        return column_array
+    values_path= os.path.join(directory, column_description['values_file'])
+    if mmap_mode is None or os.path.getsize(values_path) == 0: # an empty file can't be memory mapped
+        return StringColumn(column_array, numpy.fromfile(values_path, dtype=numpy.uint8))
+    return StringColumn(column_array, numpy.memmap(values_path, dtype=numpy.uint8, mode='r'))
+
+
+class StringColumn(collections.abc.Sequence):
+    """
+    A string or json column read from npy files, each value is decoded from the UTF-8 bytes when it is used
+    """
+    __slots__= ('offsets', 'values')
+
+    def __init__(self, offsets, values):
+        self.offsets= offsets
+        self.values= values
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [ self[position] for position in range(*index.indices(len(self))) ]
+        if index < 0:
+            index+= len(self)
+        if not 0 <= index < len(self):
+            raise IndexError(index)
+        return self.values[self.offsets[index]:self.offsets[index + 1]].tobytes().decode('utf-8')
+
+    def __repr__(self):
+        return 'StringColumn(%s rows)'% len(self)
+
+    def tolist(self):
+        values= self.values.tobytes()
+        offsets= self.offsets.tolist()
+        return [ values[start:end].decode('utf-8') for start, end in zip(offsets, offsets[1:]) ]
+
+def _write_parquet(path, columns, rows, chunk_size):
+    schema= pyarrow.schema([ pyarrow.field(column.name, _arrow_type(column), nullable=column.nullable) for column in columns ])
+    writer= pyarrow.parquet.ParquetWriter(path, schema)
+    try:
+        if len(rows) == 0:
+            writer.write_table(schema.empty_table())
+        for start in range(0, len(rows), chunk_size):
+            chunk= rows[start:start + chunk_size]
+            writer.write_table(pyarrow.Table.from_arrays(
+                [ pyarrow.array(_column_values(column, list(map(column.value_function, chunk))), type=_arrow_type(column)) for column in columns ], schema=schema))
+    finally:
+        writer.close()
+    return path
+
+def _write_npy(directory, columns, rows, chunk_size):
+    if not os.path.exists(directory):
+        os.makedirs(directory)
+    column_descriptions= []
+    for index, column in enumerate(columns): # npy files are written a column at a time
+        column_description= { 'name': column.name, 'file': '%04d.npy'% index, 'type': column.column_type, 'nullable': column.nullable }
+        if column.column_type in variable_length_types:
+            column_description['values_file']= '%04d.bytes'% index
+            _write_npy_strings(directory, column_description, column, rows, chunk_size)
+        else:
+            _write_npy_values(directory, column_description, column, rows, chunk_size)
+        column_descriptions.append(column_description)
+    with open(os.path.join(directory, columns_file_name), 'w') as f:
+        json.dump({ 'rows': len(rows), 'columns': column_descriptions }, f, indent=2)
+    return directory
+
+def _write_npy_values(directory, column_description, column, rows, chunk_size):
+    dtype= _numpy_dtype(column)
+    if len(rows) == 0: # an empty file can't be memory mapped
+        numpy.save(os.path.join(directory, column_description['file']), numpy.empty(0, dtype=dtype))
+        return column_description
+    column_array= numpy.lib.format.open_memmap(os.path.join(directory, column_description['file']), mode='w+', dtype=dtype, shape=(len(rows),))
+    for start in range(0, len(rows), chunk_size):
+        column_array[start:start + chunk_size]= _npy_values(column, list(map(column.value_function, rows[start:start + chunk_size])))
+    column_array.flush()
+    del column_array
+    return column_description
+
+def _write_npy_strings(directory, column_description, column, rows, chunk_size):
+    offsets= numpy.lib.format.open_memmap(os.path.join(directory, column_description['file']), mode='w+', dtype='int64', shape=(len(rows) + 1,))
+    offsets[0]= 0
+    position= 0
+    with open(os.path.join(directory, column_description['values_file']), 'wb') as values_file:
+        for start in range(0, len(rows), chunk_size):
+            encoded_values= [ value.encode('utf-8') for value in _npy_values(column, list(map(column.value_function, rows[start:start + chunk_size]))) ]
+            offsets[start + 1:start + 1 + len(encoded_values)]= position + numpy.cumsum(numpy.fromiter(map(len, encoded_values), dtype='int64', count=len(encoded_values)))
+            position= int(offsets[start + len(encoded_values)])
+            values_file.write(b''.join(encoded_values))
+    offsets.flush()
+    del offsets
+    return column_description
+
+def _column_values(column, values): # converts the values of a column to the type written
+    if column.column_type == 'json':
+        return [ _json_value(value) if value is not None else None for value in values ]
+    if column.column_type == 'float64':
+        return [ float(value) if value is not None else None for value in values ]
+    return values
+
+def _npy_values(column, values):
+    values= _column_values(column, values)
+    if column.column_type in variable_length_types:
+        return [ value if value is not None else '' for value in values ]
+    if column.nullable:
+        return [ float(value) if value is not None else numpy.nan for value in values ]
+    return values
+
+def _numpy_dtype(column):
+    if column.nullable or column.column_type == 'float64':
+        return 'float64'
+    return column.column_type
+
+def _arrow_type(column):
+    return { 'bool': pyarrow.bool_(), 'int64': pyarrow.int64(), 'float64': pyarrow.float64(),
+        'string': pyarrow.string(), 'json': pyarrow.string() }[column.column_type]
+
+def _type_kind(value_type):
+    if value_type is bool:
+        return 'bool'
+    if value_type is str:
+        return 'string'
+    if issubclass(value_type, numbers.Integral) and not issubclass(value_type, bool):
+        return 'int64'
+    if issubclass(value_type, numbers.Real):
+        return 'float64'
+    return 'json'
+
+def _fits_int64(values):
+    integers= [ value for value in values if isinstance(value, int) and not isinstance(value, bool) ]
+    return len(integers) == 0 or ( -2**63 <= min(integers) and max(integers) < 2**63 )
+
+_json_value= json.JSONEncoder(default=str, sort_keys=True).encode
+
+def _check_column_names(value_functions):
+    names= set()
+    for name, value_function in value_functions:
+        if name in names:
+            raise ColumnarError("More than one column is named " + name + ", rename the measure")
+        names.add(name)
+    return names
+
+def _field_value(state_field, key):
+    if state_field == 'meta':
+        return lambda state: state.meta.get(key)
+    if state_field == 'data':
+        return lambda state: state.data.get(key)
+    return lambda state: state.measures.get(key)
+
+def _group_measure_value(key):
+    return lambda keyed_group: keyed_group[1].measures.get(key)
@@ -0,0 +1,200 @@
+# Defines a compact, columnar store of states
+
+import collections.abc
+
+import funtool.state
+import funtool.state_collection
+
+# A CompactStateStore keeps the same information as a list of States ( from state.py ) with much less per state overhead.
+#   Instead of four dicts per state, measures and meta are stored as columns ( one list per key ) indexed by the
+#   position of the state in the store. Each state is represented by a StateView, a small flyweight which gives the
+#   same attribute access as a State, so measures, selectors, and reporters can use either representation.
+#
+# ids           a list of state ids
+# data          a list with the data of each state
+# measures      a dict with measure names as keys and a column ( list ) of values as the value
+# meta          a dict with meta keys as keys and a column ( list ) of values as the value
+# groupings     a list with the groupings dict of each state, or None until the state is added to a group
+# states        a list of StateViews, one per state
+#
+# Columns are only as long as the last state with a value for the key, missing values are stored as _missing
+
+
+class CompactStateStore(object):
+    def __init__(self):
+        self.ids= []
+        self.data= []
+        self.measures= {}
+        self.meta= {}
+        self.groupings= []
+        self.states= []
+
+    def __len__(self):
+        return len(self.ids)
+
+    def add_state(self, state_id, data=None, measures=None, meta=None, groupings=None):
+        """
+        Adds a state to the store and returns its StateView
+        """
+        index= len(self.ids)
+        self.ids.append(state_id)
+        self.data.append(data if data != None else {})
+        self.groupings.append(groupings or None)
+        for (columns, values) in ((self.measures, measures), (self.meta, meta)):
+            if values != None:
+                for key, value in values.items():
+                    _set_column_value(columns, key, index, value)
+        state_view= StateView(self, index)
+        self.states.append(state_view)
+        return state_view
+
+    def state_collection(self):
+        """
+        Returns a StateCollection with the StateViews of the store
+        """
+        return funtool.state_collection.StateCollection(self.states, {})
+
+
+def from_states(states):
+    """
+    Returns a CompactStateStore with a copy of the given states
+    """
+    store= CompactStateStore()
+    for state in states:
+        store.add_state(state.id, state.data, state.measures, state.meta, state.groupings)
+    return store
+
+
+class StateView(object):
+    """
+    A flyweight state backed by a CompactStateStore
+
+    Has the same fields as a State, measures and meta are mutable mappings over the store's columns. Each mapping is
+    created the first time it is used and kept in a slot, so repeated access doesn't create new objects.
+    """
+    __slots__= ('_store','_index','_measures','_meta')
+
+    _fields= funtool.state.State._fields
+
+    def __init__(self, store, index):
+        self._store= store
+        self._index= index
+
+    @property
+    def id(self):
+        return self._store.ids[self._index]
+
+    @property
+    def data(self):
+        return self._store.data[self._index]
+
+    @property
+    def measures(self):
+        try:
+            return self._measures
+        except AttributeError:
+            self._measures= ColumnMapping(self._store.measures, self._index)
+            return self._measures
+
+    @property
+    def meta(self):
+        try:
+            return self._meta
+        except AttributeError:
+            self._meta= ColumnMapping(self._store.meta, self._index)
+            return self._meta
+
+    @property
+    def groupings(self):
+        groupings= self._store.groupings[self._index]
+        if groupings is None:
+            groupings= {}
+            self._store.groupings[self._index]= groupings
+        return groupings
+
+    def __getitem__(self, field_index): # Allows a StateView to be indexed like the State namedtuple
+        return getattr(self, self._fields[field_index])
+
+    def __iter__(self):
+        return ( getattr(self, field) for field in self._fields )
+
+    def __len__(self):
+        return len(self._fields)
+
+    def __repr__(self):
+        return 'StateView(id=%r, index=%r)' % (self.id, self._index)
+
+    def replace_data(self, data):
+        """
+        Replaces the data of the state in the store
+        """
+        self._store.data[self._index]= data
+        return self
+
+    def to_state(self):
+        """
+        Returns a State with copies of the measures and meta of the StateView
+        """
+        return funtool.state.State(self.id, self.data, dict(self.measures), dict(self.meta), self.groupings)
+
+
+class ColumnMapping(collections.abc.MutableMapping):
+    """
+    A dict-like view of one state's values in a set of columns
+    """
+    __slots__= ('_columns','_index')
+
+    def __init__(self, columns, index):
+        self._columns= columns
+        self._index= index
+
+    def __getitem__(self, key):
+        value= self.get(key, _missing)
+        if value is _missing:
+            raise KeyError(key)
+        return value
+
+    def get(self, key, default=None):
+        column= self._columns.get(key)
+        if column is None or len(column) <= self._index or column[self._index] is _missing:
+            return default
+        return column[self._index]
+
+    def __contains__(self, key):
+        return self.get(key, _missing) is not _missing
+
+    def __setitem__(self, key, value):
+        _set_column_value(self._columns, key, self._index, value)
+
+    def __delitem__(self, key):
+        if key not in self:
+            raise KeyError(key)
+        self._columns[key][self._index]= _missing
+
+    def __iter__(self):
+        return ( key for key in list(self._columns.keys()) if key in self )
+
+    def __len__(self):
+        return sum( 1 for key in self )
+
+    def __repr__(self):
+        return repr(dict(self))
+
+
+def _set_column_value(columns, key, index, value):
+    column= columns.get(key)
+    if column is None:
+        column= []
+        columns[key]= column
+    if len(column) <= index:
+        column.extend( [_missing] * (index + 1 - len(column)) )
+    column[index]= value
+    return columns
+
+class _Missing(object): # A picklable marker for values missing from a column
+    def __reduce__(self):
+        return '_missing'
+    def __repr__(self):
+        return '_missing'
+
+_missing= _Missing()
@@ -0,0 +1,269 @@
+# Keeps the data of states in a memory mapped, append only file, decoding each field only when it is used
+
+import atexit
+import collections
+import collections.abc
+import hashlib
+import mmap
+import os
+import pickle
+import struct
+import tempfile
+import threading
+
+import funtool.compact_state
+import funtool.state_collection
+
+DataStore = collections.namedtuple('DataStore',['path','file','lock','mapping','temporary'])
+
+# A DataStore is an append only file of encoded state data, read through a memory map
+#
+# path          the absolute path of the store file
+# file          the store file, opened for appending
+# lock          guards appending to the file and remapping it
+# mapping       a dict with the current mmap ( or None ), the mapped size, and the end of the file
+# temporary     true if the file is removed when python exits ( by the process which created it )
+#
+# Each record holds the data of one state: the length of its field index, the field index ( a pickled list of
+# key, offset, length triples ), then each value pickled separately, so a field can be decoded without the others.
+# Records are never changed once written, values set on the data afterwards are kept in memory by StoredData.
+#
+# Stores are opened once per python process and shared by path. Pickled StoredData only holds the store path, the
+# record position, and the keys set or deleted since, so worker processes read the same file. A store used by a snapshot ( or checkpoint ) must be
+# kept for as long as the snapshot is, temporary stores are only suitable for a single analysis run.
+
+_header_format= struct.Struct('<Q')
+
+_open_stores= {}
+_open_stores_lock= threading.Lock()
+
+
+def open_data_store(path=None):
+    """
+    Opens the store at path ( creating it if needed ), or a temporary store when path is None
+
+    Opening the same path again returns the same DataStore. Records are appended to any already in the file.
+    """
+    temporary= path is None
+    if temporary:
+        file_descriptor, path= tempfile.mkstemp(prefix='funtool_data_', suffix='.store')
+        os.close(file_descriptor)
+    path= os.path.abspath(path)
+    with _open_stores_lock:
+        if path not in _open_stores:
+            directory= os.path.dirname(path)
+            if not os.path.exists(directory):
+                os.makedirs(directory)
+            store_file= open(path, 'ab')
+            _open_stores[path]= DataStore(path, store_file, threading.Lock(),
+                { 'mmap': None, 'size': 0, 'end': store_file.tell(), 'pid': os.getpid() }, temporary)
+        return _open_stores[path]
+
+def close_data_store(data_store):
+    """
+    Closes the store, removing its file if it is temporary. StoredData from the store can't be read once it is closed.
+    """
+    with _open_stores_lock:
+        _open_stores.pop(data_store.path, None)
+    with data_store.lock:
+        if data_store.mapping['mmap'] != None:
+            data_store.mapping['mmap'].close()
+            data_store.mapping['mmap']= None
+        data_store.file.close()
+    if data_store.temporary and data_store.mapping['pid'] == os.getpid() and os.path.exists(data_store.path):
+        os.remove(data_store.path)
+    return data_store
+
+def store_data(data_store, data):
+    """
+    Appends the fields of a data dict to the store and returns a StoredData for them
+    """
+    index= []
+    values= []
+    position= 0
+    for key, value in data.items():
+        encoded_value= pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+        index.append( (key, position, len(encoded_value)) )
+        values.append(encoded_value)
+        position+= len(encoded_value)
+    encoded_index= pickle.dumps(index, pickle.HIGHEST_PROTOCOL)
+    record= b''.join( [ _header_format.pack(len(encoded_index)), encoded_index ] + values )
+    with data_store.lock:
+        offset= data_store.mapping['end']
+        data_store.file.write(record)
+        data_store.mapping['end']+= len(record)
+    return StoredData(data_store, offset, len(record))
+
+def store_state_data(state_collection, data_store):
+    """
+    Returns a StateCollection with the data of each state moved to the store
+
+    States are namedtuples, so each state is replaced by a copy holding a StoredData, and groups are updated to
+    hold the copies. The data of StateViews ( see funtool.compact_state ) is replaced in their CompactStateStore.
+    States which already hold StoredData are left as they are.
+    """
+    replacements= {}
+    states= []
+    for state in state_collection.states:
+        if isinstance(state, funtool.compact_state.StateView):
+            if not isinstance(state.data, StoredData):
+                state.replace_data(store_data(data_store, state.data))
+        elif not isinstance(state.data, StoredData):
+            stored_state= state._replace(data=store_data(data_store, state.data))
+            replacements[id(state)]= stored_state
+            state= stored_state
+        states.append(state)
+    flush_data_store(data_store)
+    for grouping in state_collection.groupings.values():
+        for group in grouping.values():
+            group.states[:]= [ replacements.get(id(state), state) for state in group.states ]
+    return funtool.state_collection.StateCollection(states, state_collection.groupings)
+
+def flush_data_store(data_store):
+    with data_store.lock:
+        data_store.file.flush()
+    return data_store
+
+def read_bytes(data_store, offset, length):
+    """
+    Returns length bytes of the store starting at offset, remapping the file if it has grown
+    """
+    with data_store.lock:
+        if offset + length > data_store.mapping['size']:
+            data_store.file.flush()
+            if data_store.mapping['mmap'] != None:
+                data_store.mapping['mmap'].close()
+            with open(data_store.path, 'rb') as f:
+                data_store.mapping['mmap']= mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            if hasattr(mmap, 'MADV_RANDOM'): # fields are read a few at a time, reading ahead would map in the values not used
+                data_store.mapping['mmap'].madvise(mmap.MADV_RANDOM)
+            data_store.mapping['size']= len(data_store.mapping['mmap'])
+        return data_store.mapping['mmap'][offset:offset + length]
+
+
+class StoredData(collections.abc.MutableMapping):
+    """
+    The data of a state, kept in a DataStore and decoded a field at a time
+
+    Decoded values are cached, so a value is decoded once. Setting or deleting a key only changes this StoredData, 
+    the record in the store is never changed. release() drops the decoded values.
+
+    Pickling and hashing ( see hash_key ) only use the record and the keys set or deleted, so a mutable value changed
+    in place must be set again ( data[key]= value ) to be kept in a worker process or seen by an incremental run.
+    """
+    __slots__= ('data_store', 'offset', 'length', '_index', '_decoded', '_changed', '_deleted')
+
+    def __init__(self, data_store, offset, length, changed=None, deleted=None):
+        self.data_store= data_store
+        self.offset= offset
+        self.length= length
+        self._index= None
+        self._decoded= {}
+        self._changed= changed or {}
+        self._deleted= deleted or set()
+
+    def __getitem__(self, key):
+        if key in self._changed:
+            return self._changed[key]
+        if key in self._deleted:
+            raise KeyError(key)
+        if key not in self._decoded:
+            value_offset, value_length= self._field_index()[key]
+            self._decoded[key]= pickle.loads(read_bytes(self.data_store, value_offset, value_length))
+        return self._decoded[key]
+
+    def __setitem__(self, key, value):
+        self._changed[key]= value
+        self._decoded.pop(key, None)
+        self._deleted.discard(key)
+
+    def __delitem__(self, key):
+        if key not in self:
+            raise KeyError(key)
+        self._changed.pop(key, None)
+        self._decoded.pop(key, None)
+        if key in self._field_index():
+            self._deleted.add(key)
+
+    def __contains__(self, key):
+        return key in self._changed or ( key not in self._deleted and key in self._field_index() )
+
+    def __iter__(self):
+        for key in self._field_index():
+            if key not in self._deleted and key not in self._changed:
+                yield key
+        for key in list(self._changed):
+            yield key
+
+    def __len__(self):
+        return len([ key for key in self._field_index() if key not in self._deleted and key not in self._changed ]) + len(self._changed)
+
+    def __repr__(self):
+        return 'StoredData(%s, offset=%s, length=%s)'% (self.data_store.path, self.offset, self.length)
+
+    def __reduce__(self): # only the position of the record is pickled, with the keys set or deleted
+        flush_data_store(self.data_store)
+        return ( _stored_data, (self.data_store.path, self.offset, self.length, self._changed, self._deleted) )
+
+    def copy(self):
+        return dict(self)
+
+    def __copy__(self): # a StoredData for the same record, sharing the decoded values but not later changes
+        stored_data= StoredData(self.data_store, self.offset, self.length, dict(self._changed), set(self._deleted))
+        stored_data._index= self._index
+        stored_data._decoded= dict(self._decoded)
+        return stored_data
+
+    def changed_items(self):
+        """
+        Returns a dict of the keys set since the data was stored, and their values
+        """
+        return dict(self._changed)
+
+    def hash_key(self):
+        """
+        Returns a value which funtool.lib.general.hash_value hashes in place of the data, without decoding the record
+        
+        The record bytes are hashed rather than their position, so the same data stored again has the same hash
+        """
+        return { 'record': hashlib.sha1(read_bytes(self.data_store, self.offset, self.length)).hexdigest(),
+            'changed': self._changed, 'deleted': sorted(self._deleted, key=repr) }
+
+    def release(self):
+        """
+        Drops the decoded values, they are decoded again when next used
+        """
+        self._decoded= {}
+        return self
+
+    def _field_index(self):
+        if self._index is None:
+            index_length= _header_format.unpack(read_bytes(self.data_store, self.offset, _header_format.size))[0]
+            values_offset= self.offset + _header_format.size + index_length
+            self._index= { key:(values_offset + value_offset, value_length) for key, value_offset, value_length in
+                pickle.loads(read_bytes(self.data_store, self.offset + _header_format.size, index_length)) }
+        return self._index
+
+def _stored_data(path, offset, length, changed, deleted):
+    data_store= _open_stores.get(path)
+    if data_store is None:
+        data_store= open_data_store(path)
+    return StoredData(data_store, offset, length, changed, deleted)
+
+def _flush_open_stores(): # forked worker processes inherit the stores, so nothing may be left buffered
+    with _open_stores_lock:
+        data_stores= list(_open_stores.values())
+    for data_store in data_stores:
+        if not data_store.file.closed:
+            flush_data_store(data_store)
+
+def _close_temporary_stores():
+    with _open_stores_lock:
+        data_stores= [ data_store for data_store in _open_stores.values() if data_store.temporary ]
+    for data_store in data_stores:
+        close_data_store(data_store)
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(before=_flush_open_stores)
+
+atexit.register(_close_temporary_stores)
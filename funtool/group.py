@@ -27,8 +27,9 @@ def add_state_to_group(group,state):
     return group
 
 def add_group_reference_to_state(group, state):
-    if state.groupings.get(group.group_selector_name, None) is None:
+    state_groups= state.groupings.get(group.group_selector_name, None)
+    if state_groups is None:
         state.groupings[group.group_selector_name] = [ group ]
     else:
-        state.groupings[group.group_selector_name]+= [ group ]
+        state_groups.append(group)
     return state
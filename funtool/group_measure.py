@@ -1,15 +1,23 @@
 # A measure performed and recorded on an individual state
 
 import collections
+import copy
 import yaml
-import importlib
 import functools
+import concurrent.futures
 
+import funtool.state
 import funtool.state_collection
 import funtool.analysis
+import funtool.analysis_plan
 import funtool.logger
 
 import funtool.lib.config_parse
+import funtool.lib.lazy_import
+import funtool.lib.general
+import funtool.lib.parallel
+import funtool.analysis_profile
+import funtool.progress
 
 GroupMeasure = collections.namedtuple('GroupMeasure',['name','measure_module','measure_function','analysis_selectors','grouping_selectors','parameters'])
 
@@ -26,44 +34,183 @@ GroupMeasure = collections.namedtuple('GroupMeasure',['name','measure_module','m
 #
 #   After measuring each member of the grouping, the measure process returns a StateCollection
 
+
+class GroupMeasureError(Exception):
+    pass
+
 def group_measure_process(group_measure, loaded_processes): #returns a function, that accepts a state_collection, to be used as a process
     return _wrap_measure(individual_group_measure_process(group_measure), group_measure, loaded_processes)
 
 import_config= functools.partial(funtool.lib.config_parse.import_config, GroupMeasure, group_measure_process)
 
 def individual_group_measure_process(group_measure): #returns a function that accepts an analysis_collection and a state_collection
-    group_measure_module = importlib.import_module(group_measure.measure_module)
-    return functools.partial( getattr(group_measure_module,group_measure.measure_function), group_measure )
+    return funtool.lib.lazy_import.LazyFunction(group_measure.measure_module, group_measure.measure_function, group_measure)
 
 def _wrap_measure(individual_group_measure_process, group_measure, loaded_processes): 
     """
     Creates a function on a state_collection, which creates analysis_collections for each group in the collection.
+
+    Optionally measures the groups concurrently if the group_measure has an executor parameter
+        For example (as YAML):
+            executor:
+                type: process       (thread or process, defaults to thread)
+                workers: 8          (optional: defaults to the number of cpus)
+                chunk_size: 100     (optional: only used by process executors)
+    Results are written back in the order of the groups in the grouping, so reports match a serial run. Thread executors
+    measure a copy of each group and its states, so groups don't see each other's changes, as with process executors.
+
+    Groups for which reuse_group(grouping_name, group_key, group) is true are skipped ( see funtool.incremental )
     """
-    def wrapped_measure(state_collection,overriding_parameters=None,loggers=None):
+    def wrapped_measure(state_collection,overriding_parameters=None,loggers=None,reuse_group=None):
         if loggers == None:
             loggers = funtool.logger.set_default_loggers()
         if loaded_processes != None :
             if group_measure.grouping_selectors != None:
+                executor_parameters= (group_measure.parameters or {}).get('executor')
+                latencies= funtool.analysis_profile.current_latencies()
                 for grouping_selector_name in group_measure.grouping_selectors:
                     state_collection= funtool.state_collection.add_grouping(state_collection, grouping_selector_name, loaded_processes) 
-                    for group in funtool.state_collection.groups_in_grouping(state_collection, grouping_selector_name):
-                        analysis_collection = funtool.analysis.AnalysisCollection(None,group,{},{})
-                        if group_measure.analysis_selectors != None:
-                            for analysis_selector in group_measure.analysis_selectors:
-                                analysis_collection = loaded_processes["analysis_selector"][analysis_selector].process_function(analysis_collection,state_collection)
-                        if analysis_collection != None:
-                            individual_group_measure_process(analysis_collection,state_collection)
+                    group_keys= _group_keys_to_measure(state_collection, grouping_selector_name, reuse_group)
+                    progress= funtool.progress.start_progress(loggers, len(group_keys), unit='groups')
+                    if executor_parameters != None:
+                        _measure_groups_concurrently(state_collection, grouping_selector_name, group_keys, individual_group_measure_process, group_measure, loaded_processes, executor_parameters, latencies, progress)
+                    else:
+                        for group_key in group_keys:
+                            funtool.analysis_profile.timed_call(latencies, _measure_group, 
+                                state_collection.groupings[grouping_selector_name][group_key], state_collection, individual_group_measure_process, group_measure, loaded_processes)
+                            funtool.progress.advance_progress(progress)
+                    funtool.progress.finish_progress(progress)
+                for written_key in funtool.analysis_plan.declared_writes(group_measure):
+                    funtool.lib.general.invalidate_sorted_states(field_key=written_key)
         return state_collection
     return wrapped_measure
+
+def _group_keys_to_measure(state_collection, grouping_selector_name, reuse_group):
+    grouping= state_collection.groupings.get(grouping_selector_name, {})
+    if reuse_group is None:
+        return list(grouping.keys())
+    return [ group_key for group_key,group in grouping.items() if not reuse_group(grouping_selector_name, group_key, group) ]
+
+def _measure_group(group, state_collection, individual_group_measure_process, group_measure, loaded_processes):
+    analysis_collection = funtool.analysis.AnalysisCollection(None,group,{},{})
+    if group_measure.analysis_selectors != None:
+        for analysis_selector in group_measure.analysis_selectors:
+            analysis_collection = loaded_processes["analysis_selector"][analysis_selector].process_function(analysis_collection,state_collection)
+    if analysis_collection != None:
+        individual_group_measure_process(analysis_collection,state_collection)
+    return group
+
+def _measure_groups_concurrently(state_collection, grouping_selector_name, group_keys, individual_group_measure_process, group_measure, loaded_processes, executor_parameters, latencies=None, progress=None):
+    executor_type= executor_parameters.get('type', 'thread')
+    workers= funtool.lib.parallel.get_worker_count(executor_parameters)
+    if executor_type == 'thread':
+        groups= [ state_collection.groupings[grouping_selector_name][group_key] for group_key in group_keys ]
+        measured_groups= []
+        with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+            for measured_group, latency in executor.map( lambda group: funtool.analysis_profile.timed_result(_measure_isolated_group, 
+                    group, state_collection, individual_group_measure_process, group_measure, loaded_processes), groups):
+                measured_groups.append(measured_group)
+                if latencies != None: # appended here, since the histogram isn't thread safe
+                    latencies.append(latency)
+                if progress != None:
+                    funtool.progress.advance_progress(progress)
+        for group, (group_values, state_values) in zip(groups, measured_groups): # only written once every group is measured
+            _update_values(group, group_values)
+            for state, values in state_values:
+                _update_values(state, values)
+    elif executor_type == 'process':
+        _measure_groups_in_processes(state_collection, grouping_selector_name, group_keys, group_measure, loaded_processes, executor_parameters, workers, latencies, progress)
+    else:
+        raise GroupMeasureError("Unknown executor type for group measure " + group_measure.name + ": " + str(executor_type))
+    return state_collection
+
+def _measure_isolated_group(group, state_collection, individual_group_measure_process, group_measure, loaded_processes):
+    """
+    Measures a copy of the group and its states, returns the values changed on the group and the values changed on each state
+    """
+    isolated_states= [ funtool.state.State(state.id, copy.copy(state.data), dict(state.measures), dict(state.meta), state.groupings) 
+        for state in group.states ]
+    isolated_group= group._replace(states=isolated_states, measures=copy.copy(group.measures), meta=copy.copy(group.meta), data=copy.copy(group.data))
+    _measure_group(isolated_group, state_collection, individual_group_measure_process, group_measure, loaded_processes)
+    return ( _isolated_changes(group, isolated_group), 
+        [ (state, _isolated_changes(state, isolated_state)) for state, isolated_state in zip(group.states, isolated_states) ] )
+
+def _isolated_changes(target, isolated_target):
+    return tuple( _changed_items(getattr(target, field), getattr(isolated_target, field)) for field in [ 'measures', 'meta', 'data' ] )
+
+def _changed_items(original_values, isolated_values):
+    if hasattr(isolated_values, 'changed_items'): # StoredData only decodes the keys which were used
+        return isolated_values.changed_items()
+    return funtool.lib.parallel.changed_values(original_values, isolated_values)
+
+def _measure_groups_in_processes(state_collection, grouping_selector_name, group_keys, group_measure, loaded_processes, executor_parameters, workers, latencies=None, progress=None):
+    """
+    Measures the groups in chunks using a process pool, then merges the measures, meta, and data changed on each group 
+    and on its states back into the original objects, following the order of the groups in the grouping
+    """
+    grouping= state_collection.groupings.get(grouping_selector_name, {})
+    chunk_size= funtool.lib.parallel.get_chunk_size(executor_parameters, len(group_keys), workers)
+    chunks= funtool.lib.parallel.split_into_chunks(group_keys, chunk_size)
+    analysis_selector_processes= { analysis_selector:loaded_processes["analysis_selector"][analysis_selector] 
+        for analysis_selector in (group_measure.analysis_selectors or []) }
+    with concurrent.futures.ProcessPoolExecutor(max_workers=workers, initializer=_initialize_parallel_worker, 
+            initargs=(state_collection, grouping_selector_name, group_measure, analysis_selector_processes, latencies != None)) as executor:
+        for measured_chunk in executor.map(_measure_chunk, chunks):
+            for group_key, group_values, state_values, latency in measured_chunk:
+                _update_values(grouping[group_key], group_values)
+                for position, values in state_values:
+                    _update_values(state_collection.states[position], values)
+                if latencies != None and latency != None:
+                    latencies.append(latency)
+            if progress != None:
+                funtool.progress.advance_progress(progress, len(measured_chunk))
+    return state_collection
+
+def _update_values(target, values):
+    measures, meta, data= values
+    target.measures.update(measures)
+    target.meta.update(meta)
+    target.data.update(data)
+    return target
+
+# Each worker process keeps its own copy of the StateCollection and the processes needed to measure it
+
+_parallel_worker= {}
+
+def _initialize_parallel_worker(state_collection, grouping_selector_name, group_measure, analysis_selector_processes, measure_latency=False):
+    _parallel_worker['state_collection']= state_collection
+    _parallel_worker['grouping']= state_collection.groupings.get(grouping_selector_name, {})
+    _parallel_worker['state_positions']= { id(state):position for position,state in enumerate(state_collection.states) }
+    _parallel_worker['group_measure']= group_measure
+    _parallel_worker['loaded_processes']= { 'analysis_selector': analysis_selector_processes }
+    _parallel_worker['individual_group_measure_process']= individual_group_measure_process(group_measure)
+    _parallel_worker['measure_latency']= measure_latency
+
+def _measure_chunk(group_keys):
+    measured_chunk= []
+    for group_key in group_keys:
+        group= _parallel_worker['grouping'][group_key]
+        original_group_values= _copy_values(group)
+        original_state_values= [ (state, _copy_values(state)) for state in group.states ]
+        latencies= [] if _parallel_worker['measure_latency'] else None
+        funtool.analysis_profile.timed_call(latencies, _measure_group, group,
+            _parallel_worker['state_collection'],
+            _parallel_worker['individual_group_measure_process'],
+            _parallel_worker['group_measure'],
+            _parallel_worker['loaded_processes'])
+        state_values= [ (_parallel_worker['state_positions'][id(state)], _changed_values(original_values, state))
+            for state,original_values in original_state_values if id(state) in _parallel_worker['state_positions'] ]
+        measured_chunk.append( (group_key, _changed_values(original_group_values, group), state_values, latencies[0] if latencies else None) )
+    return measured_chunk
+
+def _copy_values(target):
+    return ( dict(target.measures), dict(target.meta), dict(target.data) )
+
+def _changed_values(original_values, target):
+    return tuple( funtool.lib.parallel.changed_values(original_dict, current_dict) 
+        for original_dict,current_dict in zip(original_values, _copy_values(target)) )
         
 
 
-def get_measure_parameters(group_measure, overriding_parameters):
-    measure_parameters= group_measure.parameters
-    if overriding_parameters != None:
-        if measure_parameters is None:
-            measure_parameters = {}
-        for param, val in overriding_parameters.items():
-            measure_parameters[param] = val
-    return measure_parameters
+get_measure_parameters= funtool.lib.general.get_parameters
 
@@ -1,10 +1,12 @@
 # Defines Grouping Selector 
 import collections
 import yaml
-import importlib
 import functools
+import collections.abc
 
+import funtool.group
 import funtool.lib.config_parse
+import funtool.lib.lazy_import
 import funtool.lib.general
 
 GroupingSelector = collections.namedtuple('GroupingSelector',['name','selector_module','selector_function','parameters'])
@@ -22,10 +24,95 @@ GroupingSelector = collections.namedtuple('GroupingSelector',['name','selector_m
 #  AND WITH groupings updated in each state !!!
 
 
+class GroupingSelectorError(Exception):
+    pass
+
+
 def grouping_selector_process(grouping_selector): #returns a function, that accepts a state_collection, to be used as a process
-    grouping_selector_module = importlib.import_module(grouping_selector.selector_module)
-    return functools.partial( getattr(grouping_selector_module,grouping_selector.selector_function), grouping_selector )
+    return funtool.lib.lazy_import.LazyFunction(grouping_selector.selector_module, grouping_selector.selector_function, grouping_selector)
 
 import_config= functools.partial(funtool.lib.config_parse.import_config, GroupingSelector, grouping_selector_process)
     
 get_selector_parameters= funtool.lib.general.get_parameters
+
+
+# Built in grouping selectors
+
+def group_by_key(grouping_selector, state_collection, overriding_parameters=None, loggers=None):
+    """
+    Groups states by the values of one or more keys in a single pass over the states
+
+    The group_by parameter is a state field: field key pair, or a list of them for a composite key
+        For example (as YAML):
+            group_by_user:
+                selector_module: funtool.grouping_selector
+                selector_function: group_by_key
+                parameters:
+                    group_by:
+                        meta: user_id
+    or
+                    group_by:
+                        - meta: user_id
+                        - data: level
+
+    The state field may also be given as measure ( for measures ), as in sort_by.
+
+    The group key is the value ( or a tuple of values for a composite key ), and the group meta holds each field key with its value.
+    States missing any of the values are not placed in a group. Groups are ordered by their first state. Values which 
+    can't be group keys ( such as lists or dicts ) raise a GroupingSelectorError.
+    """
+    selector_parameters= get_selector_parameters(grouping_selector, overriding_parameters)
+    key_fields= _group_by_fields(selector_parameters['group_by'])
+    grouped_states= {}
+    for state in state_collection.states:
+        group_key= _group_key(state, key_fields)
+        if group_key is None:
+            continue
+        try:
+            grouped_states[group_key].append(state)
+        except KeyError:
+            grouped_states[group_key]= [ state ]
+        except TypeError:
+            raise GroupingSelectorError(_unhashable_key_message(grouping_selector, state, key_fields))
+    grouping= {}
+    for group_key, group_states in grouped_states.items():
+        group_values= group_key if len(key_fields) > 1 else (group_key,)
+        group_meta= { field_key:value for (attribute_name, field_key), value in zip(key_fields, group_values) }
+        grouping[group_key]= funtool.group.create_group(grouping_selector.name, group_states, {}, group_meta, {})
+    state_collection.groupings[grouping_selector.name]= grouping
+    return state_collection
+
+def _group_by_fields(group_by): # converts the group_by parameter to a list of ( attribute_name, field_key ) tuples
+    if isinstance(group_by, collections.abc.Mapping):
+        group_by= [ group_by ]
+    key_fields= []
+    for field in group_by:
+        field_name, field_key= funtool.lib.general.get_tuple(field)
+        if field_name not in funtool.lib.general.state_attribute_names:
+            raise GroupingSelectorError("Unknown state field for group_by: " + str(field_name) + 
+                " ( expected one of " + ', '.join(funtool.lib.general.state_attribute_names) + " )")
+        key_fields.append( (funtool.lib.general.state_attribute_names[field_name], field_key) )
+    return key_fields
+
+def _group_key(state, key_fields):
+    if len(key_fields) == 1:
+        attribute_name, field_key= key_fields[0]
+        return getattr(state, attribute_name).get(field_key)
+    values= tuple( getattr(state, attribute_name).get(field_key) for attribute_name, field_key in key_fields )
+    if None in values:
+        return None
+    return values
+
+def _unhashable_key_message(grouping_selector, state, key_fields):
+    unhashable_fields= [ (attribute_name, field_key, getattr(state, attribute_name).get(field_key)) for attribute_name, field_key in key_fields
+        if not _is_hashable(getattr(state, attribute_name).get(field_key)) ]
+    return "Grouping selector " + grouping_selector.name + " can't group state " + str(state.id) + " by " + ", ".join(
+        "%s: %s ( a %s value, %r )"% (attribute_name, field_key, type(value).__name__, value) for attribute_name, field_key, value in unhashable_fields 
+        ) + ", group keys must be hashable values such as strings, numbers or tuples"
+
+def _is_hashable(value): # a tuple is Hashable even when it holds a list, so this tries to hash the value
+    try:
+        hash(value)
+        return True
+    except TypeError:
+        return False
@@ -0,0 +1,179 @@
+# Supports incremental analyses, which only measure the states and groups that changed since the previous run
+
+import collections
+import os
+
+import funtool.analysis_plan
+import funtool.snapshot
+import funtool.lib.general
+
+IncrementalRun = collections.namedtuple('IncrementalRun',['snapshot_path','analysis_hash','previous_collection','previous_hashes','state_hashes','changed_state_ids'])
+
+# An IncrementalRun holds what is needed to compare the current run of an analysis with the previous one
+#
+# snapshot_path         where the final StateCollection of the analysis is saved
+# analysis_hash         a hash of the analysis processes, a previous snapshot is only used when the analysis hasn't changed
+# previous_collection   the StateCollection saved by the previous run, or None
+# previous_hashes       a dict of state id: hash of the state data and meta, as loaded by the adaptors of the previous run
+# state_hashes          a dict of state id: hash of the state data and meta, as loaded by the adaptors of this run
+# changed_state_ids     a set of the ids of states which are new or changed since the previous run
+#
+# After each adaptor, states which are unchanged are replaced by the state from the previous run ( with its measures ).
+# State measures then skip the unchanged states whose groups are unchanged, and group measures skip groups with the 
+# same states as the previous run, restoring the previous group measures instead.
+#
+# Incremental runs assume a state's measures only depend on the state itself and the groups it belongs to. So every
+# member of a group with a changed state, or with different states than in the previous run, is measured again.
+#
+# Measures with analysis_selectors or a sort_by parameter may depend on other states ( such as the previous state
+# found by neighboring_states ), so they measure every state. Unchanged states whose values for such a measure change
+# are then treated as changed by the later measures. A measure which only depends on its selected states through
+# the state's groups can opt in to reusing values:
+#   For example (as YAML):
+#       parameters:
+#           incremental: reuse
+#
+# Streamed states are collected after each adaptor, since they are compared with the previous run as a whole.
+
+
+def start_incremental_run(analysis, incremental_dir):
+    """
+    Returns an IncrementalRun for the analysis, loading the previous snapshot from incremental_dir if it exists
+    """
+    snapshot_path= os.path.join(incremental_dir, analysis.name + '.snapshot')
+    analysis_hash= funtool.lib.general.hash_value(_analysis_description(analysis))
+    previous_collection= None
+    previous_hashes= {}
+    if os.path.exists(snapshot_path):
+        saved_collection, extra= funtool.snapshot.load_snapshot(snapshot_path)
+        if extra != None and extra.get('analysis_hash') == analysis_hash:
+            previous_collection= saved_collection
+            previous_hashes= extra['state_hashes']
+    return IncrementalRun(snapshot_path, analysis_hash, previous_collection, previous_hashes, {}, set())
+
+def has_previous_run(incremental_run):
+    return incremental_run.previous_collection != None
+
+def merge_previous_states(incremental_run, state_collection):
+    """
+    Replaces the unchanged states in the collection with the states from the previous run, and records the changed states
+
+    Used after an adaptor, returns the merged StateCollection
+    """
+    previous_states= { state.id:state for state in (incremental_run.previous_collection.states if has_previous_run(incremental_run) else []) }
+    previous_state_ids= set( id(state) for state in previous_states.values() )
+    merged_states= []
+    for state in state_collection.states:
+        if id(state) in previous_state_ids: # already merged by an earlier adaptor
+            merged_states.append(state)
+            continue
+        state_hash= state_content_hash(state)
+        incremental_run.state_hashes[state.id]= state_hash
+        previous_state= previous_states.get(state.id)
+        if previous_state != None and incremental_run.previous_hashes.get(state.id) == state_hash:
+            previous_state.groupings.clear() # groupings are rebuilt during this run
+            merged_states.append(previous_state)
+        else:
+            incremental_run.changed_state_ids.add(state.id)
+            merged_states.append(state)
+    state_collection.states[:]= merged_states
+    funtool.lib.general.invalidate_sorted_states(states=state_collection.states)
+    return state_collection
+
+def state_content_hash(state):
+    return funtool.lib.general.hash_value( [ state.data, state.meta ] )
+
+def reuse_state(incremental_run):
+    """
+    Returns a function which is true for a state that was measured in the previous run, hasn't changed, and only
+    belongs to groups which haven't changed
+    """
+    changed_groups= {} # id(group): ( group, true if the group changed )
+    previous_memberships= {} # grouping name: set of frozensets of the state ids of each group in the previous run
+    def group_changed(group):
+        if id(group) not in changed_groups:
+            changed_groups[id(group)]= ( group, _group_changed(incremental_run, group, previous_memberships) )
+        return changed_groups[id(group)][1]
+    def reuse(state):
+        if not has_previous_run(incremental_run) or state.id in incremental_run.changed_state_ids:
+            return False
+        return not any( group_changed(group) for groups in state.groupings.values() for group in groups )
+    return reuse
+
+def reuses_values(measure):
+    """
+    Returns true if the previous values of a state or group measure may be reused ( see above )
+    """
+    parameters= measure.parameters or {}
+    if parameters.get('incremental') != None:
+        return parameters['incremental'] == 'reuse'
+    return not measure.analysis_selectors and 'sort_by' not in parameters
+
+def record_changed_values(incremental_run, state_collection, measure):
+    """
+    Returns a function to call on the StateCollection once a measure which doesn't reuse values has run, it adds the
+    unchanged states whose values for the keys written by the measure changed to the changed states
+    """
+    written_keys= funtool.analysis_plan.declared_writes(measure)
+    previous_values= { id(state):_written_values(state, written_keys) for state in state_collection.states
+        if state.id not in incremental_run.changed_state_ids }
+    def record(measured_collection):
+        for state in measured_collection.states:
+            if id(state) in previous_values and _written_values(state, written_keys) != previous_values[id(state)]:
+                incremental_run.changed_state_ids.add(state.id)
+        return measured_collection
+    return record
+
+def _written_values(state, written_keys):
+    return [ ( state.measures.get(key), state.meta.get(key), state.data.get(key) ) for key in written_keys ]
+
+def reuse_group(incremental_run):
+    """
+    Returns a function of ( grouping_name, group_key, group ) which restores the previous results of a group that
+    has the same unchanged states as in the previous run. It returns true when the results were restored.
+    """
+    def reuse(grouping_name, group_key, group):
+        if not has_previous_run(incremental_run):
+            return False
+        previous_group= incremental_run.previous_collection.groupings.get(grouping_name, {}).get(group_key)
+        if previous_group is None:
+            return False
+        state_ids= [ state.id for state in group.states ]
+        if state_ids != [ state.id for state in previous_group.states ]:
+            return False
+        if any( state_id in incremental_run.changed_state_ids for state_id in state_ids ):
+            return False
+        group.measures.update(previous_group.measures)
+        for (group_values, previous_values) in ((group.meta, previous_group.meta), (group.data, previous_group.data)):
+            for key, value in previous_values.items():
+                if key not in group_values:
+                    group_values[key]= value
+        return True
+    return reuse
+
+def _group_changed(incremental_run, group, previous_memberships):
+    if any( state.id in incremental_run.changed_state_ids for state in group.states ):
+        return True
+    grouping_name= group.group_selector_name
+    if grouping_name not in previous_memberships:
+        previous_memberships[grouping_name]= set( frozenset( state.id for state in previous_group.states )
+            for previous_group in incremental_run.previous_collection.groupings.get(grouping_name, {}).values() )
+    return frozenset( state.id for state in group.states ) not in previous_memberships[grouping_name]
+
+def save_incremental_run(incremental_run, state_collection):
+    """
+    Saves the final StateCollection of the analysis for the next incremental run
+    """
+    extra= { 'analysis_hash': incremental_run.analysis_hash, 'state_hashes': incremental_run.state_hashes }
+    return funtool.snapshot.save_snapshot(state_collection, incremental_run.snapshot_path, extra)
+
+def _analysis_description(analysis): # A description of the analysis processes which doesn't depend on memory addresses
+    return [ analysis.name,
+        [ list(process_identifier) for process_identifier in analysis.process_identifiers ],
+        [ _process_description(process) for process in analysis.processes ] ]
+
+def _process_description(process):
+    collection= getattr(process, 'collection', None)
+    if hasattr(collection, 'process_identifiers'):
+        return _analysis_description(collection)
+    return repr(collection)
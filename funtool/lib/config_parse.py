@@ -1,10 +1,42 @@
 import yaml
 import copy
+import os
+import threading
+
+# Parsed config files are cached by path, and reparsed when the file's modification time or size changes.
+#   Cached configs are shared, so callers copy anything they change ( parse_parameters copies the process parameters ).
+#   Configs are parsed with the C based yaml loader when PyYAML was built with libyaml.
+
+yaml_loader= getattr(yaml, 'CSafeLoader', yaml.SafeLoader)
+
+_yaml_cache= {}
+_yaml_cache_lock= threading.Lock()
+
+
+def load_yaml(config_file_location):
+    """
+    Returns the parsed contents of a YAML config file, reusing the previous result if the file hasn't changed
+    """
+    file_stat= os.stat(config_file_location)
+    file_version= ( file_stat.st_mtime_ns, file_stat.st_size )
+    cache_key= os.path.abspath(config_file_location)
+    with _yaml_cache_lock:
+        cached= _yaml_cache.get(cache_key)
+    if cached != None and cached[0] == file_version:
+        return cached[1]
+    with open(config_file_location) as f:
+        yaml_config= yaml.load(f, Loader=yaml_loader)
+    with _yaml_cache_lock:
+        _yaml_cache[cache_key]= ( file_version, yaml_config )
+    return yaml_config
+
+def clear_yaml_cache():
+    with _yaml_cache_lock:
+        _yaml_cache.clear()
 
 def import_config( process_tuple, process_loading_function, config_file_location, loaded_processes= None):
     new_processes={}
-    with open(config_file_location) as f:
-        yaml_config= yaml.load(f)
+    yaml_config= load_yaml(config_file_location)
     dependent_load_function= 'loaded_processes' in process_loading_function.__code__.co_varnames
     if not( yaml_config is None):
         for process_name,process_parameters in yaml_config.items():
@@ -1,16 +1,91 @@
 import copy
 import functools
+import collections
+import threading
+import hashlib
+import json
+import collections.abc
 
 
 
 def get_parameters(process_tuple, overriding_parameters):
-    tuple_parameters= copy.deepcopy(process_tuple.parameters)
-    if overriding_parameters != None:
-        if tuple_parameters is None:
-            tuple_parameters = {}
-        for param, val in overriding_parameters.items():
-            tuple_parameters[param] = val
-    return tuple_parameters
+    """
+    Returns the parameters of a process merged with the overriding parameters, as read-only FrozenParameters
+    ( or None if there are neither )
+
+    FrozenParameters are dicts ( and lists in them are FrozenLists ), changing them raises a TypeError, use 
+    thaw_parameters or copy() for a mutable copy. Overriding parameters which are already FrozenParameters were 
+    merged by get_parameters, so they are returned as they are. Measures resolve their parameters once per run and 
+    pass them as the overriding parameters of each state ( see funtool.state_measure ).
+    """
+    if isinstance(overriding_parameters, FrozenParameters):
+        return overriding_parameters
+    if process_tuple.parameters is None and overriding_parameters is None:
+        return None
+    merged_parameters= dict(process_tuple.parameters or {})
+    merged_parameters.update(overriding_parameters or {})
+    return FrozenParameters(merged_parameters)
+
+def _read_only(self, *args, **kwargs):
+    raise TypeError("Parameters are read-only, use funtool.lib.general.thaw_parameters for a mutable copy")
+
+class FrozenParameters(dict):
+    """
+    A read-only dict of parameters, any dicts and lists in the values are frozen as well
+    """
+    __slots__= ()
+
+    def __init__(self, values=None):
+        dict.__init__(self, ( (key, freeze_parameters(value)) for key,value in (values or {}).items() ))
+
+    __setitem__= __delitem__= clear= pop= popitem= setdefault= update= __ior__= _read_only
+
+    def __repr__(self):
+        return 'FrozenParameters(%s)'% dict.__repr__(self)
+
+    def __reduce__(self):
+        return ( FrozenParameters, (dict(self),) )
+
+class FrozenList(list):
+    """
+    A read-only list of parameters
+    """
+    __slots__= ()
+
+    def __init__(self, values=()):
+        list.__init__(self, ( freeze_parameters(value) for value in values ))
+
+    __setitem__= __delitem__= append= extend= insert= pop= remove= clear= sort= reverse= __iadd__= __imul__= _read_only
+
+    def __repr__(self):
+        return 'FrozenList(%s)'% list.__repr__(self)
+
+    def __reduce__(self):
+        return ( FrozenList, (list(self),) )
+
+def freeze_parameters(value):
+    """
+    Returns a read-only copy of a parameter value, dicts become FrozenParameters and lists become FrozenLists
+    """
+    if isinstance(value, (FrozenParameters, FrozenList)):
+        return value
+    if isinstance(value, collections.abc.Mapping):
+        return FrozenParameters(value)
+    if isinstance(value, list):
+        return FrozenList(value)
+    if isinstance(value, set):
+        return frozenset(value)
+    return value
+
+def thaw_parameters(value):
+    """
+    Returns a mutable copy of frozen parameters, the reverse of freeze_parameters
+    """
+    if isinstance(value, collections.abc.Mapping):
+        return { key:thaw_parameters(item) for key,item in value.items() }
+    if isinstance(value, FrozenList):
+        return [ thaw_parameters(item) for item in value ]
+    return copy.deepcopy(value)
 
 def get_tuple(my_dict):
     """
@@ -24,7 +99,31 @@ def get_tuple(my_dict):
         return ( None, None )
 
 
-def sort_states(states, sort_list):
+def hash_value(value):
+    """
+    Returns a hex digest of a value, such as state data or process parameters
+
+    Dicts are hashed independent of key order. Values which can't be represented as JSON are hashed by their repr.
+    """
+    try:
+        value_json= json.dumps(value, sort_keys=True, default=_hashable_default)
+    except (TypeError, ValueError):
+        value_json= repr(value)
+    return hashlib.sha1(value_json.encode('utf8')).hexdigest()
+
+def _hashable_default(value):
+    if hasattr(value, 'hash_key'): # such as funtool.data_store.StoredData, which would otherwise be decoded
+        return value.hash_key()
+    if isinstance(value, collections.abc.Mapping):
+        return dict(value)
+    if isinstance(value, (set, frozenset)):
+        return sorted(value, key=repr)
+    if isinstance(value, (tuple, list)):
+        return list(value)
+    return repr(value)
+
+
+def sort_states(states, sort_list, key_cache=None):
     """
     Returns a list of sorted states, original states list remains unsorted
 
@@ -63,58 +162,144 @@ def sort_states(states, sort_list):
     NOT
         - -groupings: ...
         
+    Missing ( or None ) values sort before any other value, or after them when the sort is inverted.
+
+    The sort list is compiled into a single key, so the states are sorted once. An optional key_cache dict keeps the
+    field values read from each state, so later sorts using the same fields don't read them again. The cache is keyed 
+    on id(state), so it should only be reused while the states it was built from exist and their fields are unchanged.
+    """
+    sort_fields= compile_sort_list(sort_list)
+    if key_cache is None:
+        key_cache= {}
+    return sorted(states, key= lambda state: _sort_key(state, sort_fields, key_cache))
+
+def cached_sort_states(states, sort_list):
+    """
+    Returns the same result as sort_states, reusing the order from an earlier sort of the same states list with the same sort fields
+
+    A cached order is dropped when states are added to ( or removed from ) the list, or when invalidate_sorted_states 
+    is called for one of the sorted fields. State and group measures invalidate the keys they write after each run
+    ( their name, or their declared writes, see funtool.analysis_plan ). Every other step of an analysis, except 
+    reporters, may change any state, so run_analysis drops every cached order after them and at the end of the run.
+    """
+    sort_fields= compile_sort_list(sort_list)
+    try:
+        cache_key= ( id(states), sort_fields )
+        hash(cache_key)
+    except TypeError: # unhashable field keys can't be cached
+        return sort_states(states, sort_list)
+    with _sorted_states_lock:
+        cached= _sorted_states_cache.get(cache_key)
+        if cached != None and cached[0] is states and cached[1] == len(states):
+            _sorted_states_cache.move_to_end(cache_key)
+            return list(cached[2])
+    sorted_states= sort_states(states, sort_list)
+    with _sorted_states_lock:
+        _sorted_states_cache[cache_key]= ( states, len(states), sorted_states )
+        while len(_sorted_states_cache) > sorted_states_cache_size:
+            _sorted_states_cache.popitem(last=False)
+    return list(sorted_states)
+
+def invalidate_sorted_states(field_key=None, grouping_name=None, states=None):
+    """
+    Removes cached orders ( see cached_sort_states ) which sort on field_key in any state or group field, 
+    which sort on values from the named grouping, or which sort the given states list. With no arguments, every
+    cached order is removed.
+
+    Returns the number of cached orders removed
+    """
+    clear_all= field_key is None and grouping_name is None and states is None
+    with _sorted_states_lock:
+        invalid_keys= [ cache_key for cache_key in _sorted_states_cache.keys() 
+            if clear_all or ( states is not None and cache_key[0] == id(states) ) or 
+                any( _sort_field_matches(field, field_key, grouping_name) for inverted, field in cache_key[1] ) ]
+        for cache_key in invalid_keys:
+            del _sorted_states_cache[cache_key]
+    return len(invalid_keys)
+
+def _sort_field_matches(field, field_key, grouping_name):
+    if field_key is not None and field[-1] == field_key:
+        return True
+    return grouping_name is not None and field[0] == 'groupings' and field[1] == grouping_name
+
+# Cached orders, keyed on ( id(states), sort fields ) with values of ( states, len(states), sorted states )
+#   The states list is kept so its id can't be reused by another list while the order is cached
 
+sorted_states_cache_size= 16
+
+_sorted_states_cache= collections.OrderedDict()
+
+_sorted_states_lock= threading.Lock()
+
+def compile_sort_list(sort_list):
+    """
+    Returns a tuple of ( inverted, field ) pairs for a sort list ( see sort_states ), in order of precedence
+
+    A field is either ( 'state', attribute_name, field_key ) or ( 'groupings', grouping_name, grouping_index, attribute_name, field_key )
+    The result is hashable, so it can be used to identify a sort
     """
-    sorted_states= states.copy()
-    for sort_pair in reversed( _convert_list_of_dict_to_tuple(sort_list) ):
-        if sort_pair[0].lstrip('-') in ['data','measure','meta']:
-            sorted_states= _state_value_sort(sorted_states, sort_pair, _state_key_function)
+    sort_fields= []
+    for sort_pair in _convert_list_of_dict_to_tuple(sort_list):
+        if sort_pair[0].lstrip('-') in state_attribute_names:
+            attribute_name= state_attribute_names[sort_pair[0].lstrip('-')]
+            for field_key in _as_list(sort_pair[1]):
+                sort_fields.append( (sort_pair[0][0] == '-', ('state', attribute_name, field_key)) )
         elif sort_pair[0] == 'groupings':
-            for grouping in reversed(sort_pair[1]):
-                sorted_states= _groupings_values_sort(sorted_states, grouping)
-    return sorted_states
-
-def _state_value_sort(states, sort_pair, key_function):
-    sorted_states= states.copy()
-    attribute_name= sort_pair[0].lstrip('-')
-    if sort_pair[0][0] == '-':
-        reverse= True
-    else:
-        reverse= False
-    if type(sort_pair[1]) == list:
-        for sort_value in reversed(sort_pair[1]):
-            sorted_states= sorted(sorted_states, key= lambda state: key_function(state, attribute_name, sort_value), reverse= reverse)
-    else:
-        sorted_states= sorted(sorted_states, key= lambda state: key_function(state, attribute_name, sort_pair[1]), reverse= reverse)
-    return sorted_states
-
-def _groupings_values_sort(states, grouping):
-    grouping_name= next(iter( grouping.keys() ))
-    grouping_details= next(iter( grouping.values() ))
-    grouping_index= grouping_details.get('index') or 0
-    sorted_states= states.copy()
-    for sort_pair in reversed(_convert_list_of_dict_to_tuple(grouping_details['values'])):
-        sorted_states= _state_value_sort( sorted_states, 
-            sort_pair, 
-            functools.partial(_grouping_key_function, grouping_name= grouping_name, grouping_index= grouping_index))
-    return sorted_states
-
-def _state_key_function(state, attribute_name, sort_value):
-    return _state_value(state, attribute_name,sort_value)
-
- # Since a group also has data,meta, and measures it can be treated like a state for the sort value lookup
-def _grouping_key_function(state, attribute_name, sort_value, grouping_name, grouping_index):
-    if len(state.groupings.get(grouping_name,[])) > grouping_index:
-        return _state_value(state.groupings.get(grouping_name,[])[grouping_index], attribute_name,sort_value)
-    else:
-        return MinType() #Incase of a missing group
+            for grouping in sort_pair[1]:
+                grouping_name= next(iter( grouping.keys() ))
+                grouping_details= next(iter( grouping.values() ))
+                grouping_index= grouping_details.get('index') or 0
+                for value_pair in _convert_list_of_dict_to_tuple(grouping_details['values']):
+                    attribute_name= state_attribute_names.get(value_pair[0].lstrip('-'), value_pair[0].lstrip('-'))
+                    for field_key in _as_list(value_pair[1]):
+                        sort_fields.append( (value_pair[0][0] == '-', ('groupings', grouping_name, grouping_index, attribute_name, field_key)) )
+    return tuple(sort_fields)
 
-def _state_value(state, attribute_name, attribute_value): # handles None values for sort
-    val= getattr(state, attribute_name,{}).get(attribute_value)
-    if val is None:
-        return MinType()
+state_attribute_names= { 'data':'data', 'meta':'meta', 'measures':'measures', 'measure':'measures' } # the state fields which parameters may name, measure is accepted for measures
+
+def _as_list(value):
+    if isinstance(value, (list, tuple)):
+        return value
+    return [ value ]
+
+def _sort_key(state, sort_fields, key_cache):
+    return tuple( _sort_value(_cached_field_value(state, field, key_cache), inverted) for inverted, field in sort_fields )
+
+def _cached_field_value(state, field, key_cache):
+    cache_key= (id(state), field)
+    try:
+        return key_cache[cache_key]
+    except KeyError:
+        value= _field_value(state, field)
+        key_cache[cache_key]= value
+        return value
+
+def _field_value(state, field): # Since a group also has data,meta, and measures it can be treated like a state for the value lookup
+    if field[0] == 'groupings':
+        groups= state.groupings.get(field[1],[])
+        if len(groups) <= field[2]:
+            return None #Incase of a missing group
+        state= groups[field[2]]
+        field= field[2:]
+    return getattr(state, field[1], {}).get(field[2])
+
+def _sort_value(value, inverted): # missing values are placed before all other values
+    if value is None:
+        sort_value= (0,)
     else:
-        return val
+        sort_value= (1, value)
+    if inverted:
+        return _InvertedValue(sort_value)
+    return sort_value
+
+class _InvertedValue(object):
+    __slots__= ('value',)
+    def __init__(self, value):
+        self.value= value
+    def __lt__(self, other):
+        return other.value < self.value
+    def __eq__(self, other):
+        return self.value == other.value
 
 # TODO replace this with a function that converts all single item dicts to tuples anywhere in a list(or sublist)
 def _convert_list_of_dict_to_tuple(dict_list): #converts a list of single key dicts to a list of tuples
@@ -0,0 +1,44 @@
+# Defers importing the modules of configured processes until the processes are used
+
+import functools
+import importlib
+import threading
+
+
+class LazyFunction(object):
+    """
+    A function from a module which is imported the first time the function is called ( or an attribute of it is used )
+
+    Any args are bound to the front of the function's arguments, like functools.partial
+    """
+    def __init__(self, module_name, function_name, *args):
+        self.module_name= module_name
+        self.function_name= function_name
+        self.args= args
+        self._function= None
+        self._lock= threading.Lock()
+
+    def resolve(self):
+        """
+        Imports the module and returns the function with its bound args
+        """
+        if self._function is None:
+            with self._lock:
+                if self._function is None:
+                    module= importlib.import_module(self.module_name)
+                    self._function= functools.partial( getattr(module, self.function_name), *self.args )
+        return self._function
+
+    def __call__(self, *args, **kwargs):
+        return self.resolve()(*args, **kwargs)
+
+    def __getattr__(self, name): # attributes set by decorators, such as streamable, are read from the imported function
+        if name.startswith('__') or name in ('_function', '_lock'):
+            raise AttributeError(name)
+        return getattr(self.resolve(), name)
+
+    def __reduce__(self): # only the names are pickled, so worker processes import the module themselves
+        return ( LazyFunction, (self.module_name, self.function_name) + tuple(self.args) )
+
+    def __repr__(self):
+        return 'LazyFunction(%s.%s)'% (self.module_name, self.function_name)
@@ -0,0 +1,118 @@
+# A persistent cache of state measure results, stored in a local SQLite database
+
+import collections
+import collections.abc
+import os
+import pickle
+import sqlite3
+import time
+
+import funtool.lib.general
+
+MeasureCache = collections.namedtuple('MeasureCache',['connection','max_size'])
+
+# connection        an open sqlite3 connection to the cache database
+# max_size          the largest total size in bytes of the stored values before the least recently used are evicted
+#
+# Each entry is keyed on the state id, a hash of the state data, the measure name, module and function, and a hash of 
+# the measure's configured parameters. The value is a pickled dict with the state field ( measures, meta, or data ) 
+# as the key and the value the measure saved under its name as the value.
+
+default_cache_path= os.path.join('.','cache','measure_cache.sqlite')
+
+default_max_size= 1024 * 1024 * 1024
+
+# Parameters which change how a measure is run, but not its result
+execution_parameters= [ 'cache', 'parallel', 'streamable' ]
+
+_lookup_chunk_size= 500
+
+
+def open_cache(cache_parameters):
+    """
+    Opens ( or creates ) the cache described by a measure's cache parameter
+        For example (as YAML):
+            cache:
+                path: ./cache/measure_cache.sqlite    (optional)
+                max_size: 1073741824                    (optional: in bytes)
+    A cache parameter of true uses the defaults
+    """
+    if not isinstance(cache_parameters, collections.abc.Mapping):
+        cache_parameters= {}
+    cache_path= cache_parameters.get('path') or default_cache_path
+    if os.path.dirname(cache_path) and not os.path.exists(os.path.dirname(cache_path)): 
+        os.makedirs(os.path.dirname(cache_path))
+    connection= sqlite3.connect(cache_path)
+    connection.execute('CREATE TABLE IF NOT EXISTS measure_cache (key TEXT PRIMARY KEY, value BLOB, size INTEGER, last_used REAL)')
+    connection.execute('CREATE INDEX IF NOT EXISTS measure_cache_last_used ON measure_cache (last_used)')
+    return MeasureCache(connection, int(cache_parameters.get('max_size') or default_max_size))
+
+def close_cache(measure_cache):
+    measure_cache.connection.commit()
+    measure_cache.connection.close()
+    return measure_cache
+
+def measure_key(state_measure):
+    """
+    Returns the part of a cache key which identifies the measure and its configured parameters
+    """
+    measure_parameters= { param:val for param,val in (state_measure.parameters or {}).items() if param not in execution_parameters }
+    return '|'.join([ 
+        str(state_measure.name), 
+        str(state_measure.measure_module), 
+        str(state_measure.measure_function), 
+        funtool.lib.general.hash_value(measure_parameters) ])
+
+def cache_key(state, measure_key):
+    return funtool.lib.general.hash_value( [ str(state.id), funtool.lib.general.hash_value(state.data), measure_key ] )
+
+def get_cached_values(measure_cache, keys):
+    """
+    Returns a dict of key: cached values for the keys found in the cache, and marks them as recently used
+    """
+    keys= list(keys)
+    cached_values= {}
+    for start in range(0, len(keys), _lookup_chunk_size):
+        chunk= keys[start:start + _lookup_chunk_size]
+        rows= measure_cache.connection.execute(
+            'SELECT key, value FROM measure_cache WHERE key IN (%s)' % ','.join('?' * len(chunk)), chunk)
+        for key, value in rows:
+            cached_values[key]= pickle.loads(value)
+    now= time.time()
+    measure_cache.connection.executemany('UPDATE measure_cache SET last_used = ? WHERE key = ?', 
+        ( (now, key) for key in cached_values.keys() ))
+    measure_cache.connection.commit()
+    return cached_values
+
+def store_values(measure_cache, keyed_values):
+    """
+    Stores an iterable of ( key, values ) pairs, then evicts entries if the cache is over its max_size
+    """
+    now= time.time()
+    rows= []
+    for key, values in keyed_values:
+        try:
+            value= pickle.dumps(values, pickle.HIGHEST_PROTOCOL)
+        except Exception: # Unpicklable results are not cached
+            continue
+        rows.append( (key, value, len(value), now) )
+    measure_cache.connection.executemany('INSERT OR REPLACE INTO measure_cache (key, value, size, last_used) VALUES (?,?,?,?)', rows)
+    measure_cache.connection.commit()
+    evict(measure_cache)
+    return measure_cache
+
+def evict(measure_cache):
+    """
+    Removes the least recently used entries until the cache is no larger than its max_size
+    """
+    total_size= measure_cache.connection.execute('SELECT COALESCE(SUM(size),0) FROM measure_cache').fetchone()[0]
+    if total_size > measure_cache.max_size:
+        evicted_keys= []
+        for key, size in measure_cache.connection.execute('SELECT key, size FROM measure_cache ORDER BY last_used, key'):
+            if total_size <= measure_cache.max_size:
+                break
+            evicted_keys.append( (key,) )
+            total_size-= size
+        measure_cache.connection.executemany('DELETE FROM measure_cache WHERE key = ?', evicted_keys)
+        measure_cache.connection.commit()
+    return measure_cache
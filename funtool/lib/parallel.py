@@ -0,0 +1,40 @@
+import os
+
+
+def get_worker_count(parallel_parameters):
+    """
+    Returns the number of workers requested in a parallel parameters dict
+
+    Defaults to the number of available cpus when workers is missing or null
+    """
+    workers= (parallel_parameters or {}).get('workers')
+    if workers is None:
+        workers= os.cpu_count() or 1
+    return max(1, int(workers))
+
+def get_chunk_size(parallel_parameters, item_count, workers):
+    """
+    Returns the number of items to send to a worker at once
+
+    Defaults to splitting the items into roughly four chunks per worker
+    """
+    chunk_size= (parallel_parameters or {}).get('chunk_size')
+    if chunk_size is None:
+        chunk_size= -(-item_count // (workers * 4))
+    return max(1, int(chunk_size))
+
+def split_into_chunks(items, chunk_size):
+    """
+    Returns a list of consecutive slices of items, each with at most chunk_size entries
+    """
+    return [ items[start:start + chunk_size] for start in range(0, len(items), chunk_size) ]
+
+def changed_values(original_dict, current_dict):
+    """
+    Returns a dict of the entries in current_dict which were added or replaced since original_dict was copied
+
+    Used so workers only send back the values a measure changed
+    """
+    return { key:value for key,value in current_dict.items() if original_dict.get(key, _missing) is not value }
+
+_missing= object()
@@ -0,0 +1,101 @@
+# Buffered writers for reports made of rows ( dicts of column name: value ), written as CSV or JSON lines
+
+import collections
+import csv
+import io
+import json
+import os
+
+RowWriter = collections.namedtuple('RowWriter',['path','row_format','file','columns','chunk_size','buffer','counts'])
+
+# path          the path of the file being written
+# row_format    csv or jsonl
+# file          the open file
+# columns       a list of the CSV column names. When empty, it is filled with the keys of every row in the first chunk, in 
+#                   the order they are first seen. A later row with a key not in the columns raises a RowWriterError.
+# chunk_size    the number of rows buffered before they are written with a single write
+# buffer        a list of the rows not yet written
+# counts        a dict with the number of rows written
+#
+# Rows are serialized a chunk at a time, so a report never has to be held in memory and the file is written with
+# a few large writes instead of one per row.
+
+row_formats= [ 'csv', 'jsonl' ]
+
+default_chunk_size= 10000
+
+
+class RowWriterError(Exception):
+    pass
+
+def open_row_writer(path, row_format=None, columns=None, chunk_size=None):
+    """
+    Opens a RowWriter, the format defaults to jsonl for .jsonl and .json paths, otherwise csv
+    """
+    if row_format is None:
+        row_format= 'jsonl' if os.path.splitext(path)[1].lower() in [ '.jsonl', '.json' ] else 'csv'
+    if row_format not in row_formats:
+        raise RowWriterError("Unknown row format: " + str(row_format) + " ( expected one of " + ', '.join(row_formats) + " )")
+    directory= os.path.dirname(path)
+    if directory != '' and not os.path.exists(directory):
+        os.makedirs(directory)
+    row_file= open(path, 'w', newline='')
+    return RowWriter(path, row_format, row_file, list(columns or []),
+        max(1, int(chunk_size or default_chunk_size)), [], { 'rows': 0 })
+
+def write_rows(row_writer, rows):
+    """
+    Adds rows to the writer, writing a chunk each time chunk_size rows are buffered
+    """
+    for row in rows:
+        row_writer.buffer.append(row)
+        if len(row_writer.buffer) >= row_writer.chunk_size:
+            flush_rows(row_writer)
+    return row_writer
+
+def flush_rows(row_writer):
+    """
+    Writes the buffered rows
+    """
+    if len(row_writer.buffer) == 0:
+        return row_writer
+    chunk= io.StringIO()
+    if row_writer.row_format == 'csv':
+        _write_csv_chunk(row_writer, chunk)
+    else:
+        for row in row_writer.buffer:
+            chunk.write(json.dumps(row, default=str))
+            chunk.write('\n')
+    row_writer.file.write(chunk.getvalue())
+    row_writer.counts['rows']+= len(row_writer.buffer)
+    del row_writer.buffer[:]
+    return row_writer
+
+def close_row_writer(row_writer):
+    """
+    Writes the buffered rows and closes the file, returns the number of rows written
+    """
+    try:
+        flush_rows(row_writer)
+        if row_writer.row_format == 'csv' and row_writer.counts['rows'] == 0 and len(row_writer.columns) > 0:
+            csv.writer(row_writer.file).writerow(row_writer.columns)
+    finally:
+        row_writer.file.close()
+    return row_writer.counts['rows']
+
+def _write_csv_chunk(row_writer, chunk):
+    if len(row_writer.columns) == 0:
+        columns= collections.OrderedDict()
+        for row in row_writer.buffer:
+            for key in row:
+                columns[key]= True
+        row_writer.columns.extend(columns)
+    writer= csv.DictWriter(chunk, fieldnames=row_writer.columns, extrasaction='raise')
+    if row_writer.counts['rows'] == 0:
+        writer.writeheader()
+    try:
+        writer.writerows(row_writer.buffer)
+    except ValueError as e:
+        del row_writer.buffer[:] # the chunk can't be written, so it isn't written again when the writer is closed
+        raise RowWriterError("A row of " + str(row_writer.path) + " has columns missing from the CSV header ( " + str(e) + 
+            " ), list every column in the columns parameter")
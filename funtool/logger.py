@@ -1,21 +1,89 @@
 # Contains the setup of all the system loggers
 
 import logging
+import logging.handlers
+import atexit
 import collections
 import os
+import queue
 import sys
+import threading
 
-Loggers = collections.namedtuple('Loggers',['analysis_logger','process_logger','status_logger'])
+Loggers = collections.namedtuple('Loggers',['analysis_logger','process_logger','status_logger','log_dir','listener'])
+Loggers.__new__.__defaults__= (None, None)
+
+# log_dir       the base log directory the loggers were loaded for ( nested analyses log there too ), or None
+# listener      the QueueListener which writes the log files in a background thread, or None
+#
+# The loggers only put records on a queue, the log files are written by the listener's thread. close_loggers stops the 
+# listener once the analysis is complete ( or when python exits ), after which the loggers write their files directly.
+# Console output from the analysis logger isn't queued.
+
+_default_loggers= None
+
+_active_listeners= set()
+
+_listeners_lock= threading.Lock()
 
 def load_loggers(log_base_dir, analysis_time, analysis_name, analysis_uuid, log_level=logging.WARN):
-    logger_dir= os.path.join(log_base_dir,'history',analysis_time, analysis_name)
+    logger_dir= log_directory(log_base_dir, analysis_time, analysis_name)
     logger_id= ('_').join([analysis_time,str(analysis_uuid)]).replace('.','_')
     if not os.path.exists(logger_dir): os.makedirs(logger_dir)
     analysis_logger= load_analysis_logger(logger_dir, logger_id, log_level) 
     process_logger= load_process_logger(logger_dir, logger_id, log_level) 
     status_logger= load_status_logger(logger_dir, logger_id, log_level) 
-    return Loggers( analysis_logger, process_logger, status_logger )
+    listener= _queue_file_handlers([ analysis_logger, process_logger, status_logger ])
+    global _default_loggers
+    _default_loggers= Loggers( analysis_logger, process_logger, status_logger, log_base_dir, listener )
+    return _default_loggers
+
+def close_loggers(loggers):
+    """
+    Stops the background listener of a set of loggers after writing the queued records, the log files are then written directly
+    """
+    if loggers.listener is None:
+        return loggers
+    with _listeners_lock:
+        if loggers.listener not in _active_listeners:
+            return loggers
+        _active_listeners.discard(loggers.listener)
+    loggers.listener.stop()
+    for logger in loggers[:3]:
+        for handler in list(logger.handlers):
+            if isinstance(handler, logging.handlers.QueueHandler):
+                logger.removeHandler(handler)
+        for handler in loggers.listener.handlers:
+            if any( log_filter.name == logger.name for log_filter in handler.filters ):
+                logger.addHandler(handler)
+    return loggers
+
+def _queue_file_handlers(loggers): # moves the file handlers of the loggers to a QueueListener
+    log_queue= queue.SimpleQueue()
+    file_handlers= []
+    for logger in loggers:
+        for handler in list(logger.handlers):
+            if isinstance(handler, logging.FileHandler):
+                logger.removeHandler(handler)
+                handler.addFilter(logging.Filter(logger.name))
+                file_handlers.append(handler)
+        logger.addHandler(logging.handlers.QueueHandler(log_queue))
+    listener= logging.handlers.QueueListener(log_queue, *file_handlers, respect_handler_level=True)
+    listener.start()
+    with _listeners_lock:
+        _active_listeners.add(listener)
+    return listener
+
+def _stop_active_listeners(): # writes any queued records before python exits
+    with _listeners_lock:
+        listeners= list(_active_listeners)
+        _active_listeners.clear()
+    for listener in listeners:
+        listener.stop()
+
+atexit.register(_stop_active_listeners)
 
+def log_directory(log_base_dir, analysis_time, analysis_name):
+    return os.path.join(log_base_dir,'history',analysis_time, analysis_name)
 
 def load_analysis_logger(log_dir, logger_id, log_level):
     logger= logging.getLogger(logger_id)
@@ -52,7 +120,9 @@ def load_status_logger(log_dir, logger_id, log_level):
     logger.addHandler(status_log)
     return logger
 
-def set_default_loggers(): #Creates a default logger set based on the most recent timestamp
+def set_default_loggers(): #Returns the most recently loaded logger set, or creates one based on the most recent timestamp
+    if _default_loggers != None:
+        return _default_loggers
     known_logger_ids= list(set([ key[0:67] for key in logging.Logger.manager.loggerDict.keys()]))
     last_logger_id= sorted(known_logger_ids)[-1]
     return Loggers( logging.getLogger(last_logger_id), logging.getLogger(last_logger_id+'_process'),logging.getLogger(last_logger_id+'_status'))
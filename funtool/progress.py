@@ -0,0 +1,189 @@
+# Reports the progress of long running steps ( states or groups measured, states read by streaming adaptors )
+
+import collections
+import datetime
+import json
+import os
+import threading
+import time
+
+ProgressUpdate = collections.namedtuple('ProgressUpdate',['analysis_name','step','process_type','process_name','unit','completed','total',
+    'elapsed','rate','eta','finished','time'])
+
+# A ProgressUpdate is passed to each progress writer
+#
+# analysis_name     the name of the analysis, or None outside of an analysis
+# step              the step number ( starting at 1, as in the analysis log ), or None outside of an analysis
+# process_type      the type of the process reporting progress, or None outside of an analysis
+# process_name      the name of the process reporting progress, or None outside of an analysis
+# unit              what is being counted ( states, groups, ... )
+# completed         the number completed so far
+# total             the number to complete, or None when it isn't known ( for streams )
+# elapsed           seconds since progress started
+# rate              the number completed per second
+# eta               the estimated seconds until completion, or None when the total or rate isn't known
+# finished          true for the last update
+# time              the time of the update, as an ISO 8601 string
+
+ProgressContext = collections.namedtuple('ProgressContext',['analysis_name','step','process_type','process_name','writers'])
+
+# A ProgressContext describes the step currently running in a thread ( see run_in_context )
+#
+# writers           a list of functions which take a ProgressUpdate, such as those returned by status_log_writer and
+#                       progress_file_writer. Any other function can be added to forward progress elsewhere.
+
+Progress = collections.namedtuple('Progress',['context','unit','total','interval','step_size','start_time','counts','lock'])
+
+# A Progress tracks one loop, it is returned by start_progress
+#
+# counts            a dict with the completed count, and the count and time at which the next update is written
+# lock              guards counts, so progress can be advanced from several threads
+#
+# Updates are written after each fraction of the total ( 5% by default ) or after interval seconds ( 60 by default ),
+# whichever comes first, so progress is safe to advance for every state of any size of collection.
+#   For example:
+#       progress= funtool.progress.start_progress(loggers, len(states))
+#       for state in states:
+#           measure(state)
+#           funtool.progress.advance_progress(progress)
+#       funtool.progress.finish_progress(progress)
+
+progress_interval= 60 # the most seconds between updates, even when little progress was made
+
+progress_fraction= 0.05 # the fraction of the total between updates
+
+progress_file_name= 'progress.json'
+
+_progress_context= threading.local()
+
+
+def run_in_context(progress_context, function):
+    """
+    Calls function with progress_context as the current context of this thread, restoring the previous context afterwards
+    """
+    previous_context= getattr(_progress_context, 'context', None)
+    _progress_context.context= progress_context
+    try:
+        return function()
+    finally:
+        _progress_context.context= previous_context
+
+def current_context():
+    """
+    Returns the ProgressContext of this thread, or None outside of an analysis step
+    """
+    return getattr(_progress_context, 'context', None)
+
+def start_progress(loggers, total, unit='states', interval=None, fraction=None):
+    """
+    Returns a Progress for a loop over total items ( or None if unknown ), reported to the writers of the current context
+
+    Outside of an analysis step, progress is written to the status logger of loggers ( if given )
+    """
+    progress_context= current_context()
+    if progress_context is None:
+        writers= [ status_log_writer(loggers.status_logger) ] if loggers != None else []
+        progress_context= ProgressContext(None, None, None, None, writers)
+    interval= progress_interval if interval is None else interval
+    step_size= max(1, int((total or 0) * (progress_fraction if fraction is None else fraction)))
+    start_time= time.monotonic()
+    counts= { 'completed': 0, 'next_count': 0 if total != None else None, 'next_time': start_time + interval }
+    return Progress(progress_context, unit, total, interval, step_size, start_time, counts, threading.Lock())
+
+def advance_progress(progress, count=1):
+    """
+    Adds count to the completed count, writing an update when one is due
+    """
+    with progress.lock:
+        return _set_completed(progress, progress.counts['completed'] + count)
+
+def update_progress(progress, completed):
+    """
+    Sets the completed count, writing an update when one is due
+    """
+    with progress.lock:
+        return _set_completed(progress, completed)
+
+def finish_progress(progress):
+    """
+    Writes the last update of a Progress
+    """
+    with progress.lock:
+        _write_update(progress, True)
+    return progress
+
+def status_log_writer(status_logger):
+    """
+    Returns a progress writer which writes a line to the status logger for each update
+    """
+    def write_status_line(progress_update):
+        status_logger.warning(format_update(progress_update))
+    return write_status_line
+
+def progress_file_writer(progress_path):
+    """
+    Returns a progress writer which keeps a JSON file with the latest update of each step
+
+    The file is replaced on each update, so it can be read at any time. Its updated_at time shows when the
+    analysis last made progress.
+    """
+    steps= {}
+    lock= threading.Lock()
+    directory= os.path.dirname(progress_path)
+    if directory != '' and not os.path.exists(directory):
+        os.makedirs(directory)
+    def write_progress_file(progress_update):
+        with lock:
+            steps[str(progress_update.step)]= progress_update._asdict()
+            temporary_path= progress_path + '.tmp'
+            with open(temporary_path, 'w') as f:
+                json.dump({ 'analysis_name': progress_update.analysis_name,
+                    'updated_at': progress_update.time,
+                    'current_step': progress_update.step,
+                    'steps': steps }, f, indent=2)
+            os.replace(temporary_path, progress_path)
+    return write_progress_file
+
+def format_update(progress_update):
+    """
+    Returns a status line for a ProgressUpdate, such as
+        2016-01-01 12:00:00.000000: Step 3 state_measure:time_on_task 45.0 % (4500/10000 states, 812.3 states/sec, ETA 0:00:06)
+    """
+    step= ''
+    if progress_update.step != None:
+        step= 'Step {} {}:{} '.format(progress_update.step, progress_update.process_type, progress_update.process_name)
+    if progress_update.total != None:
+        percent= round(progress_update.completed / progress_update.total * 100, 1) if progress_update.total > 0 else 100.0
+        counts= '{} % ({}/{} {}'.format(percent, progress_update.completed, progress_update.total, progress_update.unit)
+    else:
+        counts= '({} {}'.format(progress_update.completed, progress_update.unit)
+    eta= ', ETA {}'.format(datetime.timedelta(seconds=round(progress_update.eta))) if progress_update.eta != None else ''
+    return '{}: {}{}, {} {}/sec{}){}'.format(datetime.datetime.now(), step, counts, round(progress_update.rate, 1),
+        progress_update.unit, eta, ' Finished' if progress_update.finished else '')
+
+def _set_completed(progress, completed):
+    progress.counts['completed']= completed
+    if (progress.counts['next_count'] != None and completed >= progress.counts['next_count']) or time.monotonic() >= progress.counts['next_time']:
+        _write_update(progress, False)
+    return progress
+
+def _write_update(progress, finished):
+    now= time.monotonic()
+    completed= progress.counts['completed']
+    elapsed= now - progress.start_time
+    rate= completed / elapsed if elapsed > 0 else 0.0
+    eta= None
+    if finished:
+        eta= 0
+    elif progress.total != None and rate > 0:
+        eta= max(0, progress.total - completed) / rate
+    progress_context= progress.context
+    progress_update= ProgressUpdate(progress_context.analysis_name, progress_context.step, progress_context.process_type,
+        progress_context.process_name, progress.unit, completed, progress.total, elapsed, rate, eta, finished,
+        datetime.datetime.now(datetime.timezone.utc).isoformat())
+    for writer in progress_context.writers:
+        writer(progress_update)
+    if progress.counts['next_count'] != None:
+        progress.counts['next_count']= completed + progress.step_size
+    progress.counts['next_time']= now + progress.interval
+    return progress_update
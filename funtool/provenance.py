@@ -0,0 +1,116 @@
+# Collects the installed package versions and version control status recorded in each analysis log
+
+import collections
+import concurrent.futures
+import importlib.metadata
+import json
+import subprocess
+import threading
+
+Provenance = collections.namedtuple('Provenance',['module_versions','version_control'])
+
+# A Provenance records what code an analysis was run with
+#
+# module_versions       a list of ( package name, version, vcs details ) tuples for the installed packages, vcs details is a dict
+#                           ( from the package's direct_url.json, for packages installed from version control ) or None
+# version_control       a dict with the git branch, commit, and status lines of the working directory, or None outside of git
+#
+# Provenance is collected once per python process. Module versions are read by the first analysis, which logs them
+# at its start. The version control status is collected in a background thread ( git may be slow ), and logged when
+# it is ready, so a run which fails early still records it. Later analyses ( including nested analyses ) reuse both.
+
+_module_versions= None
+_version_control_future= None
+_provenance_lock= threading.Lock()
+
+
+def get_module_versions():
+    """
+    Returns the module versions of this python process ( see module_versions ), collecting them the first time
+    """
+    global _module_versions
+    with _provenance_lock:
+        if _module_versions is None:
+            _module_versions= module_versions()
+        return _module_versions
+
+def start_version_control():
+    """
+    Starts collecting the version control status in a background thread if it hasn't been started, returns a future of it
+    """
+    global _version_control_future
+    with _provenance_lock:
+        if _version_control_future is None:
+            executor= concurrent.futures.ThreadPoolExecutor(max_workers=1, thread_name_prefix='funtool-provenance')
+            _version_control_future= executor.submit(version_control)
+            executor.shutdown(wait=False)
+        return _version_control_future
+
+def get_provenance(timeout=None):
+    """
+    Returns the Provenance of this python process, waiting for the version control status to be collected
+    """
+    return Provenance(get_module_versions(), start_version_control().result(timeout))
+
+def collect_provenance():
+    return Provenance(module_versions(), version_control())
+
+def module_versions():
+    versions= []
+    for distribution in importlib.metadata.distributions():
+        name= distribution.metadata['Name']
+        if name is None:
+            continue
+        versions.append( (name, distribution.version, _vcs_details(distribution)) )
+    return sorted(versions, key= lambda module_version: module_version[0].lower())
+
+def version_control(): #git only for now
+    try:
+        return {
+            'branch': _git_output(['rev-parse','--abbrev-ref','HEAD']).rstrip(),
+            'commit': _git_output(['rev-parse','HEAD']).rstrip(),
+            'status': [ status_line for status_line in _git_output(['status','--porcelain']).split("\n") if status_line != '' ] }
+    except Exception:
+        return None
+
+def log_provenance(loggers, provenance):
+    """
+    Writes the provenance to the analysis log, funtool packages are logged as warnings and others as info
+    """
+    log_module_versions(loggers, provenance.module_versions)
+    return log_version_control(loggers, provenance.version_control)
+
+def log_module_versions(loggers, module_versions):
+    for (name, version, vcs_details) in module_versions:
+        if 'funtool' in name:
+            if vcs_details != None:
+                loggers.analysis_logger.warning('%s Version: %s Branch %s Commit: %s'% (name, version, vcs_details.get('requested_revision', ''), vcs_details.get('commit_id', '')))
+            else:
+                loggers.analysis_logger.warning('%s Version: %s'% (name, version))
+        else:
+            loggers.analysis_logger.info('%s Version: %s'% (name, version))
+    return loggers
+
+def log_version_control(loggers, version_control):
+    if version_control != None:
+        loggers.analysis_logger.warning('Analysis Git Branch: %s'% version_control['branch'])
+        loggers.analysis_logger.warning('Analysis Git Commit: %s'% version_control['commit'])
+        if len(version_control['status']) == 0:
+            loggers.analysis_logger.warning('Analysis Git Status: Clean')
+        else:
+            loggers.analysis_logger.warning('Analysis Git Status: Dirty')
+            for status_line in version_control['status']:
+                loggers.analysis_logger.warning("\t"+status_line)
+    return loggers
+
+def _vcs_details(distribution):
+    try:
+        direct_url= json.loads(distribution.read_text('direct_url.json') or 'null')
+    except (ValueError, OSError):
+        return None
+    if not isinstance(direct_url, dict) or 'vcs_info' not in direct_url:
+        return None
+    return dict(direct_url['vcs_info'], url=direct_url.get('url'))
+
+def _git_output(git_arguments):
+    return subprocess.check_output(['git'] + git_arguments, stderr=subprocess.DEVNULL).decode('utf8')
@@ -2,11 +2,15 @@
 
 import collections
 import yaml
-import importlib
 import functools
 import os
+import threading
 
+import funtool.state_collection
 import funtool.lib.config_parse
+import funtool.lib.general
+import funtool.lib.lazy_import
+import funtool.lib.row_writer
 
 
 Reporter = collections.namedtuple('Reporter',['reporter_module','reporter_function','parameters'])
@@ -21,12 +25,113 @@ class ReporterError(Exception):
     pass
 
 def reporter_process(reporter): #returns a function, that accepts a state_collection, to be used as a process
-    reporter_module = importlib.import_module(reporter.reporter_module)
-    return functools.partial( getattr(reporter_module,reporter.reporter_function), reporter )
+    return funtool.lib.lazy_import.LazyFunction(reporter.reporter_module, reporter.reporter_function, reporter)
 
 import_config= functools.partial(funtool.lib.config_parse.import_config, Reporter, reporter_process)   
 
 
+def streaming_reporter(reporter_function):
+    """
+    Decorator for reporters which write a report incrementally
+
+    The reporter_function is a generator taking the reporter, an iterator of StateCollection batches, and the reporter parameters.
+    It should write each batch and then yield it, so the batch can continue through the analysis.
+        For example:
+            @funtool.reporter.streaming_reporter
+            def state_id_report(reporter, batches, reporter_parameters):
+                with open(reporter_parameters['filename'],'w') as f:
+                    for batch in batches:
+                        f.writelines( state.id + "\\n" for state in batch.states )
+                        yield batch
+
+    With a StateCollectionStream the report is written as the stream is drained, otherwise the full StateCollection is 
+    reported as a single batch.
+    """
+    def wrapped_function(reporter, state_collection, overriding_parameters=None, loggers=None):
+        reporter_parameters= get_parameters(reporter, overriding_parameters)
+        if funtool.state_collection.is_stream(state_collection):
+            return funtool.state_collection.StateCollectionStream(
+                    reporter_function(reporter, state_collection.batches, reporter_parameters),
+                    state_collection.retain_states)
+        for batch in reporter_function(reporter, iter([state_collection]), reporter_parameters):
+            pass
+        return state_collection
+    wrapped_function.streamable= True
+    return wrapped_function
+
+def row_reporter(row_function):
+    """
+    Decorator for reporters which generate the rows of a CSV or JSON lines report
+
+    The row_function takes the reporter, a list of states, and the reporter parameters, and yields a dict of column: value
+    for each row. It is called once for each batch of a StateCollectionStream, or once with all the states.
+        For example:
+            @funtool.reporter.row_reporter
+            def time_on_task_report(reporter, states, reporter_parameters):
+                for state in states:
+                    yield { 'id': state.id, 'time_on_task': state.measures.get('time_on_task') }
+
+    Rows are written in chunks as they are generated ( see funtool.lib.row_writer ), so the report is never held in memory.
+
+    Reporter parameters used by the report:
+        save_directory      the directory the report is saved in ( under history/analysis_start_time, see get_default_save_path )
+        filename            the name of the report file (default: the reporter function name with .jsonl for the jsonl format, otherwise .csv)
+        format              csv or jsonl (optional: defaults to jsonl for .jsonl and .json filenames, otherwise csv)
+        columns             a list of the CSV columns (optional: defaults to the columns of the rows in the first chunk,
+                                a later row with other columns raises a RowWriterError)
+        chunk_size          the number of rows written at once (default 10000)
+
+    The latest link of save_directory is updated once the report is written.
+
+    Reporters only write concurrently in an analysis run with a plan ( see funtool.analysis_plan ), where consecutive 
+    reporters share a stage. Otherwise each reporter runs on its own, after the previous one has written its report.
+    """
+    @streaming_reporter
+    def row_report(reporter, batches, reporter_parameters):
+        report_path= os.path.join(get_default_save_path(reporter_parameters), 
+            reporter_parameters.get('filename') or reporter.reporter_function + _default_extensions.get(reporter_parameters.get('format'), '.csv'))
+        row_writer= funtool.lib.row_writer.open_row_writer(report_path, reporter_parameters.get('format'), 
+            reporter_parameters.get('columns'), reporter_parameters.get('chunk_size'))
+        try:
+            for batch in batches:
+                funtool.lib.row_writer.write_rows(row_writer, row_function(reporter, batch.states, reporter_parameters))
+                yield batch
+        finally:
+            funtool.lib.row_writer.close_row_writer(row_writer)
+        if reporter_parameters.get('analysis_start_time') != None:
+            link_latest_output(reporter_parameters['save_directory'])
+    return row_report
+
+_default_extensions= { 'csv':'.csv', 'jsonl':'.jsonl' }
+
+@row_reporter
+def state_report(reporter, states, reporter_parameters):
+    """
+    Writes a row for each state with its id and the fields listed in the fields parameter
+        For example (as YAML):
+            reporter_module: funtool.reporter
+            reporter_function: state_report
+            parameters:
+                save_directory: ./reports
+                filename: time_on_task.csv
+                fields:             (optional: defaults to every measure)
+                    - meta: user_id
+                    - measures:
+                        - time_on_task
+                        - clicks
+    Columns are named by their keys, missing values are left empty. Without fields, every measure of any state in 
+    the StateCollection is a column, for a StateCollectionStream list the fields or columns if batches have different measures.
+    """
+    fields= _report_fields(reporter_parameters.get('fields'))
+    if fields is None:
+        fields= [ ('measures', key) for key in measure_keys(states) ]
+    for state in states:
+        row= { 'id': state.id }
+        for state_field, key in fields:
+            row[key]= getattr(state, state_field).get(key)
+        yield row
+
+
 
 
 
@@ -42,15 +147,12 @@ def get_default_save_path(reporter_parameters):
     return save_path
 
 
-def get_parameters(reporter,overriding_parameters):
-    reporter_parameters= reporter.parameters
-    if overriding_parameters != None:
-        for param, val in overriding_parameters.items():
-            reporter_parameters[param] = val
-    return reporter_parameters
+get_parameters= funtool.lib.general.get_parameters
 
 
 def link_latest_output(output_dir):
+    if _defer_links(output_dir):
+        return True
     most_recent_output=''
     for timestamp_dir in os.listdir(os.path.join(output_dir,'history')): 
         if os.path.isdir(os.path.join(output_dir,'history',timestamp_dir)):
@@ -67,5 +169,56 @@ def link_latest_output(output_dir):
         print('OSError:',str(e))
         succeed= False
     return succeed
-    
-    
+
+# Reporters in the same stage of an analysis run concurrently, so the analysis defers the links made by its steps 
+# until the stage is complete, linking each output directory once
+
+_deferred_links= threading.local()
+_deferred_links_lock= threading.Lock()
+
+def defer_output_links(output_dirs, function):
+    """
+    Calls function, adding the directories passed to link_latest_output in this thread to the output_dirs set instead of linking them
+    """
+    previous_output_dirs= getattr(_deferred_links, 'output_dirs', None)
+    _deferred_links.output_dirs= output_dirs
+    try:
+        return function()
+    finally:
+        _deferred_links.output_dirs= previous_output_dirs
+
+def link_deferred_outputs(output_dirs):
+    """
+    Links the latest output of each deferred directory, and empties output_dirs
+    """
+    with _deferred_links_lock:
+        deferred_output_dirs= sorted(output_dirs)
+        output_dirs.clear()
+    return all([ link_latest_output(output_dir) for output_dir in deferred_output_dirs ])
+
+def _defer_links(output_dir):
+    output_dirs= getattr(_deferred_links, 'output_dirs', None)
+    if output_dirs is None:
+        return False
+    with _deferred_links_lock:
+        output_dirs.add(output_dir)
+    return True
+
+def measure_keys(measured):
+    """
+    Returns the measure keys of a list of states or groups, in the order they are first seen
+    """
+    keys= collections.OrderedDict()
+    for item in measured:
+        for key in item.measures:
+            keys[key]= True
+    return list(keys)
+
+def _report_fields(fields): # a list of state field: key pairs, or None for every measure
+    if fields is None:
+        return None
+    report_fields= []
+    for field in fields:
+        for state_field, keys in field.items():
+            report_fields.extend( (state_field, key) for key in (keys if isinstance(keys, (list, tuple)) else [ keys ]) )
+    return report_fields
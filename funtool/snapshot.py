@@ -0,0 +1,149 @@
+# Saves and restores StateCollections, including the references between states and groups
+
+import os
+import pickle
+import re
+
+import funtool.state
+import funtool.group
+import funtool.state_collection
+
+# A snapshot stores a StateCollection in a flat form, so deeply linked states and groups don't recurse while pickling
+#
+# states            a list of ( id, data, measures, meta, { grouping_name: [ group_index ] } ) tuples
+# collection_size   the number of states in the StateCollection, any further states are only referenced by groups
+# groups            a list of ( group_selector_name, [ state_index ], measures, meta, data ) tuples
+# groupings         a dict with grouping names as keys and a list of ( group_key, group_index ) pairs as the value
+#
+# Restored states are State namedtuples and restored groups are Group namedtuples ( see state.py and group.py )
+#
+# Snapshots are pickled with the highest available protocol ( protocol 5 from Python 3.8 ), which stores large 
+# bytes and str values without extra copies.
+
+
+class SnapshotError(Exception):
+    pass
+
+def save_snapshot(state_collection, snapshot_path, extra=None):
+    """
+    Saves a StateCollection to snapshot_path, along with an optional picklable extra value
+
+    The file is written next to snapshot_path first and then moved into place, so a failed save keeps the previous snapshot
+    """
+    if os.path.dirname(snapshot_path) and not os.path.exists(os.path.dirname(snapshot_path)):
+        os.makedirs(os.path.dirname(snapshot_path))
+    snapshot= { 'format': 'funtool.snapshot', 'version': 1, 'state_collection': flatten(state_collection), 'extra': extra }
+    temporary_path= snapshot_path + '.tmp'
+    with open(temporary_path, 'wb') as f:
+        pickle.dump(snapshot, f, pickle.HIGHEST_PROTOCOL)
+    os.replace(temporary_path, snapshot_path)
+    return snapshot_path
+
+def load_snapshot(snapshot_path):
+    """
+    Returns the StateCollection and the extra value saved in a snapshot
+    """
+    with open(snapshot_path, 'rb') as f:
+        snapshot= pickle.load(f)
+    if not isinstance(snapshot, dict) or snapshot.get('format') != 'funtool.snapshot':
+        raise SnapshotError("Not a funtool snapshot: " + str(snapshot_path))
+    return unflatten(snapshot['state_collection']), snapshot.get('extra')
+
+def checkpoint_path(checkpoint_dir, analysis_name, completed_steps):
+    return os.path.join(checkpoint_dir, analysis_name, 'step_%04d.snapshot'% completed_steps)
+
+def save_checkpoint(state_collection, checkpoint_dir, analysis_name, completed_steps, extra=None):
+    """
+    Saves a snapshot of the StateCollection after the given number of steps of an analysis
+    """
+    extra= dict(extra or {})
+    extra.update({ 'analysis_name': analysis_name, 'completed_steps': completed_steps })
+    return save_snapshot(state_collection, checkpoint_path(checkpoint_dir, analysis_name, completed_steps), extra)
+
+def latest_checkpoint(checkpoint_dir, analysis_name):
+    """
+    Returns the number of completed steps and the path of the latest checkpoint of an analysis, or ( None, None ) if there isn't one
+    """
+    checkpoints= _checkpoint_steps(checkpoint_dir, analysis_name)
+    if len(checkpoints) == 0:
+        return ( None, None )
+    completed_steps= max(checkpoints.keys())
+    return ( completed_steps, checkpoints[completed_steps] )
+
+def clear_checkpoints(checkpoint_dir, analysis_name):
+    """
+    Removes the checkpoints of an analysis, returns the number removed
+    """
+    checkpoints= _checkpoint_steps(checkpoint_dir, analysis_name)
+    for path in checkpoints.values():
+        os.remove(path)
+    return len(checkpoints)
+
+def _checkpoint_steps(checkpoint_dir, analysis_name):
+    analysis_checkpoint_dir= os.path.join(checkpoint_dir, analysis_name)
+    if not os.path.isdir(analysis_checkpoint_dir):
+        return {}
+    checkpoints= {}
+    for file_name in os.listdir(analysis_checkpoint_dir):
+        step_match= re.match(r'^step_(\d+)\.snapshot$', file_name)
+        if step_match:
+            checkpoints[int(step_match.group(1))]= os.path.join(analysis_checkpoint_dir, file_name)
+    return checkpoints
+
+def flatten(state_collection):
+    """
+    Returns a flat, picklable form of a StateCollection where states and groups refer to each other by index
+    """
+    state_positions= { id(state):position for position,state in enumerate(state_collection.states) }
+    all_states= list(state_collection.states)
+    group_positions= {}
+    all_groups= []
+    def group_position(group):
+        position= group_positions.get(id(group))
+        if position is None:
+            position= len(all_groups)
+            group_positions[id(group)]= position
+            all_groups.append(group)
+        return position
+    def state_position(state):
+        position= state_positions.get(id(state))
+        if position is None:
+            position= len(all_states)
+            state_positions[id(state)]= position
+            all_states.append(state)
+        return position
+    groupings= { grouping_name:[ (group_key, group_position(group)) for group_key,group in grouping.items() ]
+        for grouping_name,grouping in state_collection.groupings.items() }
+    flat_states= []
+    flat_groups= []
+    state_index= 0
+    group_index= 0
+    while state_index < len(all_states) or group_index < len(all_groups): # groups may add states, and states may add groups
+        while state_index < len(all_states):
+            state= all_states[state_index]
+            flat_states.append( (state.id, state.data, dict(state.measures), dict(state.meta),
+                { grouping_name:[ group_position(group) for group in groups ] for grouping_name,groups in state.groupings.items() }) )
+            state_index+= 1
+        while group_index < len(all_groups):
+            group= all_groups[group_index]
+            flat_groups.append( (group.group_selector_name, [ state_position(state) for state in group.states ], group.measures, group.meta, group.data) )
+            group_index+= 1
+    return {
+        'states': flat_states,
+        'collection_size': len(state_collection.states),
+        'groups': flat_groups,
+        'groupings': groupings }
+
+def unflatten(flat_collection):
+    """
+    Returns a StateCollection from its flat form, restoring the references between states and groups
+    """
+    states= [ funtool.state.State(state_id, data, measures, meta, {}) for (state_id, data, measures, meta, state_groupings) in flat_collection['states'] ]
+    groups= [ funtool.group.Group(group_selector_name, [ states[position] for position in state_positions ], measures, meta, data)
+        for (group_selector_name, state_positions, measures, meta, data) in flat_collection['groups'] ]
+    for state, flat_state in zip(states, flat_collection['states']):
+        for grouping_name, group_positions in flat_state[4].items():
+            state.groupings[grouping_name]= [ groups[position] for position in group_positions ]
+    groupings= { grouping_name:{ group_key:groups[position] for group_key,position in grouping }
+        for grouping_name,grouping in flat_collection['groupings'].items() }
+    return funtool.state_collection.StateCollection(states[:flat_collection['collection_size']], groupings)
@@ -2,12 +2,24 @@
 
 import collections
 import funtool.analysis
+import funtool.lib.general
 
 StateCollection = collections.namedtuple('StateCollection',['states','groupings'])
 
 # A StateCollection is the default collection for a funtool. It consists of a list of states (from state.py)
 # along with groupings, a dict, which has selector names as keys ( see selector.py ) and a dict of group_keys:group (from group.py)  
 
+StateCollectionStream = collections.namedtuple('StateCollectionStream',['batches','retain_states'])
+
+# A StateCollectionStream is used in place of a StateCollection when an adaptor streams its states ( see adaptor.streaming_adaptor )
+#
+# batches           an iterator of StateCollections, each holding one batch of states. Batches are only created as they are consumed
+# retain_states     a boolean, when true the batches are joined into a single StateCollection once the stream is drained,
+#                       otherwise states are discarded after passing through the analysis to keep memory bounded
+#
+# Streamable processes ( state measures without groupings and streaming reporters ) are applied batch by batch,
+# any other process first collects the whole stream into a single StateCollection
+
 def join_state_collections( collection_a, collection_b):
     """
     Warning: This is a very naive join. Only use it when measures and groups will remain entirely within each subcollection.
@@ -23,6 +35,51 @@ def join_state_collections( collection_a, collection_b):
                 for grouping_name in set( list(collection_a.groupings.keys()) + list(collection_b.groupings.keys()) ) })
 
 
+def is_stream(state_collection):
+    """
+    Returns true if state_collection is a StateCollectionStream
+    """
+    return isinstance(state_collection, StateCollectionStream)
+
+def map_stream(state_collection_stream, batch_function):
+    """
+    Returns a new stream where batch_function is lazily applied to each batch (a StateCollection) of the stream
+    """
+    return StateCollectionStream( 
+            ( batch_function(batch) for batch in state_collection_stream.batches ), 
+            state_collection_stream.retain_states)
+
+def collect_stream(state_collection_stream):
+    """
+    Consumes a stream and returns a single StateCollection with all of the states in the stream
+
+    Warning: This holds every state in memory, and uses the same naive join as join_state_collections
+
+    The states are added to a single list, and the groupings of the batches are merged once every batch is read
+    """
+    states= []
+    batch_groupings= []
+    for batch in state_collection_stream.batches:
+        states.extend(batch.states)
+        batch_groupings.append(batch.groupings)
+    groupings= {}
+    for grouping_values in batch_groupings: # later batches override earlier ones for the same group key
+        for grouping_name, grouping in grouping_values.items():
+            groupings.setdefault(grouping_name, {}).update(grouping)
+    return StateCollection(states, groupings)
+
+def drain_stream(state_collection_stream):
+    """
+    Consumes a stream, so every process applied to it is run on every batch
+
+    Returns the collected StateCollection if the stream retains states, otherwise an empty StateCollection
+    """
+    if state_collection_stream.retain_states:
+        return collect_stream(state_collection_stream)
+    for batch in state_collection_stream.batches:
+        pass
+    return StateCollection([],{})
+
 def add_grouping(state_collection, grouping_name, loaded_processes, overriding_parameters=None):
     """
     Adds a grouping to a state collection by using the process selected by the grouping name
@@ -35,6 +92,7 @@ def add_grouping(state_collection, grouping_name, loaded_processes, overriding_p
         loaded_processes["grouping_selector"].get(grouping_name) != None
     ):
         state_collection = loaded_processes["grouping_selector"][grouping_name].process_function(state_collection,overriding_parameters)
+        funtool.lib.general.invalidate_sorted_states(grouping_name=grouping_name)
     return state_collection
 
 def add_group_to_grouping(state_collection, grouping_name, group, group_key=None):
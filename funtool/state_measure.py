@@ -2,17 +2,29 @@
 
 import collections
 import yaml
-import importlib
 import functools
+import concurrent.futures
 
 import funtool.analysis
+import funtool.analysis_selector
+import funtool.analysis_plan
 import funtool.state_collection
 import funtool.logger
 import funtool.lib.config_parse
+import funtool.lib.lazy_import
 import funtool.lib.general
+import funtool.lib.parallel
+import funtool.lib.measure_cache
+import funtool.analysis_profile
+import funtool.progress
 
 import datetime
 
+try:
+    import numpy
+except ImportError: # numpy is only needed for batch_field_measure
+    numpy= None
+
 StateMeasure = collections.namedtuple('StateMeasure',['name','measure_module','measure_function','analysis_selectors','grouping_selectors','parameters'])
 
 # A StateMeasure is used with an AnalysisCollection and a StateCollection to measure each State in the StateCollection
@@ -28,26 +40,60 @@ StateMeasure = collections.namedtuple('StateMeasure',['name','measure_module','m
 #
 # StateMeasures are run through a loop during the actual analysis ( created in the _wrap_measure function ). The full StateMeasure process returns
 # a state_collection
+#
+# Batch measures ( see batch_state_measure and batch_field_measure ) are instead called once with all the selected states
+
+
+class StateMeasureError(Exception):
+    pass
 
 def state_measure_process(state_measure, loaded_processes): #returns a function, that accepts a state_collection, to be used as a process
     return _wrap_measure(individual_state_measure_process(state_measure), state_measure, loaded_processes)
 
+def is_streamable(state_measure):
+    """
+    Returns true if the state_measure can be run one batch of a StateCollectionStream at a time
+
+    A measure which uses groupings, analysis selectors, or sort_by needs the full StateCollection, unless 
+    its streamable parameter is set to true
+    """
+    parameters= state_measure.parameters or {}
+    if parameters.get('streamable') != None:
+        return bool(parameters['streamable'])
+    return state_measure.grouping_selectors == None and state_measure.analysis_selectors == None and 'sort_by' not in parameters
+
 import_config= functools.partial(funtool.lib.config_parse.import_config, StateMeasure, state_measure_process)
 
 
 def individual_state_measure_process(state_measure): #returns a function that accepts an analysis_collection and a state_collection
-    state_measure_module = importlib.import_module(state_measure.measure_module)
-    return functools.partial( getattr(state_measure_module,state_measure.measure_function), state_measure )
+    return funtool.lib.lazy_import.LazyFunction(state_measure.measure_module, state_measure.measure_function, state_measure)
 
 def _wrap_measure(individual_state_measure_process, state_measure, loaded_processes): 
     """
     Creates a function on a state_collection, which creates analysis_collections for each state in the collection.
     
     Optionally sorts the collection if the state_measure has a sort_by parameter (see funtool.lib.general.sort_states for details)
+
+    Optionally measures the states in a process pool if the state_measure has a parallel parameter
+        For example (as YAML):
+            parallel:
+                workers: 8          (optional: defaults to the number of cpus)
+                chunk_size: 1000    (optional: defaults to about four chunks per worker)
+    Each state is measured in a worker process, so parallel measures should only change the state being measured.
+
+    Optionally reuses results from earlier runs if the state_measure has a cache parameter (see funtool.lib.measure_cache for details)
+    The cache is keyed on the state id and data, so it should only be used with measures which depend on the state alone.
+
+    When given a StateCollectionStream, a streamable measure is applied lazily to each batch
+
+    States for which reuse_state(state) is true are skipped ( see funtool.incremental )
     """
-    def wrapped_measure(state_collection,overriding_parameters=None,loggers=None):
+    def wrapped_measure(state_collection,overriding_parameters=None,loggers=None,reuse_state=None):
         if loggers == None:
             loggers = funtool.logger.set_default_loggers()
+        if funtool.state_collection.is_stream(state_collection):
+            return funtool.state_collection.map_stream(state_collection, 
+                    lambda batch: wrapped_measure(batch, overriding_parameters, loggers, reuse_state))
         if loaded_processes != None :
             if state_measure.grouping_selectors != None:
                 for grouping_selector_name in state_measure.grouping_selectors:
@@ -55,19 +101,165 @@ def _wrap_measure(individual_state_measure_process, state_measure, loaded_proces
             states= state_collection.states
             measure_parameters= get_measure_parameters(state_measure, overriding_parameters)
             if 'sort_by' in measure_parameters.keys():
-                states= funtool.lib.general.sort_states(states, measure_parameters['sort_by'])
-            for state_index,state in enumerate(states):
-                step_size= len(states)//20
-                if state_index % step_size == 0:
-                    loggers.status_logger.warn("{}: {} %".format( datetime.datetime.now(), round((state_index/len(states) * 100 ), 1) ) )
-                analysis_collection = funtool.analysis.AnalysisCollection(state,None,{},{})
-                if state_measure.analysis_selectors != None:
-                    for analysis_selector in state_measure.analysis_selectors:
-                        analysis_collection = loaded_processes["analysis_selector"][analysis_selector].process_function(analysis_collection,state_collection)
-                if analysis_collection != None:
-                    individual_state_measure_process(analysis_collection,state_collection,overriding_parameters)
+                states= funtool.lib.general.cached_sort_states(states, measure_parameters['sort_by'])
+            if reuse_state != None:
+                states= [ state for state in states if not reuse_state(state) ]
+            if measure_parameters.get('cache') not in [None, False]:
+                measure_cache= funtool.lib.measure_cache.open_cache(measure_parameters['cache'])
+                try:
+                    states, cache_keys= _apply_cached_values(states, state_measure, measure_cache, loggers)
+                    _measure_states(states, state_collection, individual_state_measure_process, state_measure, loaded_processes, measure_parameters, loggers)
+                    _cache_values(states, cache_keys, state_measure, measure_cache)
+                finally:
+                    funtool.lib.measure_cache.close_cache(measure_cache)
+            else:
+                _measure_states(states, state_collection, individual_state_measure_process, state_measure, loaded_processes, measure_parameters, loggers)
+            for written_key in funtool.analysis_plan.declared_writes(state_measure):
+                funtool.lib.general.invalidate_sorted_states(field_key=written_key)
         return state_collection
+    wrapped_measure.streamable= is_streamable(state_measure)
     return wrapped_measure
+
+def _measure_states(states, state_collection, individual_state_measure_process, state_measure, loaded_processes, measure_parameters, loggers):
+    """
+    Measures the states, the resolved measure_parameters are passed to each call as its overriding parameters, 
+    so they aren't merged again for every state ( see funtool.lib.general.get_parameters )
+    """
+    if is_batch_measure(individual_state_measure_process):
+        _measure_batch(states, state_collection, individual_state_measure_process, state_measure, loaded_processes, measure_parameters, loggers)
+    elif measure_parameters.get('parallel') != None:
+        _measure_states_in_parallel(states, state_collection, state_measure, loaded_processes, measure_parameters, measure_parameters['parallel'], loggers)
+    else:
+        latencies= funtool.analysis_profile.current_latencies()
+        analysis_collections= _select_analysis_collections(states, state_collection, state_measure, loaded_processes)
+        progress= funtool.progress.start_progress(loggers, len(states))
+        for analysis_collection in analysis_collections:
+            if analysis_collection != None:
+                funtool.analysis_profile.timed_call(latencies, individual_state_measure_process, analysis_collection, state_collection, measure_parameters)
+            funtool.progress.advance_progress(progress)
+        funtool.progress.finish_progress(progress)
+    return states
+
+def is_batch_measure(individual_state_measure_process):
+    """
+    Returns true if the measure function was decorated with batch_state_measure or batch_field_measure
+    """
+    return getattr(getattr(individual_state_measure_process, 'func', individual_state_measure_process), 'batch_measure', False)
+
+def _measure_batch(states, state_collection, individual_state_measure_process, state_measure, loaded_processes, overriding_parameters, loggers):
+    loggers.status_logger.warn("{}: Selecting {} states".format( datetime.datetime.now(), len(states) ) )
+    analysis_collections= [ analysis_collection for analysis_collection in _select_analysis_collections(states, state_collection, state_measure, loaded_processes)
+        if analysis_collection != None ]
+    loggers.status_logger.warn("{}: Measuring {} states as a batch".format( datetime.datetime.now(), len(analysis_collections) ) )
+    latencies= funtool.analysis_profile.current_latencies()
+    progress= funtool.progress.start_progress(loggers, len(analysis_collections))
+    batch_latency= funtool.analysis_profile.timed_result(individual_state_measure_process, analysis_collections, state_collection, overriding_parameters)[1]
+    funtool.progress.update_progress(progress, len(analysis_collections))
+    funtool.progress.finish_progress(progress)
+    if latencies != None and len(analysis_collections) > 0:
+        latencies.append(batch_latency / len(analysis_collections), len(analysis_collections))
+    return states
+
+def _apply_cached_values(states, state_measure, measure_cache, loggers):
+    """
+    Writes cached values to the states found in the cache
+
+    Returns the states which still need to be measured, and a dict of id(state): cache key for those states
+    """
+    measure_key= funtool.lib.measure_cache.measure_key(state_measure)
+    cache_keys= { id(state):funtool.lib.measure_cache.cache_key(state, measure_key) for state in states }
+    cached_values= funtool.lib.measure_cache.get_cached_values(measure_cache, cache_keys.values())
+    uncached_states= []
+    for state in states:
+        values= cached_values.get(cache_keys[id(state)])
+        if values is None:
+            uncached_states.append(state)
+        else:
+            for state_field, value in values.items():
+                getattr(state, state_field)[state_measure.name]= value
+    loggers.process_logger.info("{}: {} of {} states found in the measure cache".format( state_measure.name, len(states) - len(uncached_states), len(states) ))
+    return uncached_states, cache_keys
+
+def _cache_values(states, cache_keys, state_measure, measure_cache):
+    keyed_values= ( (cache_keys[id(state)], 
+            { state_field:getattr(state, state_field)[state_measure.name] for state_field in ['measures','meta','data'] 
+                if state_measure.name in getattr(state, state_field) }) 
+        for state in states )
+    return funtool.lib.measure_cache.store_values(measure_cache, keyed_values)
+
+def _select_analysis_collections(states, state_collection, state_measure, loaded_processes):
+    """
+    Returns an iterable with an analysis_collection ( or None when a selector skips the state ) for each state
+
+    States are selected one at a time as the iterable is consumed, unless a selector is a bulk selector or is memoized,
+    then each analysis selector runs for all of the states at once ( see funtool.analysis_selector.select_analysis_collections )
+    """
+    if not funtool.analysis_selector.selects_in_bulk(state_measure.analysis_selectors, loaded_processes):
+        return ( funtool.analysis_selector.select_analysis_collection(funtool.analysis.AnalysisCollection(state,None,{},{}), 
+                state_collection, state_measure.analysis_selectors, loaded_processes)
+            for state in states )
+    analysis_collections= [ funtool.analysis.AnalysisCollection(state,None,{},{}) for state in states ]
+    return funtool.analysis_selector.select_analysis_collections(analysis_collections, state_collection, state_measure.analysis_selectors, loaded_processes)
+
+def _measure_states_in_parallel(states, state_collection, state_measure, loaded_processes, overriding_parameters, parallel_parameters, loggers):
+    """
+    Measures the states in chunks using a process pool, then merges the measures, meta, and data from each worker 
+    back into the original states, so any groups still reference the same states
+    """
+    state_positions= { id(state):position for position,state in enumerate(state_collection.states) }
+    ordered_positions= [ state_positions[id(state)] for state in states ]
+    workers= funtool.lib.parallel.get_worker_count(parallel_parameters)
+    chunk_size= funtool.lib.parallel.get_chunk_size(parallel_parameters, len(ordered_positions), workers)
+    chunks= funtool.lib.parallel.split_into_chunks(ordered_positions, chunk_size)
+    analysis_selector_processes= { analysis_selector:loaded_processes["analysis_selector"][analysis_selector] 
+        for analysis_selector in (state_measure.analysis_selectors or []) }
+    measured_count= 0
+    latencies= funtool.analysis_profile.current_latencies()
+    progress= funtool.progress.start_progress(loggers, len(ordered_positions))
+    with concurrent.futures.ProcessPoolExecutor(max_workers=workers, initializer=_initialize_parallel_worker, 
+            initargs=(state_collection, state_measure, analysis_selector_processes, overriding_parameters, latencies != None)) as executor:
+        for measured_chunk in executor.map(_measure_chunk, chunks):
+            for position, measures, meta, data, latency in measured_chunk:
+                state= state_collection.states[position]
+                state.measures.update(measures)
+                state.meta.update(meta)
+                state.data.update(data)
+                if latencies != None and latency != None:
+                    latencies.append(latency)
+            measured_count+= len(measured_chunk)
+            funtool.progress.update_progress(progress, measured_count)
+    funtool.progress.finish_progress(progress)
+    return states
+
+# Each worker process keeps its own copy of the StateCollection and the processes needed to measure it
+
+_parallel_worker= {}
+
+def _initialize_parallel_worker(state_collection, state_measure, analysis_selector_processes, overriding_parameters, measure_latency=False):
+    _parallel_worker['state_collection']= state_collection
+    _parallel_worker['state_measure']= state_measure
+    _parallel_worker['loaded_processes']= { 'analysis_selector': analysis_selector_processes }
+    _parallel_worker['overriding_parameters']= overriding_parameters
+    _parallel_worker['measure_latency']= measure_latency
+    _parallel_worker['individual_state_measure_process']= individual_state_measure_process(state_measure)
+
+def _measure_chunk(positions):
+    state_collection= _parallel_worker['state_collection']
+    measured_chunk= []
+    states= [ state_collection.states[position] for position in positions ]
+    chunk_original_values= [ ( dict(state.measures), dict(state.meta), dict(state.data) ) for state in states ]
+    analysis_collections= _select_analysis_collections(states, state_collection, _parallel_worker['state_measure'], _parallel_worker['loaded_processes'])
+    for position, state, original_values, analysis_collection in zip(positions, states, chunk_original_values, analysis_collections):
+        latencies= [] if _parallel_worker['measure_latency'] else None
+        if analysis_collection != None: # states skipped by a selector aren't timed
+            funtool.analysis_profile.timed_call(latencies, _parallel_worker['individual_state_measure_process'], 
+                analysis_collection, state_collection, _parallel_worker['overriding_parameters'])
+        measured_chunk.append( (position, 
+            funtool.lib.parallel.changed_values(original_values[0], state.measures),
+            funtool.lib.parallel.changed_values(original_values[1], state.meta),
+            funtool.lib.parallel.changed_values(original_values[2], state.data),
+            latencies[0] if latencies else None) )
+    return measured_chunk
         
 
 
@@ -149,5 +341,69 @@ def analysis_collection_and_parameter_data(state_measure_function):
         return analysis_collection
     return wrapped_function
 
+def batch_state_measure(state_measure_function):
+    """
+    Decorator for State Measures which measure all of the selected states at once
+
+    The function is given a list of states and parameters, and returns a sequence with one value per state.
+    Saves each value to state.measures with the State Measure's name as the key
+    """
+    def wrapped_function(state_measure, analysis_collections, state_collection, overriding_parameters=None):
+        measure_parameters = get_measure_parameters(state_measure, overriding_parameters)
+        states= [ analysis_collection.state for analysis_collection in analysis_collections ]
+        measure_values= state_measure_function(states,measure_parameters)
+        _save_batch_values(state_measure, states, measure_values)
+        return analysis_collections
+    wrapped_function.batch_measure= True
+    return wrapped_function
+
+def batch_field_measure(fields):
+    """
+    Decorator for State Measures which measure NumPy arrays of state fields for all of the selected states at once
+
+    fields is a list of state field: field key pairs ( like sort_by ), for example:
+        @funtool.state_measure.batch_field_measure([ {'data':'clicks'}, {'meta':'duration'} ])
+        def clicks_per_second(field_arrays, parameters):
+            return field_arrays['clicks'] / field_arrays['duration']
+
+    The function is given a dict of field key: array ( one entry per state ) and parameters, and returns an array 
+    with one value per state. Numeric fields with missing values use nan, other fields with missing values use None.
+    Saves each value to state.measures with the State Measure's name as the key
+    """
+    field_pairs= [ funtool.lib.general.get_tuple(field) for field in fields ]
+    def decorator(state_measure_function):
+        def wrapped_function(state_measure, analysis_collections, state_collection, overriding_parameters=None):
+            if numpy is None:
+                raise StateMeasureError("numpy is required for the batch field measure " + str(state_measure.name))
+            measure_parameters = get_measure_parameters(state_measure, overriding_parameters)
+            states= [ analysis_collection.state for analysis_collection in analysis_collections ]
+            field_arrays= { field_key:_field_array([ getattr(state, state_field).get(field_key) for state in states ])
+                for state_field, field_key in field_pairs }
+            measure_values= state_measure_function(field_arrays,measure_parameters)
+            _save_batch_values(state_measure, states, measure_values)
+            return analysis_collections
+        wrapped_function.batch_measure= True
+        return wrapped_function
+    return decorator
+
+def _field_array(values):
+    if any( value is None for value in values ):
+        try:
+            return numpy.array([ numpy.nan if value is None else value for value in values ], dtype=float)
+        except (TypeError, ValueError):
+            return numpy.array(values, dtype=object)
+    return numpy.array(values)
+
+def _save_batch_values(state_measure, states, measure_values):
+    if hasattr(measure_values, 'tolist'): # stores python values instead of numpy scalars
+        measure_values= measure_values.tolist()
+    measure_values= list(measure_values)
+    if len(measure_values) != len(states):
+        raise StateMeasureError("Batch measure " + str(state_measure.name) + " returned " + str(len(measure_values)) + 
+            " values for " + str(len(states)) + " states")
+    for state, measure_value in zip(states, measure_values):
+        state.measures[state_measure.name] = measure_value
+    return states
+
 get_measure_parameters= funtool.lib.general.get_parameters
 
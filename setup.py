@@ -9,18 +9,26 @@ setup(name='funtool',
         license='MIT',
         packages=[
             'funtool',
-            'funtool.lib'
+            'funtool.lib',
+            'funtool.benchmarks'
         ],
         classifiers=[
             'Development Status :: 3 - Alpha',
             'Intended Audience :: Developers',
             'License :: OSI Approved :: MIT License',
             'Programming Language :: Python :: 3',
-            'Programming Language :: Python :: 3.2',
-            'Programming Language :: Python :: 3.3',
-            'Programming Language :: Python :: 3.4'
+            'Programming Language :: Python :: 3 :: Only',
+            'Programming Language :: Python :: 3.9',
+            'Programming Language :: Python :: 3.10',
+            'Programming Language :: Python :: 3.11',
+            'Programming Language :: Python :: 3.12'
         ],
+        python_requires='>=3.9',
         install_requires=[
             'PyYAML'
         ],
+        extras_require={
+            'numpy': ['numpy'],
+            'parquet': ['pyarrow']
+        },
         zip_safe=False)
@@ -0,0 +1,37 @@
+import json
+import logging
+import os
+
+import funtool.adaptor
+import funtool.analysis
+import funtool.grouping_selector
+import funtool.logger
+import funtool.state
+import funtool.state_collection
+
+loggers= funtool.logger.Loggers(logging.getLogger('funtool.tests.analysis'), logging.getLogger('funtool.tests.process'), 
+    logging.getLogger('funtool.tests.status'))
+
+
+def states(values):
+    return [ funtool.state.State(str(index), {'x': value}, {}, {}, {}) for index, value in enumerate(values) ]
+
+def state_collection(values):
+    return funtool.state_collection.StateCollection(states(values), {})
+
+def grouping_processes(**grouping_functions):
+    processes= {}
+    for grouping_name, selector_function in grouping_functions.items():
+        grouping_selector= funtool.grouping_selector.GroupingSelector(grouping_name, 'tests.measures', selector_function, {})
+        processes[grouping_name]= funtool.analysis.Process(grouping_selector, funtool.grouping_selector.grouping_selector_process(grouping_selector))
+    return { 'analysis_selector': {}, 'grouping_selector': processes }
+
+def write_values(directory, values):
+    path= os.path.join(str(directory), 'values.json')
+    with open(path, 'w') as f:
+        json.dump(values, f)
+    return path
+
+def list_adaptor_process(path, adaptor_function='list_adaptor'):
+    adaptor= funtool.adaptor.Adaptor('tests.measures', adaptor_function, {'file': path})
+    return funtool.analysis.Process(adaptor, funtool.adaptor.adaptor_process(adaptor))
@@ -0,0 +1,83 @@
+# Adaptors, selectors, and measures used by the tests, imported by name as the processes of an analysis
+
+import json
+import time
+
+import funtool.adaptor
+import funtool.group
+import funtool.state
+import funtool.state_collection
+import funtool.state_measure
+
+CALLS= []
+
+
+def list_adaptor(adaptor, state_collection, overriding_parameters=None, loggers=None):
+    with open(adaptor.parameters['file']) as f:
+        values= json.load(f)
+    return funtool.state_collection.StateCollection([ funtool.state.State(str(index), {'x': value}, {}, {}, {}) 
+        for index, value in enumerate(values) ], {})
+
+@funtool.adaptor.streaming_adaptor
+def streamed_list(adaptor, parameters):
+    with open(parameters['file']) as f:
+        values= json.load(f)
+    for index, value in enumerate(values):
+        yield funtool.state.State(str(index), {'x': value}, {}, {}, {})
+
+def by_mod(grouping_selector, state_collection, overriding_parameters=None):
+    for remainder in range(3):
+        funtool.state_collection.add_group_to_grouping(state_collection, grouping_selector.name, 
+            funtool.group.create_group(grouping_selector.name, [ state for state in state_collection.states if state.data['x'] % 3 == remainder ], {}, {}, {}), remainder)
+    return state_collection
+
+def overlapping(grouping_selector, state_collection, overriding_parameters=None):
+    for divisor in range(2, 12):
+        funtool.state_collection.add_group_to_grouping(state_collection, grouping_selector.name, 
+            funtool.group.create_group(grouping_selector.name, [ state for state in state_collection.states if state.data['x'] % divisor == 0 ], {}, {}, {}), divisor)
+    return state_collection
+
+@funtool.state_measure.state_and_parameter_measure
+def square(state, parameters):
+    return state.data['x'] ** 2
+
+@funtool.state_measure.state_and_parameter_measure
+def group_max(state, parameters):
+    CALLS.append(state.id)
+    return max( group_state.data['x'] for group_state in state.groupings['mod'][0].states )
+
+def group_size(group_measure, analysis_collection, state_collection):
+    group= analysis_collection.group
+    time.sleep(0.001 * (len(group.states) % 3)) # finish out of order
+    group.measures[group_measure.name]= len(group.states)
+    for state in group.states:
+        state.measures['last_group_size']= len(group.states)
+
+def earlier_measured(analysis_selector, analysis_collection, state_collection):
+    analysis_collection.states_dict['earlier']= [ state for state in state_collection.states if 'earlier_count' in state.measures ]
+    return analysis_collection
+
+@funtool.state_measure.analysis_collection_and_parameter_measure
+def earlier_count(analysis_collection, parameters):
+    return len(analysis_collection.states_dict['earlier'])
+
+@funtool.state_measure.analysis_collection_and_parameter_measure
+def previous_x(analysis_collection, parameters):
+    CALLS.append(analysis_collection.state.id)
+    previous_states= analysis_collection.states_dict['previous']
+    return previous_states[0].data['x'] if previous_states else None
+
+@funtool.state_measure.state_and_parameter_measure
+def gap(state, parameters):
+    CALLS.append('gap ' + state.id)
+    return state.data['x'] - (state.measures['previous_x'] or 0)
+
+@funtool.state_measure.state_and_parameter_measure
+def recorded_parameters(state, parameters):
+    CALLS.append(parameters)
+    return parameters['power']
+
+@funtool.state_measure.state_and_parameter_measure
+def counted_square(state, parameters):
+    CALLS.append(state.id)
+    return state.data['x'] ** 2
@@ -0,0 +1,39 @@
+import pytest
+
+import funtool.analysis
+import funtool.analysis_plan
+import funtool.state_measure
+
+from tests import helpers
+
+
+def square_analysis(parameters):
+    processes= []
+    for name in [ 'first', 'second' ]:
+        state_measure= funtool.state_measure.StateMeasure(name, 'tests.measures', 'square', None, None, parameters)
+        processes.append(funtool.analysis.Process(state_measure, funtool.state_measure.state_measure_process(state_measure, { 'analysis_selector': {} })))
+    process_identifiers= funtool.analysis.load_process_identifiers([ { 'state_measure': 'first' }, { 'state_measure': 'second' } ])
+    return funtool.analysis.Analysis('squares', process_identifiers, processes, None)
+
+def test_measures_with_declared_reads_share_a_stage():
+    plan= funtool.analysis_plan.compile_plan(square_analysis({ 'reads': [ { 'data': 'x' } ] }), { 'analysis_selector': {} }, workers=2)
+    assert plan.stages == [ [ 0, 1 ] ]
+
+def test_measures_without_declared_reads_run_alone():
+    plan= funtool.analysis_plan.compile_plan(square_analysis({}), { 'analysis_selector': {} }, workers=2)
+    assert plan.stages == [ [ 0 ], [ 1 ] ]
+    assert 'Measures without declared reads' in funtool.analysis_plan.format_plan(plan)
+
+def test_run_stage_keeps_the_state_collection():
+    plan= funtool.analysis_plan.compile_plan(square_analysis({ 'reads': [ { 'data': 'x' } ] }), { 'analysis_selector': {} }, workers=2)
+    collection= helpers.state_collection(range(3))
+    result= funtool.analysis_plan.run_stage(plan, plan.stages[0], collection, 
+        lambda index, state_collection: plan.analysis.processes[index].process_function(state_collection, None, helpers.loggers))
+    assert result is collection
+    assert collection.states[2].measures == { 'first': 4, 'second': 4 }
+
+def test_run_stage_rejects_a_new_state_collection():
+    plan= funtool.analysis_plan.compile_plan(square_analysis({ 'reads': [ { 'data': 'x' } ] }), { 'analysis_selector': {} }, workers=2)
+    with pytest.raises(funtool.analysis_plan.AnalysisPlanError):
+        funtool.analysis_plan.run_stage(plan, plan.stages[0], helpers.state_collection(range(3)), 
+            lambda index, state_collection: helpers.state_collection(range(3)))
@@ -0,0 +1,51 @@
+import csv
+import os
+import threading
+
+import funtool.analysis_profile
+
+from tests import helpers
+
+
+def test_nested_cprofile_calls_run_inside_the_enclosing_profile(tmp_path):
+    options= funtool.analysis_profile.profiler_options('cprofile')
+    results= []
+    def nested_step():
+        return funtool.analysis_profile.profiled_call(options, str(tmp_path), 'inner', lambda: 'inner result')
+    thread= threading.Thread(target=lambda: results.append(funtool.analysis_profile.profiled_call(options, str(tmp_path), 'outer', nested_step)), daemon=True)
+    thread.start()
+    thread.join(10)
+    assert not thread.is_alive()
+    ( inner_result, inner_path ), outer_path= results[0]
+    assert ( inner_result, inner_path ) == ( 'inner result', None )
+    assert os.path.exists(outer_path) and not os.path.exists(str(tmp_path / 'inner.pstats'))
+
+def test_latency_histogram_percentiles():
+    latencies= funtool.analysis_profile.LatencyHistogram()
+    for latency in range(1, 101):
+        latencies.append(latency / 1000)
+    latencies.append(0.5, 100)
+    p50, p90, p99, latency_max= funtool.analysis_profile.latency_percentiles(latencies)
+    assert len(latencies) == 200 and latency_max == 0.5 and p99 == 0.5
+    assert 0.1 <= p50 <= 0.1 * 1.13
+    assert len(latencies.bucket_counts) <= 41
+
+def profiled_steps(tmp_path, measure_latency):
+    analysis_profile= funtool.analysis_profile.start_profile('profiled', str(tmp_path), measure_latency=measure_latency)
+    def step():
+        funtool.analysis_profile.timed_call(funtool.analysis_profile.current_latencies(), lambda: None)
+        return helpers.state_collection([ 1, 2 ])
+    for step_number in [ 1, 2 ]:
+        funtool.analysis_profile.profile_step(analysis_profile, step_number, 'state_measure', 'timed', step)
+    return analysis_profile
+
+def test_latencies_are_only_measured_when_asked_for(tmp_path):
+    assert [ step_profile.measured_count for step_profile in profiled_steps(tmp_path / 'off', False).step_profiles ] == [ None, None ]
+    assert [ step_profile.measured_count for step_profile in profiled_steps(tmp_path / 'on', True).step_profiles ] == [ 1, 1 ]
+
+def test_a_csv_row_is_appended_for_each_step(tmp_path):
+    profiled_steps(tmp_path, True)
+    with open(str(tmp_path / 'profile.csv')) as f:
+        rows= list(csv.reader(f))
+    assert rows[0] == list(funtool.analysis_profile.StepProfile._fields)
+    assert [ row[0] for row in rows[1:] ] == [ '1', '2' ]
@@ -0,0 +1,37 @@
+import funtool.analysis
+import funtool.analysis_selector
+
+from tests import helpers
+
+
+def selector_processes(**selectors):
+    processes= {}
+    for name, (selector_function, parameters) in selectors.items():
+        analysis_selector= funtool.analysis_selector.AnalysisSelector('funtool.analysis_selector', selector_function, parameters)
+        processes[name]= funtool.analysis.Process(analysis_selector, funtool.analysis_selector.analysis_selector_process(analysis_selector))
+    return { 'analysis_selector': processes }
+
+def select(collection, selector_names, loaded_processes):
+    analysis_collections= [ funtool.analysis.AnalysisCollection(state, None, {}, {}) for state in collection.states ]
+    return funtool.analysis_selector.select_analysis_collections(analysis_collections, collection, selector_names, loaded_processes)
+
+def user_collection(count):
+    collection= helpers.state_collection(range(count))
+    for state in collection.states:
+        state.meta['user_id']= state.data['x'] % 2
+    return collection
+
+def test_memoized_selections_are_shared_by_key():
+    loaded_processes= selector_processes(same_user=( 'states_with_same_key', { 'key': { 'meta': 'user_id' }, 'memoize_by': [ { 'meta': 'user_id' } ] } ))
+    selected= select(user_collection(4), [ 'same_user' ], loaded_processes)
+    assert [ [ state.id for state in analysis_collection.states_dict['same_key'] ] for analysis_collection in selected ] == [
+        [ '0', '2' ], [ '1', '3' ], [ '0', '2' ], [ '1', '3' ] ]
+
+def test_selector_after_a_memoized_selector_sets_each_state():
+    loaded_processes= selector_processes(
+        same_user=( 'states_with_same_key', { 'key': { 'meta': 'user_id' }, 'memoize_by': [ { 'meta': 'user_id' } ] } ),
+        previous=( 'neighboring_states', { 'partition_by': { 'meta': 'user_id' } } ))
+    selected= select(user_collection(6), [ 'same_user', 'previous' ], loaded_processes)
+    assert [ [ state.id for state in analysis_collection.states_dict['previous'] ] for analysis_collection in selected ] == [
+        [], [], [ '0' ], [ '1' ], [ '2' ], [ '3' ] ]
+    assert [ len(analysis_collection.states_dict['same_key']) for analysis_collection in selected ] == [ 3 ] * 6
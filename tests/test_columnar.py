@@ -0,0 +1,58 @@
+import json
+import os
+
+import pytest
+
+import funtool.columnar
+import funtool.state
+
+from tests import helpers
+
+numpy= pytest.importorskip('numpy')
+
+
+def test_npy_columns_are_written_in_chunks(tmp_path):
+    states= helpers.states(range(10))
+    for state in states:
+        state.measures['half']= state.data['x'] / 2
+        state.measures['label']= 'state %s'% state.id if state.data['x'] % 2 else None
+    directory= str(tmp_path / 'states')
+    funtool.columnar.write_table(directory, funtool.columnar.state_columns(states, data_keys=[ 'x' ], chunk_size=3), states, 'npy', chunk_size=3)
+    columns= funtool.columnar.read_npy_columns(directory)
+    assert list(columns) == [ 'id', 'data.x', 'half', 'label' ]
+    assert columns['data.x'].dtype == numpy.int64 and columns['data.x'].tolist() == list(range(10))
+    assert columns['half'].tolist() == [ x / 2 for x in range(10) ]
+    assert columns['label'].tolist()[:2] == [ '', 'state 1' ]
+
+def test_npy_strings_are_variable_length(tmp_path):
+    states= helpers.states(range(4))
+    for state in states:
+        state.measures['note']= 'é' * state.data['x']
+        state.measures['details']= { 'x': [ state.data['x'] ] * 1000 } if state.data['x'] == 3 else None
+    directory= str(tmp_path / 'states')
+    funtool.columnar.write_table(directory, funtool.columnar.state_columns(states, chunk_size=3), states, 'npy', chunk_size=3)
+    with open(os.path.join(directory, 'columns.json')) as f:
+        column_descriptions= { column_description['name']:column_description for column_description in json.load(f)['columns'] }
+    assert column_descriptions['note']['values_file'] == '0001.bytes'
+    assert os.path.getsize(os.path.join(directory, '0001.bytes')) == 2 * (0 + 1 + 2 + 3)
+    columns= funtool.columnar.read_npy_columns(directory)
+    assert columns['note'].tolist() == [ '', 'é', 'éé', 'ééé' ]
+    assert columns['note'][-1] == 'ééé' and columns['note'][1:3] == [ 'é', 'éé' ]
+    assert columns['details'][:3] == [ '', '', '' ] and json.loads(columns['details'][3]) == { 'x': [ 3 ] * 1000 }
+    assert os.path.getsize(os.path.join(directory, '0002.bytes')) == len(columns['details'][3])
+
+def test_npy_table_without_rows(tmp_path):
+    directory= str(tmp_path / 'states')
+    funtool.columnar.write_table(directory, [ funtool.columnar.Column('label', None, 'string', False), funtool.columnar.Column('x', None, 'int64', False) ], [], 'npy')
+    columns= funtool.columnar.read_npy_columns(directory)
+    assert columns['label'].tolist() == [] and len(columns['x']) == 0
+
+def test_column_types():
+    mixed= funtool.columnar.infer_column('mixed', lambda row: row, [ 1, 2.5, None ], chunk_size=1)
+    assert ( mixed.column_type, mixed.nullable ) == ( 'float64', True )
+    assert funtool.columnar.infer_column('big', lambda row: row, [ 1, 2**70 ]).column_type == 'json'
+    assert funtool.columnar.infer_column('flags', lambda row: row, [ True, False ]).column_type == 'bool'
+
+def test_measure_named_like_another_column_is_rejected():
+    with pytest.raises(funtool.columnar.ColumnarError):
+        funtool.columnar.state_columns([ funtool.state.State('1', {}, { 'id': 2 }, {}, {}) ])
@@ -0,0 +1,21 @@
+import pickle
+
+import funtool.compact_state
+
+from tests import helpers
+
+
+def test_state_views_keep_their_mappings():
+    store= funtool.compact_state.from_states(helpers.states(range(2)))
+    state= store.states[1]
+    assert state.measures is state.measures and state.meta is state.meta
+    state.measures['a']= 1
+    assert store.measures['a'][1] == 1 and 'a' not in store.states[0].measures
+    assert state.to_state().measures == { 'a': 1 }
+
+def test_pickled_state_views_share_their_store():
+    store= funtool.compact_state.from_states(helpers.states(range(2)))
+    store.states[0].measures['a']= 1
+    copied_store= pickle.loads(pickle.dumps(store))
+    copied_store.states[0].measures['a']= 2
+    assert copied_store.measures['a'][0] == 2 and store.measures['a'][0] == 1
@@ -0,0 +1,65 @@
+import pickle
+
+import pytest
+
+import funtool.compact_state
+import funtool.data_store
+import funtool.group
+import funtool.lib.general
+import funtool.state_collection
+
+from tests import helpers
+
+
+@pytest.fixture
+def data_store(tmp_path):
+    data_store= funtool.data_store.open_data_store(str(tmp_path / 'data.store'))
+    yield data_store
+    funtool.data_store.close_data_store(data_store)
+
+def test_fields_are_decoded_when_used(data_store):
+    stored_data= funtool.data_store.store_data(data_store, { 'a': 1, 'b': [ 1, 2 ] })
+    assert stored_data['a'] == 1
+    assert 'b' in stored_data and len(stored_data) == 2
+    assert dict(stored_data) == { 'a': 1, 'b': [ 1, 2 ] }
+
+def test_set_and_deleted_keys(data_store):
+    stored_data= funtool.data_store.store_data(data_store, { 'a': 1, 'b': 2 })
+    stored_data['c']= 3
+    del stored_data['a']
+    assert dict(stored_data) == { 'b': 2, 'c': 3 }
+    with pytest.raises(KeyError):
+        stored_data['a']
+
+def test_hashing_does_not_decode_the_record(data_store):
+    stored_data= funtool.data_store.store_data(data_store, { 'a': 1, 'b': 'x' * 1000 })
+    data_hash= funtool.lib.general.hash_value(stored_data)
+    assert stored_data._decoded == {}
+    assert funtool.lib.general.hash_value(funtool.data_store.store_data(data_store, { 'a': 1, 'b': 'x' * 1000 })) == data_hash
+    stored_data['a']= 2
+    assert funtool.lib.general.hash_value(stored_data) != data_hash
+
+def test_pickle_keeps_the_record_location_and_changes(data_store):
+    stored_data= funtool.data_store.store_data(data_store, { 'a': 1, 'b': 'x' * 1000 })
+    stored_data['c']= 3
+    del stored_data['a']
+    assert stored_data['b'] == 'x' * 1000
+    pickled= pickle.dumps(stored_data)
+    assert len(pickled) < 500
+    assert dict(pickle.loads(pickled)) == { 'b': 'x' * 1000, 'c': 3 }
+
+def test_store_state_data_keeps_groups_pointing_at_the_states(data_store):
+    collection= helpers.state_collection(range(4))
+    group= funtool.group.create_group('all', list(collection.states), {}, {}, {})
+    funtool.state_collection.add_group_to_grouping(collection, 'all', group, 'all')
+    stored_collection= funtool.data_store.store_state_data(collection, data_store)
+    assert all( isinstance(state.data, funtool.data_store.StoredData) for state in stored_collection.states )
+    assert all( group_state is state for group_state, state in zip(stored_collection.groupings['all']['all'].states, stored_collection.states) )
+    assert [ state.data['x'] for state in stored_collection.states ] == [ 0, 1, 2, 3 ]
+
+def test_store_state_data_of_compact_states(data_store):
+    compact_store= funtool.compact_state.from_states(helpers.states(range(3)))
+    stored_collection= funtool.data_store.store_state_data(compact_store.state_collection(), data_store)
+    assert stored_collection.states[1] is compact_store.states[1]
+    assert isinstance(stored_collection.states[1].data, funtool.data_store.StoredData)
+    assert stored_collection.states[1].data['x'] == 1
@@ -0,0 +1,55 @@
+import collections
+import copy
+import json
+import pickle
+
+import pytest
+
+import funtool.group_measure
+import funtool.lib.general
+import funtool.reporter
+
+Process = collections.namedtuple('Process', [ 'parameters' ])
+
+
+def test_parameters_are_merged_and_read_only():
+    parameters= funtool.lib.general.get_parameters(Process({ 'a': 1, 'b': [ 1, { 'c': 2 } ] }), { 'a': 3 })
+    assert parameters == { 'a': 3, 'b': [ 1, { 'c': 2 } ] }
+    assert isinstance(parameters, dict) and isinstance(parameters['b'], list)
+    with pytest.raises(TypeError):
+        parameters['a']= 4
+    with pytest.raises(TypeError):
+        parameters['b'].append(2)
+
+def test_parameters_behave_as_plain_dicts():
+    parameters= funtool.lib.general.get_parameters(Process({ 'a': [ 1 ] }), None)
+    assert json.loads(json.dumps(parameters)) == { 'a': [ 1 ] }
+    mutable_copy= parameters.copy()
+    mutable_copy['b']= 2
+    assert mutable_copy == { 'a': [ 1 ], 'b': 2 }
+    assert copy.deepcopy(parameters) == parameters
+    assert pickle.loads(pickle.dumps(parameters)) == parameters
+    assert funtool.lib.general.thaw_parameters(parameters) == { 'a': [ 1 ] }
+
+def test_parameters_changed_in_place_are_merged_again():
+    process_parameters= { 'a': 1 }
+    assert funtool.lib.general.get_parameters(Process(process_parameters), None)['a'] == 1
+    process_parameters['a']= 2
+    assert funtool.lib.general.get_parameters(Process(process_parameters), None)['a'] == 2
+
+def test_resolved_parameters_are_returned_as_they_are():
+    parameters= funtool.lib.general.get_parameters(Process({ 'a': 1 }), { 'b': 2 })
+    assert funtool.lib.general.get_parameters(Process({ 'a': 1 }), parameters) is parameters
+
+@pytest.mark.parametrize('get_parameters', [ funtool.group_measure.get_measure_parameters, funtool.reporter.get_parameters ])
+def test_process_parameters_are_not_changed(get_parameters):
+    process_parameters= { 'a': 1 }
+    assert get_parameters(Process(process_parameters), { 'a': 2 }) == { 'a': 2 }
+    assert process_parameters == { 'a': 1 }
+
+def test_no_parameters():
+    assert funtool.lib.general.get_parameters(Process(None), None) is None
+
+def test_hash_value_ignores_key_order():
+    assert funtool.lib.general.hash_value({ 'a': 1, 'b': 2 }) == funtool.lib.general.hash_value({ 'b': 2, 'a': 1 })
+    assert funtool.lib.general.hash_value({ 'a': 1 }) != funtool.lib.general.hash_value({ 'a': 2 })
@@ -0,0 +1,27 @@
+import pytest
+
+import funtool.group_measure
+
+from tests import helpers
+
+
+def measure_groups(executor):
+    collection= helpers.state_collection(range(60))
+    parameters= { 'executor': executor } if executor != None else {}
+    group_measure= funtool.group_measure.GroupMeasure('group_size', 'tests.measures', 'group_size', None, [ 'overlapping' ], parameters)
+    funtool.group_measure.group_measure_process(group_measure, helpers.grouping_processes(overlapping='overlapping'))(collection, None, helpers.loggers)
+    return ( [ dict(state.measures) for state in collection.states ], 
+        { group_key:dict(group.measures) for group_key, group in collection.groupings['overlapping'].items() } )
+
+@pytest.mark.parametrize('executor', [ { 'type': 'thread', 'workers': 4 }, { 'type': 'process', 'workers': 2, 'chunk_size': 3 } ])
+def test_concurrent_group_measure_matches_serial(executor):
+    assert measure_groups(executor) == measure_groups(None)
+
+def test_overlapping_groups_are_written_in_grouping_order():
+    state_measures, group_measures= measure_groups({ 'type': 'thread', 'workers': 4 })
+    assert state_measures[6]['last_group_size'] == group_measures[6]['group_size'] # in the groups of 2, 3, and 6, which is written last
+    assert 'last_group_size' not in state_measures[1]
+
+def test_unknown_executor_type():
+    with pytest.raises(funtool.group_measure.GroupMeasureError):
+        measure_groups({ 'type': 'fiber' })
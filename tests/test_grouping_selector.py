@@ -0,0 +1,27 @@
+import pytest
+
+import funtool.grouping_selector
+
+from tests import helpers
+
+
+def group_by_key_process(group_by):
+    grouping_selector= funtool.grouping_selector.GroupingSelector('by_key', 'funtool.grouping_selector', 'group_by_key', { 'group_by': group_by })
+    return funtool.grouping_selector.grouping_selector_process(grouping_selector)
+
+def test_group_by_a_measure_as_an_analysis_step():
+    collection= helpers.state_collection([ 1, 2, 3 ])
+    for state in collection.states:
+        state.measures['parity']= state.data['x'] % 2
+    collection= group_by_key_process({ 'measure': 'parity' })(collection, None, helpers.loggers)
+    assert { group_key:[ state.data['x'] for state in group.states ] for group_key, group in collection.groupings['by_key'].items() } == {
+        1: [ 1, 3 ], 0: [ 2 ] }
+    assert collection.groupings['by_key'][1].meta == { 'parity': 1 }
+
+def test_group_by_an_unhashable_value():
+    collection= helpers.state_collection([ 1, 2 ])
+    for state in collection.states:
+        state.meta['user_id']= state.data['x']
+        state.meta['tags']= [ 'a' ]
+    with pytest.raises(funtool.grouping_selector.GroupingSelectorError, match="meta: tags \\( a list value"):
+        group_by_key_process([ { 'meta': 'user_id' }, { 'meta': 'tags' } ])(collection)
@@ -0,0 +1,72 @@
+import funtool.analysis
+import funtool.analysis_selector
+import funtool.state_measure
+
+from tests import helpers
+from tests import measures
+
+
+def group_max_analysis(path, adaptor_function='list_adaptor'):
+    group_max= funtool.state_measure.StateMeasure('group_max', 'tests.measures', 'group_max', None, [ 'mod' ], {})
+    processes= [ helpers.list_adaptor_process(path, adaptor_function),
+        funtool.analysis.Process(group_max, funtool.state_measure.state_measure_process(group_max, helpers.grouping_processes(mod='by_mod'))) ]
+    process_identifiers= funtool.analysis.load_process_identifiers([ { 'adaptor': adaptor_function }, { 'state_measure': 'group_max' } ])
+    return funtool.analysis.Analysis('group_max', process_identifiers, processes, None)
+
+def previous_x_analysis(path, previous_x_parameters=None):
+    selector= funtool.analysis_selector.AnalysisSelector('funtool.analysis_selector', 'neighboring_states', { 'sort_by': [ { 'data': 'x' } ] })
+    loaded_processes= { 'analysis_selector': { 'previous': funtool.analysis.Process(selector, funtool.analysis_selector.analysis_selector_process(selector)) } }
+    previous_x= funtool.state_measure.StateMeasure('previous_x', 'tests.measures', 'previous_x', [ 'previous' ], None, previous_x_parameters or {})
+    gap= funtool.state_measure.StateMeasure('gap', 'tests.measures', 'gap', None, None, {})
+    processes= [ helpers.list_adaptor_process(path) ] + [ funtool.analysis.Process(state_measure, funtool.state_measure.state_measure_process(state_measure, loaded_processes)) 
+        for state_measure in [ previous_x, gap ] ]
+    process_identifiers= funtool.analysis.load_process_identifiers([ { 'adaptor': 'list_adaptor' }, { 'state_measure': 'previous_x' }, { 'state_measure': 'gap' } ])
+    return funtool.analysis.Analysis('previous_x', process_identifiers, processes, None)
+
+def run(analysis, tmp_path, measure_name='group_max'):
+    del measures.CALLS[:]
+    state_collection= funtool.analysis.run_analysis(analysis, None, str(tmp_path / 'logs'), incremental_dir=str(tmp_path / 'incremental'))
+    return { state.id:state.measures[measure_name] for state in state_collection.states }, sorted(measures.CALLS)
+
+def test_unchanged_states_are_reused(tmp_path):
+    analysis= group_max_analysis(helpers.write_values(tmp_path, [ 1, 2, 3, 4, 5, 6 ]))
+    first_measures, first_calls= run(analysis, tmp_path)
+    second_measures, second_calls= run(analysis, tmp_path)
+    assert second_measures == first_measures
+    assert len(first_calls) == 6 and second_calls == []
+
+def test_group_members_of_a_changed_state_are_measured_again(tmp_path):
+    path= helpers.write_values(tmp_path, [ 1, 2, 3, 4, 5, 6 ])
+    analysis= group_max_analysis(path)
+    run(analysis, tmp_path)
+    helpers.write_values(tmp_path, [ 10, 2, 3, 4, 5, 6 ]) # 10 stays in the group of 1 and 4
+    group_maxes, calls= run(analysis, tmp_path)
+    assert calls == [ '0', '3' ]
+    assert group_maxes == { '0': 10, '1': 5, '2': 6, '3': 10, '4': 5, '5': 6 }
+
+def test_streamed_states_are_compared_with_the_previous_run(tmp_path):
+    path= helpers.write_values(tmp_path, [ 1, 2, 3, 4, 5, 6 ])
+    analysis= group_max_analysis(path, 'streamed_list')
+    run(analysis, tmp_path)
+    helpers.write_values(tmp_path, [ 1, 2, 3, 4, 5, 9 ])
+    group_maxes, calls= run(analysis, tmp_path)
+    assert calls == [ '2', '5' ]
+    assert group_maxes['2'] == 9
+
+def test_measures_with_analysis_selectors_measure_every_state(tmp_path):
+    path= helpers.write_values(tmp_path, [ 10, 20, 30 ])
+    analysis= previous_x_analysis(path)
+    run(analysis, tmp_path, 'gap')
+    helpers.write_values(tmp_path, [ 10, 20, 30, 15 ]) # 15 is inserted before 20
+    gaps, calls= run(analysis, tmp_path, 'gap')
+    assert calls == [ '0', '1', '2', '3', 'gap 1', 'gap 3' ]
+    assert gaps == { '0': 10, '1': 5, '2': 10, '3': 5 }
+
+def test_measures_with_analysis_selectors_can_reuse_values(tmp_path):
+    path= helpers.write_values(tmp_path, [ 10, 20, 30 ])
+    analysis= previous_x_analysis(path, { 'incremental': 'reuse' })
+    run(analysis, tmp_path, 'gap')
+    helpers.write_values(tmp_path, [ 10, 20, 30, 15 ])
+    previous_values, calls= run(analysis, tmp_path, 'previous_x')
+    assert calls == [ '3', 'gap 3' ]
+    assert previous_values['1'] == 10 # reused, though 15 is now the previous state
@@ -0,0 +1,42 @@
+import funtool.lib.measure_cache
+import funtool.state_measure
+
+from tests import helpers
+from tests import measures
+
+
+def cached_square(tmp_path, parameters=None):
+    cache_parameters= { 'cache': { 'path': str(tmp_path / 'cache.sqlite') } }
+    cache_parameters.update(parameters or {})
+    state_measure= funtool.state_measure.StateMeasure('square', 'tests.measures', 'counted_square', None, None, cache_parameters)
+    return funtool.state_measure.state_measure_process(state_measure, { 'analysis_selector': {} })
+
+def measure(process, values):
+    del measures.CALLS[:]
+    collection= process(helpers.state_collection(values), None, helpers.loggers)
+    return [ state.measures['square'] for state in collection.states ], sorted(measures.CALLS)
+
+def test_cached_values_are_reused(tmp_path):
+    assert measure(cached_square(tmp_path), [ 1, 2, 3 ]) == ( [ 1, 4, 9 ], [ '0', '1', '2' ] )
+    assert measure(cached_square(tmp_path), [ 1, 2, 3 ]) == ( [ 1, 4, 9 ], [] )
+
+def test_changed_data_is_measured_again(tmp_path):
+    measure(cached_square(tmp_path), [ 1, 2, 3 ])
+    assert measure(cached_square(tmp_path), [ 1, 5, 3 ]) == ( [ 1, 25, 9 ], [ '1' ] )
+
+def test_changed_parameters_are_measured_again(tmp_path):
+    measure(cached_square(tmp_path), [ 1, 2 ])
+    assert measure(cached_square(tmp_path, { 'power': 3 }), [ 1, 2 ])[1] == [ '0', '1' ]
+
+def test_execution_parameters_share_the_cache(tmp_path):
+    measure(cached_square(tmp_path), [ 1, 2 ])
+    assert measure(cached_square(tmp_path, { 'streamable': True }), [ 1, 2 ])[1] == []
+
+def test_least_recently_used_values_are_evicted(tmp_path):
+    measure_cache= funtool.lib.measure_cache.open_cache({ 'path': str(tmp_path / 'evict.sqlite'), 'max_size': 200 })
+    try:
+        funtool.lib.measure_cache.store_values(measure_cache, [ ('old', { 'measures': 'x' * 150 }) ])
+        funtool.lib.measure_cache.store_values(measure_cache, [ ('new', { 'measures': 'y' * 150 }) ])
+        assert list(funtool.lib.measure_cache.get_cached_values(measure_cache, [ 'old', 'new' ])) == [ 'new' ]
+    finally:
+        funtool.lib.measure_cache.close_cache(measure_cache)
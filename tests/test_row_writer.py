@@ -0,0 +1,51 @@
+import csv
+import json
+
+import pytest
+
+import funtool.lib.row_writer
+import funtool.reporter
+
+from tests import helpers
+
+
+def read_csv(path):
+    with open(path, newline='') as f:
+        return list(csv.reader(f))
+
+def test_csv_columns_are_the_union_of_the_first_chunk(tmp_path):
+    path= str(tmp_path / 'rows.csv')
+    row_writer= funtool.lib.row_writer.open_row_writer(path, chunk_size=10)
+    funtool.lib.row_writer.write_rows(row_writer, [ { 'id': 1 }, { 'id': 2, 'b': 3 } ])
+    assert funtool.lib.row_writer.close_row_writer(row_writer) == 2
+    assert read_csv(path) == [ [ 'id', 'b' ], [ '1', '' ], [ '2', '3' ] ]
+
+def test_csv_row_with_a_new_column_after_the_header_raises(tmp_path):
+    row_writer= funtool.lib.row_writer.open_row_writer(str(tmp_path / 'rows.csv'), chunk_size=1)
+    funtool.lib.row_writer.write_rows(row_writer, [ { 'id': 1 } ])
+    with pytest.raises(funtool.lib.row_writer.RowWriterError):
+        funtool.lib.row_writer.write_rows(row_writer, [ { 'id': 2, 'b': 3 } ])
+    funtool.lib.row_writer.close_row_writer(row_writer)
+
+def test_json_lines(tmp_path):
+    path= str(tmp_path / 'rows.jsonl')
+    row_writer= funtool.lib.row_writer.open_row_writer(path, chunk_size=1)
+    funtool.lib.row_writer.write_rows(row_writer, [ { 'id': 1 }, { 'id': 2, 'b': [ 3 ] } ])
+    funtool.lib.row_writer.close_row_writer(row_writer)
+    with open(path) as f:
+        assert [ json.loads(line) for line in f ] == [ { 'id': 1 }, { 'id': 2, 'b': [ 3 ] } ]
+
+def test_state_report_writes_every_measure(tmp_path):
+    collection= helpers.state_collection(range(3))
+    collection.states[0].measures['a']= 1
+    collection.states[2].measures['b']= 2
+    reporter= funtool.reporter.Reporter('funtool.reporter', 'state_report', { 'save_directory': str(tmp_path), 'filename': 'states.csv' })
+    funtool.reporter.state_report(reporter, collection)
+    assert read_csv(str(tmp_path / 'states.csv')) == [ [ 'id', 'a', 'b' ], [ '0', '1', '' ], [ '1', '', '' ], [ '2', '', '2' ] ]
+
+def test_state_report_file_extension_follows_the_format(tmp_path):
+    collection= helpers.state_collection(range(2))
+    reporter= funtool.reporter.Reporter('funtool.reporter', 'state_report', { 'save_directory': str(tmp_path), 'format': 'jsonl' })
+    funtool.reporter.state_report(reporter, collection)
+    with open(str(tmp_path / 'state_report.jsonl')) as f:
+        assert [ json.loads(line) for line in f ] == [ { 'id': '0' }, { 'id': '1' } ]
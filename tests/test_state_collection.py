@@ -0,0 +1,24 @@
+import funtool.group
+import funtool.state_collection
+
+from tests import helpers
+
+
+def batch(values, group_key):
+    collection= helpers.state_collection(values)
+    funtool.state_collection.add_group_to_grouping(collection, 'batch',
+        funtool.group.create_group('batch', list(collection.states), {}, {}, {}), group_key)
+    return collection
+
+def test_collect_stream_joins_the_batches():
+    batches= [ batch([ 1, 2 ], 'first'), batch([ 3 ], 'second'), batch([ 4, 5 ], 'first') ]
+    collected= funtool.state_collection.collect_stream(funtool.state_collection.StateCollectionStream(iter(batches), True))
+    assert [ state.data['x'] for state in collected.states ] == [ 1, 2, 3, 4, 5 ]
+    assert sorted(collected.groupings['batch']) == [ 'first', 'second' ]
+    assert collected.groupings['batch']['first'] is batches[2].groupings['batch']['first'] # later batches override earlier ones
+    assert [ state.data['x'] for state in batches[0].groupings['batch']['first'].states ] == [ 1, 2 ] # the batches aren't changed
+    assert list(batches[0].groupings['batch']) == [ 'first' ]
+
+def test_drain_stream_without_retained_states():
+    stream= funtool.state_collection.StateCollectionStream(iter([ batch([ 1 ], 'first') ]), False)
+    assert funtool.state_collection.drain_stream(stream).states == []
@@ -0,0 +1,56 @@
+import funtool.analysis
+import funtool.analysis_selector
+import funtool.lib.general
+import funtool.state_measure
+
+from tests import helpers
+from tests import measures
+
+
+def measure(name, measure_function, parameters=None, analysis_selectors=None, grouping_selectors=None, loaded_processes=None):
+    state_measure= funtool.state_measure.StateMeasure(name, 'tests.measures', measure_function, analysis_selectors, grouping_selectors, parameters or {})
+    return funtool.state_measure.state_measure_process(state_measure, loaded_processes or { 'analysis_selector': {} })
+
+def test_parallel_measure_matches_serial():
+    serial= helpers.state_collection(range(50))
+    parallel= helpers.state_collection(range(50))
+    measure('square', 'square')(serial, None, helpers.loggers)
+    measure('square', 'square', { 'parallel': { 'workers': 2, 'chunk_size': 7 } })(parallel, None, helpers.loggers)
+    assert [ dict(state.measures) for state in parallel.states ] == [ dict(state.measures) for state in serial.states ]
+
+def test_parallel_measure_keeps_the_original_states():
+    collection= helpers.state_collection(range(10))
+    original_states= list(collection.states)
+    measure('square', 'square', { 'parallel': { 'workers': 2 } })(collection, None, helpers.loggers)
+    assert all( state is original_state for state, original_state in zip(collection.states, original_states) )
+    assert original_states[3].measures['square'] == 9
+
+def test_parameters_are_resolved_once_for_every_state():
+    del measures.CALLS[:]
+    measure('recorded_parameters', 'recorded_parameters', { 'power': 2 })(helpers.state_collection(range(5)), { 'power': 3 }, helpers.loggers)
+    assert len(measures.CALLS) == 5 and all( parameters is measures.CALLS[0] for parameters in measures.CALLS )
+    assert measures.CALLS[0] == { 'power': 3 }
+
+def test_sorted_measure_measures_every_state():
+    collection= helpers.state_collection([ 3, 1, 2 ])
+    measure('square', 'square', { 'sort_by': [ { 'data': 'x' } ] })(collection, None, helpers.loggers)
+    assert [ state.measures['square'] for state in collection.states ] == [ 9, 1, 4 ]
+
+def test_selectors_see_measures_of_earlier_states():
+    selector= funtool.analysis_selector.AnalysisSelector('tests.measures', 'earlier_measured', {})
+    loaded_processes= { 'analysis_selector': { 'earlier': funtool.analysis.Process(selector, funtool.analysis_selector.analysis_selector_process(selector)) } }
+    collection= helpers.state_collection(range(4))
+    measure('earlier_count', 'earlier_count', analysis_selectors=[ 'earlier' ], loaded_processes=loaded_processes)(collection, None, helpers.loggers)
+    assert [ state.measures['earlier_count'] for state in collection.states ] == [ 0, 1, 2, 3 ]
+
+def test_cached_sort_is_dropped_when_a_sorted_key_is_written():
+    collection= helpers.state_collection(range(5))
+    for state in collection.states:
+        state.measures['rank']= -state.data['x']
+    sort_list= [ { 'measures': 'rank' } ]
+    assert [ state.id for state in funtool.lib.general.cached_sort_states(collection.states, sort_list) ] == [ '4', '3', '2', '1', '0' ]
+    for state in collection.states:
+        state.measures['rank']= state.data['x']
+    funtool.lib.general.invalidate_sorted_states(field_key='rank')
+    assert [ state.id for state in funtool.lib.general.cached_sort_states(collection.states, sort_list) ] == [ '0', '1', '2', '3', '4' ]
+    funtool.lib.general.invalidate_sorted_states()